@@ -1,37 +1,256 @@
-from flask import Flask, redirect, request, jsonify
-import pickle
-import xgboost as xgb
-from flasgger import Swagger
 import time
+
+# Reference point for the startup time report
+START_TIME = time.perf_counter()
+
+from flask import Flask, g, redirect, request, jsonify
+import hmac
+import json
+import logging
 import os
+import tempfile
+from registry import ModelPool, ModelRegistry, UnknownModel
+from shadow import ShadowScorer
+from drift import PSI_THRESHOLD, DriftMonitor
+from explain import Explainer, ExplainerBusy, ExplainerTimeout
+from batching import MicroBatcher
+import ratelimit
+from cache import PredictionCache, row_key
+from metrics import LATENCY_BUCKETS, STAGE_BUCKETS, Metrics
+from validation import ValidationError
+import numpy as np
+import wire
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='[%(asctime)s] [%(process)d] [%(levelname)s] %(message)s')
+logger = logging.getLogger('app')
 
 PORT = int(os.environ.get('PORT', 5000))
+MODEL_FILE = os.environ.get('MODEL_FILE', 'model_xgb_eta=0.1_score=1.206.model')
+# Seconds between checks for a replaced model file, 0 disables hot reload
+MODEL_CHECK_INTERVAL = float(os.environ.get('MODEL_CHECK_INTERVAL', 1.0))
+# Directory the workers share the model to serve and their state in, so a
+# reload reaches all of them. Computed before gunicorn forks, one per master
+MODEL_STATE_DIR = os.environ.get('MODEL_STATE_DIR') or os.path.join(
+    tempfile.gettempdir(), f'model-registry-{os.getpid()}')
+# Seconds /admin/reload waits for every worker to serve the new model
+RELOAD_TIMEOUT = float(os.environ.get('RELOAD_TIMEOUT', 5))
+# /admin/reload requires a matching X-Admin-Token header, and is refused when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Directory /admin/reload may load artifacts from, the one of MODEL_FILE by default
+MODEL_DIR = os.path.realpath(os.environ.get('MODEL_DIR')
+                             or os.path.dirname(os.path.abspath(MODEL_FILE)))
+# Largest number of records accepted by a single /predict/batch call
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 10000))
+# Milliseconds /predict waits to group concurrent requests, 0 disables micro batching
+MICRO_BATCH_WINDOW_MS = float(os.environ.get('MICRO_BATCH_WINDOW_MS', 0))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64))
+# Token bucket size and tokens per second granted to each client
+RATE_LIMIT_CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', 10))
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 3))
+# memory (this process), shared (all gunicorn workers) or redis (all replicas)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Clients tracked at once before the least recently seen are evicted
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 10000))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Comma separated API keys that get a bucket of their own, other clients
+# are limited by IP whatever X-API-Key they send
+API_KEYS = ratelimit.parse_api_keys(os.environ.get('API_KEYS'))
+# Set to 0 to skip the Swagger UI and the flasgger import, e.g. in production
+SWAGGER = os.environ.get('SWAGGER', '1') == '1'
+# xgboost, or numpy to walk the trees with NumPy (faster for single records)
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'xgboost')
+# Run a dummy prediction on each loaded model before it serves requests
+PREWARM = os.environ.get('PREWARM', '1') == '1'
+# More models served next to MODEL_FILE, picked per request by name:
+# `name=path,name=path`
+MODELS = dict(entry.split('=', 1) for entry in os.environ.get('MODELS', '').split(',') if entry)
+# Named models kept loaded, and their total size in MB (0 for no limit),
+# before the least recently used is unloaded
+MAX_LOADED_MODELS = int(os.environ.get('MAX_LOADED_MODELS', 4))
+MODEL_MEMORY_MB = float(os.environ.get('MODEL_MEMORY_MB', 0))
+# Name of a model in MODELS scored in the background on the default model's traffic
+SHADOW_MODEL = os.environ.get('SHADOW_MODEL')
+# Fraction of the requests scored by the shadow model
+SHADOW_SAMPLE_RATE = float(os.environ.get('SHADOW_SAMPLE_RATE', 1.0))
+# Largest request body after gzip/zstd decompression
+MAX_DECOMPRESSED_BYTES = int(os.environ.get('MAX_DECOMPRESSED_BYTES', 64 << 20))
+# Count the inputs of the default model to compare them with its training
+# data at /drift, when the artifact has a reference profile
+DRIFT_MONITORING = os.environ.get('DRIFT_MONITORING', '1') == '1'
+# Rows each worker buffers before adding them to the shared drift sketch
+DRIFT_BUFFER_ROWS = int(os.environ.get('DRIFT_BUFFER_ROWS', 256))
+# Explanations computed at once, and the XGBoost threads each one uses, so
+# /explain takes at most EXPLAIN_WORKERS * EXPLAIN_THREADS cores from /predict
+EXPLAIN_WORKERS = int(os.environ.get('EXPLAIN_WORKERS', 1))
+EXPLAIN_THREADS = int(os.environ.get('EXPLAIN_THREADS', 1))
+# Request threads of each gunicorn worker, see gunicorn.conf.py
+THREADS = int(os.environ.get('THREADS', 4))
+# Explanations waiting or running before /explain answers 503. A waiting
+# explanation holds a request thread, so they are capped below THREADS to
+# always leave a thread of the worker to /predict
+EXPLAIN_MAX_PENDING = max(1, min(int(os.environ.get('EXPLAIN_MAX_PENDING', THREADS - 1)),
+                                 THREADS - 1))
+# Longest wait for an explanation before /explain answers 504, 0 waits forever
+EXPLAIN_TIMEOUT_MS = float(os.environ.get('EXPLAIN_TIMEOUT_MS', 5000))
+# Predictions kept in the result cache, 0 disables it
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 0))
+# Seconds a cached prediction stays valid, 0 keeps it until evicted
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 300))
+# Explanations kept in their own cache, next to the prediction cache
+EXPLAIN_CACHE_SIZE = int(os.environ.get('EXPLAIN_CACHE_SIZE', PREDICTION_CACHE_SIZE))
+
+
+# Initialize the rate limiter, one token bucket per client
+limiter = ratelimit.create_backend(RATE_LIMIT_BACKEND, capacity=RATE_LIMIT_CAPACITY,
+                                   refill_rate=RATE_LIMIT_RATE, max_keys=RATE_LIMIT_MAX_KEYS,
+                                   redis_url=REDIS_URL)
+
+# Metrics shared by every worker, all label values are declared up front
+ENDPOINTS = ('index', 'predict', 'predict_batch', 'predict_raw', 'health', 'ready',
+             'model_info', 'model_features', 'models_info', 'explain', 'drift_report', 'cache_stats', 'batching_stats', 'reload_model',
+             'metrics_text', 'other')
+STATUSES = ('200', '302', '400', '403', '404', '405', '413', '415', '422', '429', '500', '503', '504',
+            'other')
+STAGES = ('validate', 'acquire', 'features', 'encode', 'cache', 'predict')
+
+metrics = Metrics()
+# Its _count series are the request counts by endpoint and status code
+REQUEST_LATENCY = metrics.histogram('http_request_duration_seconds',
+                                    'Request latency by endpoint and status code',
+                                    LATENCY_BUCKETS, {'endpoint': ENDPOINTS, 'status': STATUSES})
+STAGE_LATENCY = metrics.histogram('predict_stage_duration_seconds',
+                                  'Time spent in each stage of the prediction path',
+                                  STAGE_BUCKETS, {'stage': STAGES})
+RATE_LIMITED = metrics.counter('rate_limit_rejections_total',
+                               'Requests rejected by the rate limiter')
+# Requests admitted but never run, by the async server (asgi.py)
+REQUESTS_DROPPED = metrics.counter('requests_dropped_total',
+                                   'Requests refused or abandoned before a prediction',
+                                   {'reason': ('queue_full', 'deadline', 'disconnected')})
+MODEL_LOADS = metrics.counter('model_loads_total', 'Model loads and reloads by result',
+                              {'result': ('success', 'failure')})
+SHADOW_RESULTS = metrics.counter('shadow_comparisons_total',
+                                 'Requests compared with the shadow model, by result',
+                                 {'result': ('scored', 'dropped', 'failed')})
+SHADOW_LATENCY = metrics.histogram('shadow_predict_duration_seconds',
+                                   'Prediction time of the default and the shadow model on '
+                                   'the same rows', STAGE_BUCKETS,
+                                   {'model': ('primary', 'shadow')})
+SHADOW_DIFFERENCE = metrics.histogram('shadow_abs_difference',
+                                      'Absolute difference between the shadow and the '
+                                      'default prediction, per row',
+                                      (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+# Load the model once at startup, requests reuse the in memory copy
+imports_done = time.perf_counter()
+registry = ModelRegistry(MODEL_FILE, check_interval=MODEL_CHECK_INTERVAL, prewarm=PREWARM,
+                         on_load=lambda result: MODEL_LOADS.inc(result),
+                         engine=INFERENCE_ENGINE, state_dir=MODEL_STATE_DIR)
+registry.load()
+
+# Named models and the optional shadow model
+models = ModelPool(registry, MODELS, max_loaded=MAX_LOADED_MODELS,
+                   max_bytes=int(MODEL_MEMORY_MB * (1 << 20)), engine=INFERENCE_ENGINE,
+                   prewarm=PREWARM)
+
+
+def record_shadow(result, comparison=None):
+    SHADOW_RESULTS.inc(result)
+    if comparison is not None:
+        SHADOW_LATENCY.observe_many([(('primary',), comparison['primary_ms'] / 1000),
+                                     (('shadow',), comparison['shadow_ms'] / 1000)])
+        SHADOW_DIFFERENCE.observe_many(
+            [((), abs(a - b)) for a, b in zip(comparison['primary_predictions'],
+                                              comparison['shadow_predictions'])])
+
+
+shadow = None
+if SHADOW_MODEL:
+    if SHADOW_MODEL not in MODELS:
+        raise ValueError(f"SHADOW_MODEL {SHADOW_MODEL!r} is not one of MODELS")
+    shadow = ShadowScorer(models, SHADOW_MODEL, sample_rate=SHADOW_SAMPLE_RATE,
+                          on_result=record_shadow)
+
+# Input drift sketch, in shared memory so every worker adds to the same counts
+drift = None
+if DRIFT_MONITORING and registry.get().meta.get('profile'):
+    drift = DriftMonitor(registry.get().meta['profile'], buffer_rows=DRIFT_BUFFER_ROWS,
+                         shared=True)
+
+# Optional cache of predictions for repeated queries
+cache = None
+if PREDICTION_CACHE_SIZE > 0:
+    cache = PredictionCache(max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+
+# Tree SHAP explanations on their own bounded pool, with their own cache so
+# they don't count as prediction lookups
+explain_cache = None
+if EXPLAIN_CACHE_SIZE > 0:
+    explain_cache = PredictionCache(max_size=EXPLAIN_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+explainer = Explainer(explain_cache, workers=EXPLAIN_WORKERS, threads=EXPLAIN_THREADS,
+                      max_pending=EXPLAIN_MAX_PENDING)
+
+
+def predict_rows(loaded, X, use_cache=True, stages=None):
+    """Runs the model on encoded rows, serving repeated rows from the cache.
+
+    Args:
+        loaded (LoadedModel): Snapshot from the registry.
+        X (numpy.ndarray): Rows encoded by loaded.encoder.
+        use_cache (bool, optional): False skips the cache for this call.
+        stages (list, optional): Stage timings of the caller, this call's
+            are appended to them instead of being recorded right away.
+
+    Returns:
+        numpy.ndarray: One prediction per row.
+    """
+    if stages is None:
+        stages = []
+        predictions = predict_rows(loaded, X, use_cache, stages)
+        STAGE_LATENCY.observe_many(stages)
+        return predictions
+
+    if cache is None or not use_cache:
+        start = time.perf_counter()
+        predictions = loaded.predict(X)
+        stages.append((('predict',), time.perf_counter() - start))
+        return predictions
 
+    start = time.perf_counter()
+    keys = [row_key(row) for row in X]
+    predictions = np.empty(len(keys), dtype=np.float32)
 
-class TokenBucket:
-    def __init__(self, capacity, refill_rate):
-        self.capacity = capacity
-        self.tokens = capacity
-        self.refill_rate = refill_rate  # Tokens per second
-        self.last_refill = time.time()
+    missing = []
+    for i, key in enumerate(keys):
+        y = cache.get(loaded.version, key)
+        if y is None:
+            missing.append(i)
+        else:
+            predictions[i] = y
+    looked_up = time.perf_counter()
 
-    def refill(self):
-        now = time.time()
-        elapsed = now - self.last_refill
-        refill_amount = elapsed * self.refill_rate
-        self.tokens = min(self.capacity, self.tokens + refill_amount)
-        self.last_refill = now
+    if missing:
+        for i, y in zip(missing, loaded.predict(X[missing])):
+            predictions[i] = y
+            cache.put(loaded.version, keys[i], y)
 
-    def take_token(self):
-        self.refill()
-        if self.tokens >= 1:
-            self.tokens -= 1
-            return True
-        return False
+    stages.append((('cache',), looked_up - start))
+    stages.append((('predict',), time.perf_counter() - looked_up))
+    return predictions
 
 
-# Initialize the token bucket
-bucket = TokenBucket(capacity=10, refill_rate=3)
+def monitor_inputs(loaded, X):
+    """Counts rows answered by the default model in the drift sketch."""
+    profile = loaded.meta.get('profile')
+    if profile is not None:
+        drift.observe(X, profile)
+
+
+def compare_with_shadow(loaded, X, predictions, stages):
+    """Hands rows answered by the default model to the shadow scorer."""
+    seconds = sum(elapsed for (stage,), elapsed in stages if stage == 'predict')
+    shadow.submit(loaded, X, predictions, seconds)
 
 
 def predict_age(
@@ -103,52 +322,324 @@ def predict_age(
         'systolic': 151,
         'vision_sharpness': 0.2,
         'weight_(kg)': 86.18519686940489,
-    }
+    },
+    use_cache=True,
+    model=None,
 ):
     """Predicts age based on given human characteristics.
 
     Args:
         human (dict, optional): A dictionary containing human characteristics. Defaults to a predefined dictionary.
+        use_cache (bool, optional): False skips the prediction cache.
+        model (str, optional): Name of a model in MODELS, the default model if None.
 
     Returns:
         float: Predicted age.
-    """
 
-    input_file = 'model_xgb_eta=0.1_score=1.206.bin'
+    Raises:
+        ValidationError: If `human` doesn't match the model's features.
+        UnknownModel: If `model` isn't configured.
+    """
 
-    with open(input_file, 'rb') as f_in:
-        dv, model = pickle.load(f_in)
+    start = time.perf_counter()
+    loaded = models.get(model)
+    acquired = time.perf_counter()
 
     # most importante features related to age
     # bone_density_(g/cm²), vision_sharpness, hearing_ability_(db),
     # cognitive_function, cholesterol_level_(mg/dl), blood_glucose_level_(mg/dl),
     # diastolic, systolic, pulse_pressure
 
-    X = dv.transform(human)
+    X = loaded.validator.encode(human)
+    stages = [(('acquire',), acquired - start), (('encode',), time.perf_counter() - acquired)]
+
+    predictions = predict_rows(loaded, X, use_cache, stages)
+    STAGE_LATENCY.observe_many(stages)
+    if drift is not None and model is None:
+        monitor_inputs(loaded, X)
+    if shadow is not None and model is None:
+        compare_with_shadow(loaded, X, predictions, stages)
+    return predictions[0]
+
+
+def predict_age_batch(humans, use_cache=True, model=None):
+    """Predicts age for many records with a single model call.
+
+    Invalid records are skipped and reported instead of failing the batch.
+
+    Args:
+        humans (list): Dictionaries in the same format accepted by predict_age.
+        use_cache (bool, optional): False skips the prediction cache.
+        model (str, optional): Name of a model in MODELS, the default model if None.
+
+    Returns:
+        tuple: A list of predicted ages in input order (None for invalid
+            records) and a dict mapping the index of each invalid record to
+            its ValidationError.
+    """
+    start = time.perf_counter()
+    loaded = models.get(model)
+    acquired = time.perf_counter()
+
+    X, valid, errors = loaded.validator.encode_many(humans)
+    stages = [(('acquire',), acquired - start), (('encode',), time.perf_counter() - acquired)]
+
+    predictions = [None] * len(humans)
+    if not valid:
+        return predictions, errors
+
+    valid_predictions = predict_rows(loaded, X, use_cache, stages)
+    for i, y in zip(valid, valid_predictions):
+        predictions[i] = y
+    STAGE_LATENCY.observe_many(stages)
+    if drift is not None and model is None:
+        monitor_inputs(loaded, X)
+    if shadow is not None and model is None:
+        compare_with_shadow(loaded, X, valid_predictions, stages)
+
+    return predictions, errors
+
+
+def predict_age_raw(records, use_cache=True, model=None):
+    """Predicts age for records in the original dataset schema.
+
+    The engineered features are derived server side with the same code used
+    for training, so clients only send the raw columns of
+    `datasets/human_age_prediction.csv`. The age derived features
+    (`bone_density_decline_rate`, `hearing_age_interaction`) can't be
+    computed without the age, records must send them when the model uses
+    them.
+
+    Args:
+        records (list): Dictionaries with raw column names, e.g.
+            `{'Gender': 'Male', 'Blood Pressure (s/d)': '151/109', ...}`.
+        use_cache (bool, optional): False skips the prediction cache.
+        model (str, optional): Name of a model in MODELS, the default model if None.
+
+    Returns:
+        numpy.ndarray: Predicted ages in input order.
+
+    Raises:
+        MissingFeatures: If records lack age derived features of the model.
+    """
+    # pandas is only needed here, importing it lazily keeps startup fast
+    import pandas as pd
+    from features import check_age_derived, prepare_features
+
+    start = time.perf_counter()
+    loaded = models.get(model)
+    acquired = time.perf_counter()
+
+    df = prepare_features(pd.DataFrame.from_records(records))
+    check_age_derived(df, loaded.encoder.feature_names)
+    prepared = time.perf_counter()
+    X = loaded.encoder.encode_frame(df)
+    stages = [(('acquire',), acquired - start), (('features',), prepared - acquired),
+              (('encode',), time.perf_counter() - prepared)]
+
+    predictions = predict_rows(loaded, X, use_cache, stages)
+    STAGE_LATENCY.observe_many(stages)
+    if drift is not None and model is None:
+        monitor_inputs(loaded, X)
+    if shadow is not None and model is None:
+        compare_with_shadow(loaded, X, predictions, stages)
+    return predictions
+
+
+class TooManyRows(ValueError):
+    """A matrix request with more rows than the endpoint accepts."""
+
+
+def predict_age_matrix(rows, fmt=wire.JSON, use_cache=True, model=None, max_rows=None):
+    """Predicts age for rows already in the model's feature order.
+
+    Positional rows, Arrow columns and float32 buffers become the prediction
+    matrix directly, and are validated with array operations. Only invalid
+    rows are looked at one by one, to explain what is wrong with them.
+
+    Args:
+        rows: Positional rows (lists of numbers or None) for JSON and
+            MessagePack, the decompressed body for Arrow and float32.
+        fmt (str, optional): The request format, see wire.py.
+        use_cache (bool, optional): False skips the prediction cache.
+        model (str, optional): Name of a model in MODELS, the default model if None.
+        max_rows (int, optional): Most rows accepted.
+
+    Returns:
+        tuple: Float32 predictions in input order (NaN for invalid rows) and
+            a dict mapping the index of each invalid row to its ValidationError.
+
+    Raises:
+        ValueError: If the rows can't be read as the model's features.
+        TooManyRows: If there are more than `max_rows`.
+    """
+    start = time.perf_counter()
+    loaded = models.get(model)
+    acquired = time.perf_counter()
+
+    if fmt in wire.MATRIX_FORMATS:
+        X = wire.load_matrix(rows, fmt, loaded.encoder.feature_names)
+    else:
+        X = wire.rows_matrix(rows, loaded.encoder.n_features)
+    if max_rows is not None and len(X) > max_rows:
+        raise TooManyRows(f"{len(X)} rows sent, at most {max_rows} are accepted")
+    n_rows = len(X)
+    X, valid, errors = loaded.validator.check_matrix(X)
+    stages = [(('acquire',), acquired - start), (('encode',), time.perf_counter() - acquired)]
+
+    predictions = np.full(n_rows, np.nan, dtype=np.float32)
+    if len(valid):
+        predictions[valid] = valid_predictions = predict_rows(loaded, X, use_cache, stages)
+        STAGE_LATENCY.observe_many(stages)
+        if drift is not None and model is None:
+            monitor_inputs(loaded, X)
+        if shadow is not None and model is None:
+            compare_with_shadow(loaded, X, valid_predictions, stages)
+    return predictions, errors
+
+
+# Optional dynamic batching of concurrent /predict calls
+batcher = None
+if MICRO_BATCH_WINDOW_MS > 0:
+    batcher = MicroBatcher(predict_age_batch, window=MICRO_BATCH_WINDOW_MS / 1000,
+                           max_batch_size=MICRO_BATCH_MAX_SIZE)
+
+
+def requested_model(data):
+    # Clients pick a model with a `model` field in the body or an X-Model header
+    name = data.get('model') if isinstance(data, dict) else None
+    return name or request.headers.get('X-Model')
+
+
+def unknown_model(name):
+    return jsonify({"detail": f"Unknown model {name!r}, expected one of "
+                              f"{['default'] + sorted(MODELS)}"}), 404
+
+
+def cache_requested():
+    # Clients bypass the prediction cache with Cache-Control: no-cache or ?cache=false
+    return request.headers.get('Cache-Control') != 'no-cache' \
+        and request.args.get('cache') != 'false'
+
 
-    d = xgb.DMatrix(X, feature_names=list(dv.get_feature_names_out()))
+def request_body(silent=True):
+    """Format and content of a prediction request.
 
-    return model.predict(d)[0]
+    Plain JSON bodies are read by Flask like before, compressed bodies and
+    the other formats of wire.py are decoded here.
+
+    Args:
+        silent (bool, optional): False fails like `request.json` on plain
+            JSON bodies that aren't valid.
+
+    Returns:
+        tuple: The format and the parsed document, or the decompressed body
+            for Arrow and float32 requests.
+
+    Raises:
+        wire.UnsupportedFormat: For other content types and encodings.
+        ValueError: For bodies that can't be decoded.
+    """
+    fmt = wire.media_type(request.mimetype)
+    if fmt == wire.JSON and not request.content_encoding:
+        return fmt, request.get_json(silent=silent)
+    body = wire.decompress(request.get_data(), request.content_encoding,
+                           MAX_DECOMPRESSED_BYTES)
+    if fmt in wire.MATRIX_FORMATS:
+        return fmt, body
+    return fmt, wire.load_document(body, fmt)
+
+
+def respond(payload, status, fmt):
+    # JSON, or the same document in MessagePack for MessagePack requests
+    if fmt != wire.MSGPACK:
+        return jsonify(payload), status
+    body, mimetype = wire.dump(payload, fmt)
+    return app.response_class(body, status=status, mimetype=mimetype)
+
+
+def matrix_response(predictions, errors, fmt):
+    # Matrix formats answer in kind, the invalid rows are NaN (null in Arrow)
+    messages = {i: str(error) for i, error in errors.items()}
+    body, mimetype = wire.dump_predictions(predictions, messages, fmt)
+    return app.response_class(body, status=200, mimetype=mimetype,
+                              headers={'X-Errors': str(len(errors))})
+
+
+def parse_json_lines(body):
+    """Splits a JSON lines body into records.
+
+    Lines that aren't valid JSON are returned as ValueError instances so
+    they can be reported per row.
+    """
+    records = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as e:
+            records.append(ValueError(f"Invalid JSON: {e}"))
+    return records
 
 
 app = Flask(__name__)
 
 # Initialize Swagger
-swagger = Swagger(app)
+swagger = None
+if SWAGGER:
+    from flasgger import Swagger
+
+    swagger = Swagger(app)
 
 # Rate limiter middleware
 
 
+# Endpoints used by orchestrators and monitoring, never rate limited
+UNLIMITED_ENDPOINTS = {'health', 'ready', 'metrics_text'}
+
+
+def client_key():
+    # Clients sending a configured API key are limited per key, the rest per IP
+    return ratelimit.client_key(request.headers.get('X-API-Key'), request.remote_addr,
+                                API_KEYS)
+
+
 @app.before_request
 def rate_limiter():
-    if not bucket.take_token():
-        return jsonify({"detail": "Rate limit exceeded"}), 429
+    g.start = time.perf_counter()
+    if request.endpoint in UNLIMITED_ENDPOINTS:
+        return None
+    decision = limiter.take(client_key())
+    g.rate_limit = decision
+    if not decision.allowed:
+        RATE_LIMITED.inc()
+        return jsonify({"detail": "Rate limit exceeded"}), 429, decision.headers()
+
+
+@app.after_request
+def rate_limit_headers(response):
+    decision = g.get('rate_limit')
+    if decision is not None:
+        response.headers.update(decision.headers())
+    return response
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint if request.endpoint in ENDPOINTS else 'other'
+    status = str(response.status_code)
+    REQUEST_LATENCY.observe(time.perf_counter() - g.start, endpoint,
+                            status if status in STATUSES else 'other')
+    return response
 
 
 # Define Flask routes
 @app.route("/")
 def index():
     # Redirect to the Swagger UI
+    if swagger is None:
+        return redirect("/model")
     return redirect("/apidocs/")
 
 
@@ -157,6 +648,11 @@ def predict():
     """
     Predict age based on clinical history
     ---
+    consumes:
+      - application/json
+      - application/msgpack
+      - application/vnd.apache.arrow.stream
+      - application/octet-stream
     parameters:
       - name: query
         in: body
@@ -435,6 +931,15 @@ def predict():
                       type: number
                       description: Weight in kilograms.
                       example: 86.18519686940489
+            model:
+              type: string
+              description: Model to predict with, one of MODELS. The default
+                model when left out, the X-Model header works too.
+        description: The record by feature name, or as a list of values in
+          the order of /model/features (null for missing values). The same
+          document can be sent as MessagePack, and the row as an Arrow IPC
+          stream or little-endian float32 values, answered in kind. Bodies
+          may be gzip or zstd compressed (Content-Encoding).
     responses:
       200:
         description: Predicted age
@@ -444,12 +949,16 @@ def predict():
             answer:
               type: string
       400:
-        description: Bad request due to missing query parameter
+        description: Bad request due to a missing query or a record not matching the model features
         schema:
           type: object
           properties:
             detail:
               type: string
+      404:
+        description: Unknown model
+      415:
+        description: Unsupported content type or encoding
       429:
         description: Rate limit exceeded
         schema:
@@ -458,18 +967,691 @@ def predict():
             detail:
               type: string
     """
-    data = request.json
-    query = data.get('query')
+    start = time.perf_counter()
+    try:
+        fmt, data = request_body(silent=False)
+    except wire.UnsupportedFormat as e:
+        return jsonify({"detail": str(e)}), 415
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
+    if fmt in wire.MATRIX_FORMATS:
+        query = data
+    else:
+        query = data.get('query') if isinstance(data, dict) else None
 
     if not query:
-        return jsonify({"detail": "Query parameter is required"}), 400
+        return respond({"detail": "Query parameter is required"}, 400, fmt)
+    STAGE_LATENCY.observe(time.perf_counter() - start, 'validate')
 
+    model = requested_model(data)
     try:
-        answer = predict_age(query)
-        return ({"result": str(answer)}), 200
+        use_cache = cache_requested()
+        if fmt in wire.MATRIX_FORMATS or isinstance(query, list):
+            # One row in the model's feature order
+            predictions, errors = predict_age_matrix(query, fmt, use_cache=use_cache,
+                                                     model=model, max_rows=1)
+            if errors:
+                raise errors[0]
+            if fmt in wire.MATRIX_FORMATS:
+                return matrix_response(predictions, errors, fmt)
+            answer = predictions[0]
+        elif batcher is not None and use_cache and model is None:
+            answer = batcher.predict(query)
+        else:
+            answer = predict_age(query, use_cache=use_cache, model=model)
+        if fmt == wire.JSON:
+            return ({"result": str(answer)}), 200
+        return respond({"result": str(answer)}, 200, fmt)
+    except ValidationError as e:
+        return respond({"detail": str(e), "errors": e.errors}, 400, fmt)
+    except UnknownModel:
+        return unknown_model(model)
+    except ValueError as e:
+        return respond({"detail": str(e)}, 400, fmt)
     except Exception as e:
-        return jsonify({"detail": str(e)}), 500  # Handle unexpected errors
+        logger.exception('Prediction failed')
+        return respond({"detail": str(e)}, 500, fmt)  # Handle unexpected errors
+
+
+@app.route("/predict/batch", methods=['POST'])
+def predict_batch():
+    """
+    Predict age for many records in one call
+    ---
+    consumes:
+      - application/json
+      - application/x-ndjson
+      - application/msgpack
+      - application/vnd.apache.arrow.stream
+      - application/octet-stream
+    parameters:
+      - name: queries
+        in: body
+        required: true
+        description: Either an object with a `queries` list or a list of records.
+          JSON lines bodies (one record per line) are accepted with the
+          application/x-ndjson content type. Each record has the same keys as
+          the /predict query, or is a list of values in the order of
+          /model/features. MessagePack bodies hold the same documents. Arrow
+          IPC streams (a column per feature) and little-endian float32 rows
+          are answered with an Arrow `prediction`/`error` batch and float32
+          predictions, NaN for invalid rows, counted by the X-Errors header.
+          Bodies may be gzip or zstd compressed (Content-Encoding).
+        schema:
+          type: object
+          properties:
+            queries:
+              type: array
+              items:
+                type: object
+            model:
+              type: string
+              description: Model to predict with, see /predict.
+    responses:
+      200:
+        description: One entry per record in input order, with either a
+          `result` or a `detail` explaining why the record was rejected
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  result:
+                    type: string
+                  detail:
+                    type: string
+            errors:
+              type: integer
+      400:
+        description: Bad request due to a missing or malformed body
+      404:
+        description: Unknown model
+      413:
+        description: More records than MAX_BATCH_SIZE
+      415:
+        description: Unsupported content type or encoding
+      429:
+        description: Rate limit exceeded
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        fmt, data = wire.JSON, None
+        queries = parse_json_lines(request.get_data(as_text=True))
+    else:
+        try:
+            fmt, data = request_body()
+        except wire.UnsupportedFormat as e:
+            return jsonify({"detail": str(e)}), 415
+        except ValueError as e:
+            return jsonify({"detail": str(e)}), 400
+        queries = data.get('queries') if isinstance(data, dict) else data
+    model = requested_model(data)
+
+    if fmt in wire.MATRIX_FORMATS or (isinstance(queries, list) and queries
+                                      and all(isinstance(q, list) for q in queries)):
+        return predict_batch_matrix(queries, fmt, model)
+
+    if not isinstance(queries, list) or not queries:
+        return respond({"detail": "A non empty list of queries is required"}, 400, fmt)
+
+    if len(queries) > MAX_BATCH_SIZE:
+        return respond({"detail": f"Batch size exceeds the maximum of {MAX_BATCH_SIZE}"}, 413,
+                       fmt)
+
+    parse_errors = {i: str(q) for i, q in enumerate(queries) if isinstance(q, ValueError)}
+    if parse_errors:
+        queries = [{} if isinstance(q, ValueError) else q for q in queries]
+
+    try:
+        predictions, errors = predict_age_batch(queries, use_cache=cache_requested(),
+                                                model=model)
+    except UnknownModel:
+        return unknown_model(model)
+    except Exception as e:
+        logger.exception('Batch prediction failed')
+        return respond({"detail": str(e)}, 500, fmt)
+
+    errors.update(parse_errors)
+
+    results = []
+    for i, y in enumerate(predictions):
+        error = errors.get(i)
+        if error is None:
+            results.append({"result": str(y)})
+        elif isinstance(error, ValidationError):
+            results.append({"detail": str(error), "errors": error.errors})
+        else:
+            results.append({"detail": error})
+    return respond({"results": results, "errors": len(errors)}, 200, fmt)
+
+
+def predict_batch_matrix(rows, fmt, model):
+    """/predict/batch for positional rows, Arrow and float32 bodies."""
+    try:
+        predictions, errors = predict_age_matrix(rows, fmt, use_cache=cache_requested(),
+                                                 model=model, max_rows=MAX_BATCH_SIZE)
+    except UnknownModel:
+        return unknown_model(model)
+    except TooManyRows:
+        return respond({"detail": f"Batch size exceeds the maximum of {MAX_BATCH_SIZE}"}, 413,
+                       fmt)
+    except ValueError as e:
+        return respond({"detail": str(e)}, 400, fmt)
+    except Exception as e:
+        logger.exception('Batch prediction failed')
+        return respond({"detail": str(e)}, 500, fmt)
+
+    if fmt in wire.MATRIX_FORMATS:
+        return matrix_response(predictions, errors, fmt)
+    results = []
+    for i, y in enumerate(predictions):
+        error = errors.get(i)
+        if error is None:
+            results.append({"result": str(y)})
+        else:
+            results.append({"detail": str(error), "errors": error.errors})
+    return respond({"results": results, "errors": len(errors)}, 200, fmt)
+
+
+@app.route("/health")
+def health():
+    """
+    Liveness probe
+    ---
+    responses:
+      200:
+        description: The process is up
+    """
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/ready")
+def ready():
+    """
+    Readiness probe, only succeeds once the model is loaded
+    ---
+    responses:
+      200:
+        description: Ready to serve predictions
+      503:
+        description: The model isn't loaded yet
+    """
+    if not registry.ready():
+        return jsonify({"status": "loading"}), 503
+    return jsonify({"status": "ready", "version": registry.info()['version']}), 200
+
+
+@app.route("/model")
+def model_info():
+    """
+    Information about the model currently serving
+    ---
+    responses:
+      200:
+        description: Path, version and load time of the serving model, and
+          under `cluster` the model each worker serves
+        schema:
+          type: object
+    """
+    return jsonify({**registry.info(), "cluster": registry.cluster()}), 200
+
+
+@app.route("/model/features")
+def model_features():
+    """
+    Feature names of a model in column order, the order of positional rows
+    and float32 bodies
+    ---
+    parameters:
+      - name: model
+        in: query
+        type: string
+        required: false
+        description: Model name, the default model when left out
+    responses:
+      200:
+        description: The model version and its features
+        schema:
+          type: object
+      404:
+        description: Unknown model
+    """
+    name = request.args.get('model') or request.headers.get('X-Model')
+    try:
+        loaded = models.get(name)
+    except UnknownModel:
+        return unknown_model(name)
+    return jsonify({"version": loaded.version,
+                    "features": list(loaded.encoder.feature_names)}), 200
+
+
+@app.route("/models")
+def models_info():
+    """
+    Every configured model, whether it is loaded and its size, and the
+    shadow model's comparison statistics
+    ---
+    responses:
+      200:
+        description: The default model, the named models and the shadow stats
+        schema:
+          type: object
+    """
+    return jsonify({**models.info(),
+                    "shadow": shadow.stats() if shadow is not None else None}), 200
+
+
+@app.route("/predict/raw", methods=['POST'])
+def predict_raw():
+    """
+    Predict age from records in the original dataset schema
+    ---
+    parameters:
+      - name: queries
+        in: body
+        required: true
+        description: Records with the columns of datasets/human_age_prediction.csv
+          (without the age). Feature engineering happens on the server, except
+          for bone_density_decline_rate and hearing_age_interaction which are
+          computed from the age and must be sent when the model uses them.
+        schema:
+          type: object
+          properties:
+            queries:
+              type: array
+              items:
+                type: object
+              example:
+                - Gender: Male
+                  Height (cm): 171.14835857585234
+                  Weight (kg): 86.18519686940489
+                  Blood Pressure (s/d): 151/109
+                  Cholesterol Level (mg/dL): 259.46581350104714
+                  BMI: 29.423016908813725
+                  Blood Glucose Level (mg/dL): 157.65284793866718
+                  Bone Density (g/cm²): 0.13286827989647274
+                  Vision Sharpness: 0.2
+                  Hearing Ability (dB): 58.78619834245858
+                  Physical Activity Level: Moderate
+                  Smoking Status: Former
+                  Alcohol Consumption: null
+                  Diet: Low-carb
+                  Chronic Diseases: null
+                  Medication Use: null
+                  Family History: null
+                  Cognitive Function: 44.05917162252895
+                  Mental Health Status: Good
+                  Sleep Patterns: Insomnia
+                  Stress Levels: 2.7970640394252375
+                  Pollution Exposure: 5.142344384136116
+                  Sun Exposure: 7.108974826344509
+                  Education Level: null
+                  Income Level: Medium
+            model:
+              type: string
+              description: Model to predict with, see /predict.
+    responses:
+      200:
+        description: Predicted ages in input order
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: string
+      400:
+        description: Bad request due to a missing or malformed body
+      404:
+        description: Unknown model
+      422:
+        description: Records without the age derived features the model needs
+      429:
+        description: Rate limit exceeded
+    """
+    data = request.get_json(silent=True)
+    queries = data.get('queries') if isinstance(data, dict) else data
+    model = requested_model(data)
+
+    if not isinstance(queries, list) or not queries \
+            or not all(isinstance(q, dict) for q in queries):
+        return jsonify({"detail": "A non empty list of records is required"}), 400
+
+    if len(queries) > MAX_BATCH_SIZE:
+        return jsonify({"detail": f"Batch size exceeds the maximum of {MAX_BATCH_SIZE}"}), 413
+
+    # Imported here like pandas, it isn't needed by the other routes
+    from features import MissingFeatures
+
+    try:
+        predictions = predict_age_raw(queries, use_cache=cache_requested(), model=model)
+    except UnknownModel:
+        return unknown_model(model)
+    except MissingFeatures as e:
+        return jsonify({"detail": str(e), "features": e.features, "rows": e.rows}), 422
+    except Exception as e:
+        logger.exception('Raw prediction failed')
+        return jsonify({"detail": str(e)}), 500
+
+    return jsonify({"results": [str(y) for y in predictions]}), 200
+
+
+@app.route("/explain", methods=['POST'])
+def explain():
+    """
+    Why a record got its prediction: the contribution of each clinical field
+    (tree SHAP), one-hot columns summed back into the field they encode
+    ---
+    consumes:
+      - application/json
+      - application/msgpack
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: A `query` record like /predict takes, or a `queries`
+          list of them like /predict/batch.
+        schema:
+          type: object
+          properties:
+            query:
+              type: object
+            queries:
+              type: array
+              items:
+                type: object
+            top_k:
+              type: integer
+              description: Fields listed per record, by absolute contribution, 5 by default.
+            interactions:
+              type: boolean
+              description: Also list the strongest field pairs (SHAP interaction
+                values), much slower.
+            model:
+              type: string
+              description: Model to explain, see /predict.
+    responses:
+      200:
+        description: Per record the prediction, the base value (the average
+          prediction) and the top contributions with the record's value of
+          each field, which add up to the prediction with `other`. Batches
+          get one entry per record in input order, with a `detail` for the
+          rejected ones.
+        schema:
+          type: object
+      400:
+        description: Bad request due to a missing or malformed body
+      404:
+        description: Unknown model
+      413:
+        description: More records than MAX_BATCH_SIZE
+      415:
+        description: Unsupported content type or encoding
+      429:
+        description: Rate limit exceeded
+      503:
+        description: Too many explanations pending, retry later
+      504:
+        description: The explanation took longer than EXPLAIN_TIMEOUT_MS
+    """
+    try:
+        fmt, data = request_body()
+    except wire.UnsupportedFormat as e:
+        return jsonify({"detail": str(e)}), 415
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
+    if fmt in wire.MATRIX_FORMATS:
+        return jsonify({"detail": "/explain takes JSON or MessagePack records"}), 415
+    if not isinstance(data, dict) or not (isinstance(data.get('query'), dict)
+                                          or isinstance(data.get('queries'), list)):
+        return respond({"detail": "A query record or a list of queries is required"}, 400, fmt)
+
+    batched = 'queries' in data
+    queries = data['queries'] if batched else [data['query']]
+    if not queries:
+        return respond({"detail": "A non empty list of queries is required"}, 400, fmt)
+    if len(queries) > MAX_BATCH_SIZE:
+        return respond({"detail": f"Batch size exceeds the maximum of {MAX_BATCH_SIZE}"}, 413,
+                       fmt)
+    top_k = data.get('top_k', 5)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+        return respond({"detail": "top_k must be a positive integer"}, 400, fmt)
+
+    model = requested_model(data)
+    try:
+        loaded = models.get(model)
+    except UnknownModel:
+        return unknown_model(model)
+    X, valid, errors = loaded.validator.encode_many(
+        [q if isinstance(q, dict) else {} for q in queries])
+    for i, q in enumerate(queries):
+        if not isinstance(q, dict):
+            errors[i] = ValidationError([{'field': None, 'error': 'a query must be an object'}])
+
+    explanations = []
+    if len(X):
+        try:
+            explanations = explainer.explain(
+                loaded, X, top_k, interactions=bool(data.get('interactions')),
+                use_cache=cache_requested(), timeout=EXPLAIN_TIMEOUT_MS / 1000 or None)
+        except ExplainerBusy as e:
+            response = app.make_response(respond({"detail": str(e)}, 503, fmt))
+            response.headers['Retry-After'] = '1'
+            return response
+        except ExplainerTimeout as e:
+            return respond({"detail": str(e)}, 504, fmt)
+        except ValueError as e:
+            return respond({"detail": str(e)}, 400, fmt)
+        except Exception as e:
+            logger.exception('Explanation failed')
+            return respond({"detail": str(e)}, 500, fmt)
+
+    results = [None] * len(queries)
+    for i, explanation in zip(valid, explanations):
+        results[i] = explanation
+    for i, error in errors.items():
+        results[i] = {"detail": str(error), "errors": error.errors}
+    if not batched:
+        if errors:
+            return respond(results[0], 400, fmt)
+        return respond({"version": loaded.version, **results[0]}, 200, fmt)
+    return respond({"version": loaded.version, "results": results, "errors": len(errors)},
+                   200, fmt)
+
+
+@app.route("/drift")
+def drift_report():
+    """
+    Drift of the inputs of the default model from its training data
+    ---
+    parameters:
+      - name: threshold
+        in: query
+        type: number
+        required: false
+        description: PSI above which a feature is reported as drifted, 0.25 by default
+      - name: sketch
+        in: query
+        type: boolean
+        required: false
+        description: Also return the raw counts, to merge the sketches of
+          several replicas with `python drift.py merge`
+    responses:
+      200:
+        description: Rows counted, PSI, KS distance and missing rates per
+          feature, and the drifted features
+        schema:
+          type: object
+      404:
+        description: Drift monitoring is off or the model has no reference profile
+    """
+    if drift is None:
+        return jsonify({"detail": "Drift monitoring is off, set DRIFT_MONITORING=1 and serve "
+                                  "an artifact with a reference profile"}), 404
+    try:
+        threshold = float(request.args.get('threshold', PSI_THRESHOLD))
+    except ValueError:
+        return jsonify({"detail": "threshold must be a number"}), 400
+    report = {"version": registry.get().version, **drift.report(threshold)}
+    if request.args.get('sketch') in ('1', 'true'):
+        report['sketch'] = drift.to_dict()
+    return jsonify(report), 200
+
+
+@app.route("/cache")
+def cache_stats():
+    """
+    Prediction cache size and hit rate
+    ---
+    responses:
+      200:
+        description: Cache statistics, or enabled false when it is off, and
+          the statistics of the explanation cache under explanations
+        schema:
+          type: object
+    """
+    stats = {"enabled": False} if cache is None else {"enabled": True, **cache.stats()}
+    stats["explanations"] = {"enabled": False} if explain_cache is None \
+        else {"enabled": True, **explain_cache.stats()}
+    return jsonify(stats), 200
+
+
+@app.route("/batching")
+def batching_stats():
+    """
+    Micro batching queue depth and realized batch sizes
+    ---
+    responses:
+      200:
+        description: Batching statistics, or enabled false when it is off
+        schema:
+          type: object
+    """
+    if batcher is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **batcher.stats()}), 200
+
+
+@app.route("/metrics")
+def metrics_text():
+    """
+    Metrics in the Prometheus text format
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Request counts and latencies, prediction stage timings,
+          rate limiter rejections and model loads, summed over all workers
+    """
+    loaded = registry.get()
+    text = metrics.render() + (
+        '# HELP model_info Model currently serving in this worker\n'
+        '# TYPE model_info gauge\n'
+        f'model_info{{version="{loaded.version}"}} 1\n'
+    )
+    return text, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def admin_authorized():
+    # Constant time comparison, so the token can't be guessed from response times
+    token = request.headers.get('X-Admin-Token', '')
+    return ADMIN_TOKEN is not None \
+        and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def reload_path(path):
+    """Checks an artifact path sent to /admin/reload.
+
+    Client supplied paths must be native artifacts in MODEL_DIR or one of
+    the configured models. Pickled `.bin` files are never loaded from
+    them, unpickling can run arbitrary code.
+
+    Raises:
+        ValueError: If the path isn't allowed.
+    """
+    from artifact import is_artifact
+
+    if not isinstance(path, str) or not path:
+        raise ValueError("path must be a non empty string")
+    real = os.path.realpath(path)
+    configured = {os.path.realpath(p) for p in (MODEL_FILE, *MODELS.values())}
+    if os.path.commonpath([real, MODEL_DIR]) != MODEL_DIR and real not in configured:
+        raise ValueError(f"Only artifacts in {MODEL_DIR} can be loaded")
+    if not is_artifact(real):
+        raise ValueError(f"{path} isn't a native model artifact")
+    return path
+
+
+@app.route("/admin/reload", methods=['POST'])
+def reload_model():
+    """
+    Reload the model in every worker, optionally switching to another artifact
+    ---
+    parameters:
+      - name: X-Admin-Token
+        in: header
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            path:
+              type: string
+              description: Native artifact to load, in MODEL_DIR or one of the
+                configured models. Defaults to the serving one.
+    responses:
+      200:
+        description: The model now serving, the model each worker serves
+          and whether they all switched within RELOAD_TIMEOUT
+      400:
+        description: The path isn't an artifact /admin/reload may load
+      403:
+        description: Missing or wrong admin token, or ADMIN_TOKEN isn't set
+      500:
+        description: Loading failed, the previous model keeps serving
+    """
+    if not admin_authorized():
+        return jsonify({"detail": "Forbidden"}), 403
+
+    data = request.get_json(silent=True) or {}
+    path = data.get('path') if isinstance(data, dict) else None
+
+    try:
+        if path is not None:
+            path = reload_path(path)
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
+
+    try:
+        registry.publish(path)
+    except Exception as e:
+        return jsonify({"detail": str(e)}), 500
+
+    # The other workers follow on their next check
+    deadline = time.monotonic() + RELOAD_TIMEOUT
+    while True:
+        cluster = registry.cluster()
+        converged = all(worker['generation'] == registry.generation
+                        for worker in cluster['workers'])
+        if converged or time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    return jsonify({**registry.info(), "cluster": cluster, "converged": converged}), 200
+
+
+loaded = registry.get()
+logger.info('Ready to serve model %s in %.0f ms (imports %.0f ms, model load %.1f ms, prewarm %.1f ms)',
+            loaded.version, (time.perf_counter() - START_TIME) * 1000,
+            (imports_done - START_TIME) * 1000, loaded.load_time * 1000,
+            loaded.warm_up_time * 1000)
 
 
 if __name__ == '__main__':
+    registry.start_watching()
     app.run(debug=True, host='0.0.0.0', port=PORT)
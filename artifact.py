@@ -0,0 +1,278 @@
+# Native model artifact: a directory that loads without pickle or sklearn.
+#
+#     model_xgb_eta=0.1_score=1.206.model/
+#         booster.ubj    XGBoost's own UBJSON model format
+#         features.npy   Feature vocabulary in column order, memory mappable
+#         meta.json      Format version, metrics, params, training data hash and
+#                        the reference profile of drift.py
+#         trees.npz      The trees as flat arrays for the NumPy engine (trees.py)
+#
+# Usage:
+#     python artifact.py convert model_xgb_eta=0.1_score=1.206.bin
+#     python artifact.py bench model_xgb_eta=0.1_score=1.206.bin model_xgb_eta=0.1_score=1.206.model
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from encoder import CompiledEncoder
+from trees import TreeEnsemble
+
+FORMAT = 'age-model'
+FORMAT_VERSION = 1
+
+BOOSTER_FILE = 'booster.ubj'
+FEATURES_FILE = 'features.npy'
+META_FILE = 'meta.json'
+TREES_FILE = 'trees.npz'
+
+# How models are evaluated: xgboost (the Booster) or numpy (trees.py)
+ENGINES = ('xgboost', 'numpy')
+
+
+def is_artifact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+
+def stamp_path(path):
+    """File whose modification time changes when the artifact is replaced.
+
+    meta.json is written last, so a changed stamp means the rest is in place.
+    """
+    return os.path.join(path, META_FILE) if os.path.isdir(path) else path
+
+
+# Bytes before the end of the training data hashed to recognize it later
+TAIL_BYTES = 1 << 20
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tail_hash(path, size):
+    """sha256 of the last TAIL_BYTES bytes of the first `size` bytes of a file."""
+    with open(path, 'rb') as f_in:
+        f_in.seek(max(0, size - TAIL_BYTES))
+        return hashlib.sha256(f_in.read(min(size, TAIL_BYTES))).hexdigest()
+
+
+def data_stamp(path, chunk_size=1 << 20):
+    """Identifies a training CSV: its hash, size, rows and the hash of its tail.
+
+    The size and tail hash let incremental.py find the rows appended since
+    training without reading the whole file again.
+    """
+    digest = hashlib.sha256()
+    size, newlines, last = 0, 0, b''
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            newlines += chunk.count(b'\n')
+            last = chunk
+    lines = newlines + (1 if last and not last.endswith(b'\n') else 0)
+    return {
+        'path': path,
+        'sha256': digest.hexdigest(),
+        'size': size,
+        'rows': max(lines - 1, 0),  # Without the header
+        'tail_sha256': tail_hash(path, size),
+    }
+
+
+def save_artifact(path, feature_names, model, metrics=None, params=None,
+                  data_file=None, separator='=', **extra):
+    """Writes a native artifact directory.
+
+    The files are written to a temporary directory first and moved into
+    place at the end, so a server watching `path` never loads half of it.
+
+    Args:
+        path (str): Directory to create, e.g. `model_xgb_eta=0.1_score=1.206.model`.
+        feature_names (list): Vocabulary in the model's column order.
+        model (xgboost.Booster): Trained model.
+        metrics (dict, optional): Evaluation metrics to record.
+        params (dict, optional): Training parameters to record.
+        data_file (str, optional): Training data, its hash, size and rows
+            are recorded.
+        separator (str, optional): One-hot separator of the vocabulary.
+        **extra: More JSON serializable fields for the metadata.
+    """
+    import xgboost as xgb
+
+    tmp = f'{path}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    model.save_model(os.path.join(tmp, BOOSTER_FILE))
+    try:
+        TreeEnsemble.from_booster(model).save(os.path.join(tmp, TREES_FILE))
+    except ValueError:
+        pass  # Only served by XGBoost
+    np.save(os.path.join(tmp, FEATURES_FILE), np.array(feature_names, dtype=str))
+
+    meta = {
+        'format': FORMAT,
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'xgboost_version': xgb.__version__,
+        'n_features': len(feature_names),
+        'separator': separator,
+        'num_boosted_rounds': model.num_boosted_rounds(),
+        'metrics': {k: float(v) for k, v in (metrics or {}).items()},
+        'params': params or {},
+        **extra,
+    }
+    if data_file is not None:
+        meta['training_data'] = data_stamp(data_file)
+
+    with open(os.path.join(tmp, META_FILE), 'w') as f_out:
+        json.dump(meta, f_out, indent=2, sort_keys=True)
+
+    if os.path.exists(path):
+        old = f'{path}.old'
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, path)
+
+    return path
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE)) as f_in:
+        meta = json.load(f_in)
+    if meta.get('format') != FORMAT or meta.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"{path} is not a supported model artifact")
+    return meta
+
+
+def load_artifact(path, engine='xgboost'):
+    """Loads a native artifact.
+
+    Args:
+        path (str): Artifact directory.
+        engine (str, optional): `xgboost` loads the Booster, `numpy` the
+            exported trees, without importing xgboost when the artifact
+            has them.
+
+    Returns:
+        tuple: The CompiledEncoder, the Booster or TreeEnsemble and the
+            metadata dict.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine {engine!r}, expected one of {ENGINES}")
+    meta = read_meta(path)
+
+    feature_names = np.load(os.path.join(path, FEATURES_FILE), mmap_mode='r')
+    encoder = CompiledEncoder(feature_names.tolist(), separator=meta.get('separator', '='))
+
+    trees_file = os.path.join(path, TREES_FILE)
+    if engine == 'numpy' and os.path.exists(trees_file):
+        model = TreeEnsemble.load(trees_file)
+    else:
+        import xgboost as xgb
+
+        model = xgb.Booster()
+        model.load_model(os.path.join(path, BOOSTER_FILE))
+        if engine == 'numpy':
+            # Artifacts saved before trees.npz existed
+            model = TreeEnsemble.from_booster(model)
+    encoder.check_model(model)
+
+    return encoder, model, meta
+
+
+def artifact_version(path):
+    """Content hash identifying an artifact, like the pickle file hash."""
+    digest = hashlib.sha256()
+    for name in (META_FILE, FEATURES_FILE, BOOSTER_FILE):
+        digest.update(file_hash(os.path.join(path, name)).encode())
+    return digest.hexdigest()[:12]
+
+
+def convert(pickle_file, path=None):
+    """Converts a pickled `(dv, model)` file into a native artifact."""
+    import pickle
+
+    with open(pickle_file, 'rb') as f_in:
+        dv, model = pickle.load(f_in)
+
+    path = path or os.path.splitext(pickle_file)[0] + '.model'
+    return save_artifact(path, dv.feature_names_, model, separator=dv.separator,
+                         converted_from=os.path.basename(pickle_file))
+
+
+_BENCH_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+from registry import load_model
+loaded = load_model(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'load_seconds': loaded.load_time,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'sklearn_imported': 'sklearn' in sys.modules,
+}))
+"""
+
+
+def bench(paths, repeat=5):
+    """Cold loads each artifact in fresh processes and reports time and peak RSS."""
+    import statistics
+    import subprocess
+    import sys
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for path in paths:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-W', 'ignore', '-c', _BENCH_SCRIPT, path],
+                                 cwd=here, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        results[path] = {
+            'cold_start_s': statistics.median(r['seconds'] for r in runs),
+            'load_s': statistics.median(r['load_seconds'] for r in runs),
+            'max_rss_mb': statistics.median(r['max_rss_mb'] for r in runs),
+            'sklearn_imported': runs[0]['sklearn_imported'],
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert and benchmark model artifacts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = commands.add_parser('convert', help='convert a pickled .bin file')
+    convert_parser.add_argument('input')
+    convert_parser.add_argument('output', nargs='?')
+
+    bench_parser = commands.add_parser('bench', help='compare cold load time and RSS')
+    bench_parser.add_argument('paths', nargs='+')
+    bench_parser.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        print(f"the model is saved to {convert(args.input, args.output)}")
+    else:
+        for path, result in bench(args.paths, args.repeat).items():
+            print(f"{path}: cold start {result['cold_start_s'] * 1000:.0f} ms, "
+                  f"load {result['load_s'] * 1000:.1f} ms, "
+                  f"max RSS {result['max_rss_mb']:.0f} MB, "
+                  f"sklearn imported: {result['sklearn_imported']}")
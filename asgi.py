@@ -0,0 +1,340 @@
+# Asyncio serving mode: an ASGI app with the same /predict contract as app.py.
+#
+# /predict is handled on the event loop and the model runs on a bounded
+# thread pool (XGBoost releases the GIL while predicting), so one process
+# overlaps reading requests with predictions on several cores. Requests
+# beyond MAX_IN_FLIGHT are refused with a 503 instead of queueing, each one
+# has a deadline, and work for clients that disconnected is cancelled.
+# Every other route, the Swagger UI included, is served by the Flask app.
+#
+# Usage, with uvicorn from the `async` extra (poetry install --extras async):
+#     uvicorn asgi:app --host 0.0.0.0 --port 5000
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as flask_app
+from ratelimit import client_key
+from registry import UnknownModel
+from validation import ValidationError
+
+logger = logging.getLogger('asgi')
+
+# Threads running predictions, defaults to one per core
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', os.cpu_count()))
+# Requests admitted at once, running or waiting for a thread. The rest get a 503
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 64))
+# Milliseconds a /predict request may take before failing with a 504. Clients
+# can ask for less with the X-Request-Timeout-Ms header
+REQUEST_TIMEOUT_MS = float(os.environ.get('REQUEST_TIMEOUT_MS', 1000))
+# Largest /predict body accepted
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 1 << 20))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def read_body(receive, limit):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    # After the body, the next message is the disconnect
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode()
+    raw_headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode())]
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def wsgi_environ(scope, body):
+    """Builds the PEP 3333 environ of an ASGI http request."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+        elif f'HTTP_{name}' in environ:
+            environ[f'HTTP_{name}'] += f',{value}'
+        else:
+            environ[f'HTTP_{name}'] = value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Runs a WSGI app to completion, returns the status, headers and body."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return response['status'], response['headers'], body
+
+
+def is_plain_json(scope):
+    """Uncompressed JSON requests are served here, the other wire formats by Flask."""
+    for name, value in scope['headers']:
+        if name == b'content-encoding' and value.strip().lower() != b'identity':
+            return False
+        if name == b'content-type' and value.split(b';')[0].strip().lower() \
+                not in (b'application/json', b''):
+            return False
+    return True
+
+
+def run_prediction(query, use_cache, deadline, model=None):
+    """Runs on the thread pool. Requests that waited past their deadline in
+    the pool's queue are dropped without running the model."""
+    if time.monotonic() > deadline:
+        raise DeadlineExceeded()
+    if isinstance(query, list):
+        predictions, errors = flask_app.predict_age_matrix(query, use_cache=use_cache,
+                                                           model=model, max_rows=1)
+        if errors:
+            raise errors[0]
+        return predictions[0]
+    if flask_app.batcher is not None and use_cache and model is None:
+        return flask_app.batcher.predict(query)
+    return flask_app.predict_age(query, use_cache=use_cache, model=model)
+
+
+class AsyncPredictServer:
+    """ASGI app serving /predict itself and everything else through Flask.
+
+    Args:
+        wsgi_app: The Flask app for the other routes.
+        threads (int): Size of the prediction thread pool.
+        max_in_flight (int): Requests admitted at once before answering 503.
+        timeout (float): Seconds a prediction may take before answering 504.
+        max_body_bytes (int): Largest request body accepted.
+    """
+
+    def __init__(self, wsgi_app, threads=INFERENCE_THREADS, max_in_flight=MAX_IN_FLIGHT,
+                 timeout=REQUEST_TIMEOUT_MS / 1000, max_body_bytes=MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='predict')
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/predict' \
+                and scope['method'] == 'POST' and is_plain_json(scope):
+            start = time.perf_counter()
+            status = await self.predict(scope, receive, send)
+            if status is not None:
+                code = str(status)
+                flask_app.REQUEST_LATENCY.observe(
+                    time.perf_counter() - start, 'predict',
+                    code if code in flask_app.STATUSES else 'other')
+        elif scope['type'] == 'http':
+            await self.fallback(scope, receive, send)
+
+    async def fallback(self, scope, receive, send):
+        """Serves the request with the Flask app, on the loop's default thread pool."""
+        try:
+            body = await read_body(receive, float('inf'))
+        except ClientDisconnected:
+            return
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            None, call_wsgi, self.wsgi_app, wsgi_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # In the serving process, follows reloads published by the others
+                flask_app.registry.start_watching()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Let running predictions finish
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _release(self, _future=None):
+        self.in_flight -= 1
+
+    async def predict(self, scope, receive, send):
+        """Handles POST /predict, returns the status sent (None if the client left)."""
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1')
+                   for k, v in scope['headers']}
+
+        client = scope.get('client') or ('', 0)
+        decision = flask_app.limiter.take(
+            client_key(headers.get('x-api-key'), client[0], flask_app.API_KEYS))
+        rate_headers = decision.headers()
+        if not decision.allowed:
+            flask_app.RATE_LIMITED.inc()
+            await send_json(send, 429, {"detail": "Rate limit exceeded"}, rate_headers)
+            return 429
+
+        if self.in_flight >= self.max_in_flight:
+            flask_app.REQUESTS_DROPPED.inc('queue_full')
+            await send_json(send, 503, {"detail": f"Server busy: {self.in_flight} requests "
+                                                  "in flight, retry later"},
+                            {**rate_headers, 'Retry-After': '1'})
+            return 503
+
+        self.in_flight += 1
+        released = False
+        try:
+            try:
+                body = await read_body(receive, self.max_body_bytes)
+            except ClientDisconnected:
+                flask_app.REQUESTS_DROPPED.inc('disconnected')
+                return None
+            except BodyTooLarge:
+                await send_json(send, 413, {"detail": "Request body too large"}, rate_headers)
+                return 413
+
+            validation_start = time.perf_counter()
+            try:
+                data = json.loads(body)
+            except ValueError:
+                await send_json(send, 400, {"detail": "Invalid JSON body"}, rate_headers)
+                return 400
+            query = data.get('query') if isinstance(data, dict) else None
+            if not query:
+                await send_json(send, 400, {"detail": "Query parameter is required"},
+                                rate_headers)
+                return 400
+            flask_app.STAGE_LATENCY.observe(time.perf_counter() - validation_start, 'validate')
+
+            timeout = self.timeout
+            if 'x-request-timeout-ms' in headers:
+                try:
+                    timeout = min(timeout, float(headers['x-request-timeout-ms']) / 1000)
+                except ValueError:
+                    pass
+            deadline = time.monotonic() + timeout
+
+            args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+            use_cache = headers.get('cache-control') != 'no-cache' \
+                and args.get('cache', [''])[0] != 'false'
+
+            model = data.get('model') or headers.get('x-model')
+            work = self.executor.submit(run_prediction, query, use_cache, deadline, model)
+            # The slot is freed when the thread is done (or the work was
+            # cancelled before starting), not when the response is sent
+            loop = asyncio.get_running_loop()
+            work.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release))
+            released = True
+
+            future = asyncio.wrap_future(work)
+            disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+            done, _ = await asyncio.wait({future, disconnect}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            disconnect.cancel()
+
+            if future not in done:
+                future.cancel()  # Only stops work that hasn't started
+                if disconnect in done:
+                    flask_app.REQUESTS_DROPPED.inc('disconnected')
+                    return None
+                flask_app.REQUESTS_DROPPED.inc('deadline')
+                await send_json(send, 504, {"detail": "Deadline exceeded"}, rate_headers)
+                return 504
+
+            try:
+                answer = future.result()
+            except DeadlineExceeded:
+                flask_app.REQUESTS_DROPPED.inc('deadline')
+                await send_json(send, 504, {"detail": "Deadline exceeded"}, rate_headers)
+                return 504
+            except ValidationError as e:
+                await send_json(send, 400, {"detail": str(e), "errors": e.errors}, rate_headers)
+                return 400
+            except ValueError as e:
+                await send_json(send, 400, {"detail": str(e)}, rate_headers)
+                return 400
+            except UnknownModel:
+                await send_json(send, 404, {"detail": f"Unknown model {model!r}, expected one of "
+                                                      f"{['default'] + sorted(flask_app.MODELS)}"},
+                                rate_headers)
+                return 404
+            except Exception as e:
+                logger.exception('Prediction failed')
+                await send_json(send, 500, {"detail": str(e)}, rate_headers)
+                return 500
+
+            await send_json(send, 200, {"result": str(answer)}, rate_headers)
+            return 200
+        finally:
+            if not released:
+                self._release()
+
+
+app = AsyncPredictServer(flask_app.app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=flask_app.PORT)
@@ -0,0 +1,117 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Groups concurrent single record predictions into one model call.
+
+    Callers submit a record and block on a Future. A background thread takes
+    the first waiting record, keeps collecting for up to `window` seconds or
+    until `max_batch_size` records arrived, then scores them all with one
+    call to `predict_batch` and hands each caller its own result.
+    """
+
+    def __init__(self, predict_batch, window=0.002, max_batch_size=64):
+        """
+        Args:
+            predict_batch (callable): Takes a list of records and returns a
+                list of predictions plus a dict of per index errors (messages
+                or exceptions), like app.predict_age_batch.
+            window (float): Seconds to wait for more records after the first one.
+            max_batch_size (int): Records that trigger an immediate flush.
+        """
+        self.predict_batch = predict_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.records = 0
+        self.max_seen = 0
+        self.batch_sizes = {}  # Realized batch size -> number of batches
+
+    def start(self):
+        # Started lazily so the thread is created in the serving process,
+        # not in a parent that forks workers afterwards
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, record):
+        """Queues `record` and returns a Future with its prediction."""
+        if self._thread is None:
+            self.start()
+        future = Future()
+        self._queue.put((record, future))
+        return future
+
+    def predict(self, record, timeout=None):
+        """Blocking version of `submit`."""
+        return self.submit(record).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window is over, still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            records = [record for record, _ in batch]
+
+            try:
+                predictions, errors = self.predict_batch(records)
+            except Exception as e:
+                logger.exception('Micro batch of %d records failed', len(batch))
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._record(len(batch))
+
+            for i, (_, future) in enumerate(batch):
+                if i in errors:
+                    error = errors[i]
+                    future.set_exception(
+                        error if isinstance(error, Exception) else ValueError(error))
+                else:
+                    future.set_result(predictions[i])
+
+    def _record(self, size):
+        self.batches += 1
+        self.records += size
+        self.max_seen = max(self.max_seen, size)
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'records': self.records,
+            'mean_batch_size': self.records / self.batches if self.batches else 0.0,
+            'largest_batch': self.max_seen,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+        }
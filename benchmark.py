@@ -0,0 +1,339 @@
+# Latency and throughput benchmarks of the inference path, no network needed.
+#
+#     micro  Encoding, DMatrix construction and prediction (XGBoost and the
+#            NumPy trees) at batch sizes 1..100k
+#     http   /predict and /predict/batch through Flask's test client at fixed
+#            concurrency levels
+#     train  train.py on datasets resampled from datasets/ to larger sizes
+#
+# Usage:
+#     python benchmark.py run --output baseline.json
+#     python benchmark.py run --tiers micro http --output current.json
+#     python benchmark.py compare baseline.json current.json --threshold 0.1
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DATA_FILE = os.path.join('datasets', 'modified_human_age_prediction.csv')
+RAW_DATA_FILE = os.path.join('datasets', 'human_age_prediction.csv')
+PICKLE_FILE = 'model_xgb_eta=0.1_score=1.206.bin'
+
+BATCH_SIZES = [1, 10, 100, 1000, 10000, 100000]
+CONCURRENCY = [1, 4, 16]
+TRAIN_SCALES = [1, 4, 16]
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def summarize(samples, rows=1):
+    """Latency percentiles in milliseconds and throughput of a list of timings.
+
+    Args:
+        samples (list): Seconds taken by each call.
+        rows (int, optional): Records processed by each call.
+    """
+    mean = statistics.fmean(samples)
+    return {
+        'n': len(samples),
+        'rows': rows,
+        'mean_ms': mean * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'rows_per_s': rows / mean if mean else 0.0,
+    }
+
+
+def measure(fn, min_time=0.5, min_runs=5, max_runs=10000):
+    """Calls `fn` after one warm-up call until `min_time` seconds or `max_runs` calls."""
+    fn()
+    samples = []
+    total = 0.0
+    while len(samples) < max_runs and (len(samples) < min_runs or total < min_time):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed)
+        total += elapsed
+    return samples
+
+
+def load_records(n, seed=1):
+    """`n` records of the modified dataset, resampled when n is larger than it."""
+    df = pd.read_csv(DATA_FILE).drop(columns='age_(years)')
+    rng = np.random.default_rng(seed)
+    return df.iloc[rng.integers(0, len(df), n)].reset_index(drop=True)
+
+
+def run_micro(batch_sizes=BATCH_SIZES, min_time=0.5):
+    """Encoding, DMatrix and prediction costs per batch size."""
+    import pickle
+
+    import xgboost as xgb
+
+    from encoder import CompiledEncoder
+    from ratelimit import MemoryBackend
+    from trees import TreeEnsemble
+
+    with open(PICKLE_FILE, 'rb') as f_in:
+        dv, model = pickle.load(f_in)
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    trees = TreeEnsemble.from_booster(model)
+    feature_names = list(dv.get_feature_names_out())
+
+    frame = load_records(max(batch_sizes))
+    results = {}
+    for size in batch_sizes:
+        df = frame.iloc[:size]
+        records = df.to_dict(orient='records')
+        X_sparse = dv.transform(records)
+        X_dense = encoder.encode_many(records)
+
+        # Booster.predict caches the predictions of a DMatrix it has seen, so
+        # the DMatrix is built on every call and predict/dmatrix includes
+        # dmatrix/sparse
+        cases = {
+            'encode/dictvectorizer': lambda: dv.transform(records),
+            'encode/compiled': lambda: encoder.encode_many(records),
+            'encode/frame': lambda: encoder.encode_frame(df),
+            'dmatrix/sparse': lambda: xgb.DMatrix(X_sparse, feature_names=feature_names),
+            'predict/dmatrix': lambda: model.predict(
+                xgb.DMatrix(X_sparse, feature_names=feature_names)),
+            'predict/inplace': lambda: model.inplace_predict(X_dense),
+            'predict/numpy': lambda: trees.predict(X_dense),
+            'end_to_end/dictvectorizer': lambda: model.predict(
+                xgb.DMatrix(dv.transform(records), feature_names=feature_names)),
+            'end_to_end/compiled': lambda: model.inplace_predict(encoder.encode_many(records)),
+            'end_to_end/numpy': lambda: trees.predict(encoder.encode_many(records)),
+        }
+        for name, fn in cases.items():
+            results[f'micro/{name}/{size}'] = summarize(measure(fn, min_time), size)
+            print(f"micro/{name}/{size}: p50 {results[f'micro/{name}/{size}']['p50_ms']:.3f} ms")
+
+    limiter = MemoryBackend(capacity=1e9, refill_rate=1e9)
+    results['micro/ratelimit/memory/1'] = summarize(
+        measure(lambda: limiter.take('client'), min_time), 1)
+    return results
+
+
+def run_http(concurrency=CONCURRENCY, requests_per_client=200, batch_size=100):
+    """Requests through the Flask app in this process, one thread per client."""
+    # Keep the rate limiter and the docs out of the measurement
+    os.environ.setdefault('RATE_LIMIT_CAPACITY', '1e9')
+    os.environ.setdefault('RATE_LIMIT_RATE', '1e9')
+    os.environ.setdefault('SWAGGER', '0')
+    os.environ.setdefault('MODEL_CHECK_INTERVAL', '0')
+    from app import STAGE_LATENCY, STAGES, app, registry
+
+    df = load_records(batch_size)
+    records = df.to_dict(orient='records')
+    X = registry.get().encoder.encode_frame(df)
+    float32 = {'data': X.astype('<f4').tobytes(), 'content_type': 'application/octet-stream'}
+    cases = {
+        'predict': ('/predict', {'json': {'query': records[0]}}, 1),
+        f'predict_batch_{batch_size}': ('/predict/batch', {'json': {'queries': records}},
+                                        batch_size),
+        f'predict_batch_{batch_size}_float32': ('/predict/batch', float32, batch_size),
+    }
+
+    results = {}
+    for name, (url, request_args, rows) in cases.items():
+        for clients in concurrency:
+            samples, errors = [], []
+            lock = threading.Lock()
+
+            def client():
+                local = []
+                with app.test_client() as http:
+                    for _ in range(requests_per_client):
+                        start = time.perf_counter()
+                        response = http.post(url, **request_args)
+                        local.append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            errors.append(response.status_code)
+                with lock:
+                    samples.extend(local)
+
+            stages_before = {stage: STAGE_LATENCY.snapshot(stage) for stage in STAGES}
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+
+            result = summarize(samples, rows)
+            result['requests_per_s'] = len(samples) / wall
+            result['rows_per_s'] = len(samples) * rows / wall
+            result['errors'] = len(errors)
+            results[f'http/{name}/c{clients}'] = result
+            print(f"http/{name}/c{clients}: p50 {result['p50_ms']:.3f} ms, "
+                  f"{result['requests_per_s']:,.0f} requests/s")
+
+            for stage, before in stages_before.items():
+                stage_result = stage_summary(STAGE_LATENCY, before, STAGE_LATENCY.snapshot(stage))
+                if stage_result is not None:
+                    results[f'stages/{name}/c{clients}/{stage}'] = stage_result
+    return results
+
+
+def stage_summary(histogram, before, after):
+    """Per stage timings recorded by the app's /metrics histograms between
+    two snapshots. Percentiles are estimated from the histogram buckets."""
+    from metrics import quantile
+
+    counts = [b - a for a, b in zip(before[0], after[0])]
+    n = sum(counts)
+    if not n:
+        return None
+    return {
+        'n': int(n),
+        'mean_ms': (after[1] - before[1]) / n * 1000,
+        'p50_ms': quantile(histogram.buckets, counts, 0.5) * 1000,
+        'p95_ms': quantile(histogram.buckets, counts, 0.95) * 1000,
+        'p99_ms': quantile(histogram.buckets, counts, 0.99) * 1000,
+    }
+
+
+def run_train(scales=TRAIN_SCALES, seed=1):
+    """Times train.py in a subprocess on resampled copies of the raw dataset.
+
+    The copies are parsed without the dataset cache, which would leave an
+    entry in datasets/cache for every temporary CSV.
+    """
+    df = pd.read_csv(RAW_DATA_FILE)
+    rng = np.random.default_rng(seed)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            data_file = os.path.join(tmp, f'train_x{scale}.csv')
+            df.iloc[rng.integers(0, len(df), len(df) * scale)].to_csv(data_file, index=False)
+
+            script = ('import time, train; start = time.perf_counter(); '
+                      f'train.train({data_file!r}, use_cache=False); '
+                      'print(time.perf_counter() - start)')
+            out = subprocess.run([sys.executable, '-W', 'ignore', '-c', script], cwd=here,
+                                 capture_output=True, text=True, check=True)
+            seconds = float(out.stdout.strip().splitlines()[-1])
+
+            results[f'train/x{scale}'] = summarize([seconds], len(df) * scale)
+            print(f"train/x{scale}: {seconds:.2f} s")
+    return results
+
+
+def environment():
+    import xgboost as xgb
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'xgboost': xgb.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'created_at': time.time(),
+    }
+
+
+def run(tiers=('micro', 'http', 'train'), quick=False):
+    """Runs the selected tiers.
+
+    Args:
+        tiers (tuple, optional): Any of micro, http and train.
+        quick (bool, optional): Smaller batch sizes, fewer requests and only
+            the 1x training run, for a fast check.
+
+    Returns:
+        dict: Environment info and the results keyed by benchmark name.
+    """
+    results = {}
+    if 'micro' in tiers:
+        results.update(run_micro(BATCH_SIZES[:4] if quick else BATCH_SIZES,
+                                 min_time=0.1 if quick else 0.5))
+    if 'http' in tiers:
+        results.update(run_http(requests_per_client=50 if quick else 200))
+    if 'train' in tiers:
+        results.update(run_train(TRAIN_SCALES[:1] if quick else TRAIN_SCALES))
+    return {'environment': environment(), 'results': results}
+
+
+def compare(baseline, current, threshold=0.1, metric='p50_ms'):
+    """Flags benchmarks that got slower than the baseline.
+
+    Args:
+        baseline (dict): Output of `run`.
+        current (dict): Output of `run`.
+        threshold (float, optional): Relative slowdown considered a regression.
+        metric (str, optional): Latency metric compared.
+
+    Returns:
+        list: `(name, baseline value, current value, ratio)` of every regression.
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None or not before[metric]:
+            continue
+        ratio = result[metric] / before[metric]
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f"{name:50} {before[metric]:10.3f} {result[metric]:10.3f} {ratio:6.2f}x {flag}")
+        if flag:
+            regressions.append((name, before[metric], result[metric], ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the inference path.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run benchmarks and save the results')
+    run_parser.add_argument('--tiers', nargs='+', choices=['micro', 'http', 'train'],
+                            default=['micro', 'http', 'train'])
+    run_parser.add_argument('--quick', action='store_true',
+                            help='smaller sizes for a fast check')
+    run_parser.add_argument('--output', default='benchmark.json')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative slowdown flagged, 0.1 is 10%%')
+    compare_parser.add_argument('--metric', default='p50_ms',
+                                choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run(args.tiers, args.quick)
+        with open(args.output, 'w') as f_out:
+            json.dump(report, f_out, indent=2)
+        print(f"results saved to {args.output}")
+    else:
+        with open(args.baseline) as f_in:
+            baseline = json.load(f_in)
+        with open(args.current) as f_in:
+            current = json.load(f_in)
+        regressions = compare(baseline, current, args.threshold, args.metric)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+def row_key(row):
+    """Hashes an encoded float32 row into a compact cache key.
+
+    Adding 0.0 canonicalizes -0.0 to 0.0, the NaNs written by the encoder
+    for missing features all share one bit pattern.
+    """
+    row = np.ascontiguousarray(row, dtype=np.float32) + np.float32(0.0)
+    return hashlib.blake2b(row.tobytes(), digest_size=16).digest()
+
+
+class PredictionCache:
+    """LRU cache of predictions with a time to live, keyed by model version.
+
+    Keys are hashes of the encoded feature vector, so requests that differ
+    only in key order, ignored keys or int vs float values share an entry.
+    Entries are stored under `(version, key)`: the models of a ModelPool
+    share the cache without evicting each other on every switch, and
+    predictions of a replaced model are never served after a swap. They
+    are simply no longer looked up and age out of the LRU.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds, 0 keeps entries until evicted
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (version, key) -> (expires, prediction)
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        """Returns the prediction of model `version` cached for `key`, or None."""
+        key = (version, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.ttl and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, version, key, prediction):
+        key = (version, key)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            versions = Counter(version for version, _ in self._entries)
+        return {
+            'versions': dict(versions),
+            'size': sum(versions.values()),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,251 @@
+# Smaller serving artifacts from a trained model, and what they cost in accuracy.
+#
+# Variants built from the artifact's training data, all keeping its feature
+# vocabulary so clients send the same records:
+#
+#     truncated      Base parameters, boosting stopped at the best
+#                    validation round
+#     pruned_<k>     Retrained on the k source fields with the most total
+#                    gain, the other columns left missing
+#     distilled_d<d> A depth d ensemble trained on the base model's
+#                    predictions
+#
+# Each variant is scored on the test split of train.py and timed on single
+# rows (XGBoost and the NumPy trees) and batches, and the report shows which
+# is the fastest within an RMSE budget.
+#
+# Usage:
+#     python compress.py model_xgb_eta=0.1_score=1.206.model --budget 0.05
+import json
+import os
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+from artifact import artifact_version, load_artifact, save_artifact
+from benchmark import measure, summarize
+from features import TARGET
+from streaming import RunningMetrics
+from trees import TreeEnsemble
+
+EARLY_STOPPING_ROUNDS = 20
+
+
+def source_field(name, separator='='):
+    """Field a column was encoded from, `diet` for `diet=Balanced`."""
+    return name.partition(separator)[0]
+
+
+def field_importance(booster, feature_names, separator='='):
+    """Total gain of the splits on each source field, largest first.
+
+    Returns:
+        list: `(field, gain)` pairs, fields the trees never split on last.
+    """
+    gains = dict.fromkeys(source_field(name, separator) for name in feature_names)
+    for name, gain in booster.get_score(importance_type='total_gain').items():
+        field = source_field(name, separator)
+        gains[field] = (gains[field] or 0.0) + gain
+    return sorted(((field, gain or 0.0) for field, gain in gains.items()),
+                  key=lambda item: -item[1])
+
+
+class Splits:
+    """The train.py split of the dataset, encoded with the artifact's vocabulary.
+
+    The full training part is split again into a fitting and a validation
+    part for early stopping. Variants are then refitted on the full
+    training part for the chosen number of rounds, like train.py --tune.
+    """
+
+    def __init__(self, df, encoder):
+        df_full_train, df_test = train_test_split(df, test_size=0.2, random_state=1)
+        df_fit, df_val = train_test_split(df_full_train, test_size=0.25, random_state=1)
+
+        def matrix(part):
+            return encoder.encode_frame(part.drop(columns=TARGET)), \
+                part[TARGET].to_numpy(dtype=np.float32)
+
+        self.feature_names = encoder.feature_names
+        self.X_full_train, self.y_full_train = matrix(df_full_train)
+        self.X_fit, self.y_fit = matrix(df_fit)
+        self.X_val, self.y_val = matrix(df_val)
+        self.X_test, self.y_test = matrix(df_test)
+
+
+def fit(params, splits, max_rounds, columns=None, teacher=None):
+    """Early stops on the validation part, then refits on the full training part.
+
+    Args:
+        params (dict): XGBoost parameters.
+        splits (Splits): The encoded dataset.
+        max_rounds (int): Most boosting rounds.
+        columns (numpy.ndarray, optional): Columns to train on, the others
+            are set to missing so the trees never split on them.
+        teacher (xgboost.Booster, optional): Train on its predictions
+            instead of the labels (distillation). Early stopping still
+            uses the labels.
+
+    Returns:
+        xgboost.Booster: The refitted model.
+    """
+    def dmatrix(X, y, distill=True):
+        if teacher is not None and distill:
+            y = teacher.inplace_predict(X)
+        if columns is not None:
+            X = np.where(np.isin(np.arange(X.shape[1]), columns), X, np.float32(np.nan))
+        return xgb.DMatrix(X, label=y, missing=np.nan, feature_names=splits.feature_names)
+
+    early = xgb.train(params, dmatrix(splits.X_fit, splits.y_fit), num_boost_round=max_rounds,
+                      evals=[(dmatrix(splits.X_val, splits.y_val, distill=False), 'val')],
+                      early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False)
+    return xgb.train(params, dmatrix(splits.X_full_train, splits.y_full_train),
+                     num_boost_round=early.best_iteration + 1)
+
+
+def artifact_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def profile(booster, splits, min_time=0.5, batch_rows=10000):
+    """Test metrics, latencies and node counts of a model.
+
+    Returns:
+        dict: `rmse`, `mae`, `r2`, single row p50 latency in microseconds
+            with XGBoost and with the NumPy trees, batch rows per second
+            with XGBoost, and the trees and nodes of the ensemble.
+    """
+    metrics = RunningMetrics()
+    metrics.update(splits.y_test, booster.inplace_predict(splits.X_test))
+    ensemble = TreeEnsemble.from_booster(booster)
+
+    row = splits.X_test[:1]
+    batch = np.resize(splits.X_test, (batch_rows, splits.X_test.shape[1]))
+    single = summarize(measure(lambda: booster.inplace_predict(row), min_time))
+    single_numpy = summarize(measure(lambda: ensemble.predict(row), min_time))
+    batched = summarize(measure(lambda: booster.inplace_predict(batch), min_time, min_runs=3),
+                        rows=batch_rows)
+    return {
+        **metrics.results(),
+        'single_row_us': single['p50_ms'] * 1000,
+        'single_row_numpy_us': single_numpy['p50_ms'] * 1000,
+        'batch_rows_per_s': batched['rows_per_s'],
+        'trees': len(ensemble.roots),
+        'nodes': len(ensemble.value),
+        'max_depth': ensemble.max_depth,
+    }
+
+
+def compress(model_path, df, output_dir='compressed', keep_fields=(9, 15), distill_depths=(3,),
+             max_rounds=1000, budget=0.05, min_time=0.5):
+    """Builds, saves and profiles the compressed variants of an artifact.
+
+    Args:
+        model_path (str): Artifact to compress.
+        df (pandas.DataFrame): Its prepared training dataset.
+        output_dir (str, optional): Directory the variant artifacts are saved in.
+        keep_fields (tuple, optional): Source fields kept by each pruned variant.
+        distill_depths (tuple, optional): Tree depth of each distilled variant.
+        max_rounds (int, optional): Most boosting rounds of a variant.
+        budget (float, optional): Relative test RMSE increase over the base
+            model a variant may have to be recommended.
+        min_time (float, optional): Seconds each latency is measured for.
+
+    Returns:
+        dict: `variants`, one entry per model (the base one first) with its
+            profile, path and size, and `recommended`, the name of the
+            fastest single row variant within the budget.
+    """
+    encoder, base, meta = load_artifact(model_path)
+    params = meta.get('params')
+    if not params:
+        from train import xgb_params
+
+        params = xgb_params
+    splits = Splits(df, encoder)
+    separator = encoder.separator
+
+    models = {'base': (base, {})}
+    models['truncated'] = (fit(params, splits, max_rounds), {})
+    importance = field_importance(base, encoder.feature_names, separator)
+    for k in keep_fields:
+        fields = [field for field, _ in importance[:k]]
+        columns = np.array([i for i, name in enumerate(encoder.feature_names)
+                            if source_field(name, separator) in fields])
+        models[f'pruned_{k}'] = (fit(params, splits, max_rounds, columns=columns),
+                                 {'fields': fields})
+    for depth in distill_depths:
+        models[f'distilled_d{depth}'] = (
+            fit({**params, 'max_depth': depth}, splits, max_rounds, teacher=base),
+            {'teacher': model_path})
+
+    os.makedirs(output_dir, exist_ok=True)
+    variants = []
+    for name, (booster, details) in models.items():
+        result = {'variant': name, **profile(booster, splits, min_time), **details}
+        if name == 'base':
+            result['path'] = model_path
+        else:
+            result['path'] = save_artifact(
+                os.path.join(output_dir, f'{name}.model'), encoder.feature_names, booster,
+                metrics={k: result[k] for k in ('rmse', 'mae', 'r2')}, params=params,
+                separator=separator,
+                parent={'path': model_path, 'version': artifact_version(model_path)},
+                compression={'variant': name, **details}, profile=meta.get('profile'))
+        result['size_bytes'] = artifact_size(result['path'])
+        variants.append(result)
+
+    base_rmse = variants[0]['rmse']
+    for result in variants:
+        result['rmse_increase'] = result['rmse'] / base_rmse - 1
+    within = [result for result in variants if result['rmse_increase'] <= budget]
+    recommended = min(within, key=lambda result: result['single_row_us'])['variant']
+    return {'base': model_path, 'budget': budget, 'variants': variants,
+            'recommended': recommended}
+
+
+def print_report(report):
+    print(f"{'variant':<14} {'rmse':>7} {'vs base':>8} {'trees':>6} {'nodes':>7} "
+          f"{'1 row xgb':>10} {'1 row np':>9} {'batch rows/s':>13} {'size':>9}")
+    for r in report['variants']:
+        print(f"{r['variant']:<14} {r['rmse']:>7.4f} {r['rmse_increase']:>+8.1%} {r['trees']:>6} "
+              f"{r['nodes']:>7} {r['single_row_us']:>8.0f}us {r['single_row_numpy_us']:>7.0f}us "
+              f"{r['batch_rows_per_s']:>13,.0f} {r['size_bytes'] / 1024:>7.0f}KB")
+    print(f"fastest single row variant within {report['budget']:.1%} of the base RMSE: "
+          f"{report['recommended']}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from artifact import read_meta
+    from dataset import cached_dataset
+    from train import DATA_FILE
+
+    parser = argparse.ArgumentParser(description='Build smaller variants of a model.')
+    parser.add_argument('model', nargs='?', default='model_xgb_eta=0.1_score=1.206.model')
+    parser.add_argument('--data', help='training CSV, defaults to the one recorded in the '
+                                       'artifact')
+    parser.add_argument('--output-dir', default='compressed',
+                        help='directory for the variant artifacts and the report')
+    parser.add_argument('--keep-fields', type=int, nargs='*', default=[9, 15],
+                        help='source fields kept by each pruned variant')
+    parser.add_argument('--distill-depth', type=int, nargs='*', default=[3],
+                        help='tree depth of each distilled variant')
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help='relative RMSE increase allowed for the recommended variant')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='seconds each latency is measured for')
+    args = parser.parse_args()
+
+    data = args.data or read_meta(args.model).get('training_data', {}).get('path', DATA_FILE)
+    report = compress(args.model, cached_dataset(data), args.output_dir,
+                      keep_fields=args.keep_fields, distill_depths=args.distill_depth,
+                      max_rounds=args.max_rounds, budget=args.budget, min_time=args.min_time)
+    print_report(report)
+    report_file = os.path.join(args.output_dir, 'report.json')
+    with open(report_file, 'w') as f_out:
+        json.dump(report, f_out, indent=2)
+    print(f"the report is saved to {report_file}")
@@ -0,0 +1,203 @@
+# Columnar cache of the prepared dataset.
+#
+# The raw CSV is parsed and feature engineered once (features.prepare_features,
+# in chunks) into a directory of `.npy` columns named after the sha256 of the
+# CSV and of features.py. Later runs memory map those columns instead of
+# parsing the text again, and a change to the data or to the feature
+# engineering gives a new key, so the cache is rebuilt only then.
+#
+#     datasets/cache/3f2a9c0e1b7d4a65/
+#         meta.json       Source stamp, row count, column names and types
+#         00.npy ...      A float32 array per numeric column, or int32 category
+#                         codes (-1 for missing) per categorical column
+#
+# Usage:
+#     python dataset.py
+#     python dataset.py --export-csv datasets/modified_human_age_prediction.csv
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import features
+from artifact import data_stamp, file_hash
+from features import RAW_DTYPES, prepare_features
+
+CACHE_DIR = os.path.join('datasets', 'cache')
+
+FORMAT = 'age-dataset'
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+
+# Measurements are parsed as float64 so the engineered features are computed
+# like load_dataset does, then stored as float32 like XGBoost does
+BUILD_DTYPES = {column: 'float64' if dtype == 'float32' else dtype
+                for column, dtype in RAW_DTYPES.items()}
+
+
+def cache_key(source):
+    """Key of the cache of a CSV: a hash of its content and of features.py.
+
+    Returns:
+        tuple: The key and the stamp of the CSV (see artifact.data_stamp).
+    """
+    stamp = data_stamp(source)
+    digest = hashlib.sha256(
+        f"{FORMAT_VERSION}:{stamp['sha256']}:{file_hash(features.__file__)}".encode())
+    return digest.hexdigest()[:16], stamp
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE)) as f_in:
+        return json.load(f_in)
+
+
+def build(source, cache_dir=CACHE_DIR, chunksize=100000, force=False):
+    """Builds the cache of a CSV in the raw dataset schema, unless it is current.
+
+    The CSV is read in chunks and every column is written into a
+    preallocated memory mapped `.npy` file, so memory is bounded by the
+    chunk size. Categories get codes in the order they are first seen.
+    Other caches of the same CSV are removed once the new one is in place.
+
+    Args:
+        source (str): CSV in the `datasets/human_age_prediction.csv` schema.
+        cache_dir (str, optional): Directory holding the caches.
+        chunksize (int, optional): Rows prepared at once.
+        force (bool, optional): Rebuild even if the cache is current.
+
+    Returns:
+        str: The cache directory.
+    """
+    key, stamp = cache_key(source)
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, META_FILE)) and not force:
+        return path
+
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    rows = stamp['rows']
+    columns, arrays, vocabularies = None, [], []
+    offset = 0
+    for chunk in pd.read_csv(source, dtype=BUILD_DTYPES, chunksize=chunksize):
+        chunk = prepare_features(chunk)
+        if columns is None:
+            columns = []
+            for i, name in enumerate(chunk.columns):
+                numeric = chunk[name].dtype.kind in 'biuf'
+                columns.append({'name': name, 'file': f'{i:02d}.npy',
+                                'dtype': 'float32' if numeric else 'category'})
+                arrays.append(np.lib.format.open_memmap(
+                    os.path.join(tmp_path, columns[-1]['file']), mode='w+',
+                    dtype=np.float32 if numeric else np.int32, shape=(rows,)))
+                vocabularies.append(None if numeric else {})
+        if offset + len(chunk) > rows:
+            raise ValueError(f"{source} has more records than lines, quoted line breaks "
+                             "are not supported")
+
+        for column, array, vocabulary in zip(columns, arrays, vocabularies):
+            values = chunk[column['name']]
+            if vocabulary is None:
+                array[offset:offset + len(chunk)] = values.to_numpy(dtype=np.float32)
+            else:
+                codes, uniques = pd.factorize(values)
+                mapping = np.array([vocabulary.setdefault(str(value), len(vocabulary))
+                                    for value in uniques] + [-1], dtype=np.int32)
+                array[offset:offset + len(chunk)] = mapping[codes]  # -1 picks the last
+        offset += len(chunk)
+
+    if columns is None or offset != rows:
+        shutil.rmtree(tmp_path)
+        raise ValueError(f"{source} has {offset} records but {rows} lines, blank lines "
+                         "and quoted line breaks are not supported")
+    for array in arrays:
+        array.flush()
+    del arrays
+
+    for column, vocabulary in zip(columns, vocabularies):
+        if vocabulary is not None:
+            column['categories'] = list(vocabulary)
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f_out:
+        json.dump({
+            'format': FORMAT,
+            'format_version': FORMAT_VERSION,
+            'key': key,
+            'source': stamp,
+            'features_sha256': file_hash(features.__file__),
+            'rows': rows,
+            'columns': columns,
+        }, f_out, indent=2, ensure_ascii=False)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    for name in os.listdir(cache_dir):
+        other = os.path.join(cache_dir, name)
+        if other != path and os.path.exists(os.path.join(other, META_FILE)) \
+                and read_meta(other)['source']['path'] == stamp['path']:
+            shutil.rmtree(other, ignore_errors=True)
+    return path
+
+
+def load_cached(path):
+    """Loads a cache as a DataFrame backed by the memory mapped columns.
+
+    Numeric columns and category codes are not copied, pages are read from
+    disk as they are used.
+
+    Returns:
+        pandas.DataFrame: The prepared dataset, with the columns of
+            `datasets/modified_human_age_prediction.csv`.
+    """
+    meta = read_meta(path)
+    if meta.get('format') != FORMAT or meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} dataset cache")
+
+    data = {}
+    for column in meta['columns']:
+        array = np.load(os.path.join(path, column['file']), mmap_mode='r')
+        if column['dtype'] == 'category':
+            dtype = pd.CategoricalDtype(column['categories'])
+            data[column['name']] = pd.Categorical.from_codes(array, dtype=dtype, validate=False)
+        else:
+            data[column['name']] = array
+    return pd.DataFrame(data, copy=False)
+
+
+def cached_dataset(source, cache_dir=CACHE_DIR, chunksize=100000):
+    """Prepared dataset of a CSV, through its cache. Replaces features.load_dataset."""
+    return load_cached(build(source, cache_dir, chunksize))
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Build the prepared dataset cache.')
+    parser.add_argument('--data', default=os.path.join('datasets', 'human_age_prediction.csv'),
+                        help='CSV in the datasets/human_age_prediction.csv schema')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--force', action='store_true', help='rebuild even if current')
+    parser.add_argument('--export-csv', metavar='PATH',
+                        help='also write the prepared dataset as CSV, like '
+                             'datasets/modified_human_age_prediction.csv')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = build(args.data, args.cache_dir, args.chunksize, force=args.force)
+    print(f"cache {path} ready in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    df = load_cached(path)
+    print(f"loaded {len(df)} rows, {len(df.columns)} columns in "
+          f"{(time.perf_counter() - start) * 1000:.1f}ms")
+    if args.export_csv:
+        df.to_csv(args.export_csv, index=False)
+        print(f"written to {args.export_csv}")
@@ -0,0 +1,424 @@
+# Input drift monitoring with fixed size, mergeable sketches.
+#
+# The reference profile of a model is computed from its training data and
+# stored in the artifact's meta.json: per numeric feature the decile edges
+# of the training values and how many rows fall between them, per one-hot
+# group how often each value is active. Serving counts the encoded rows the
+# same way, in a fixed array whatever the traffic, and the counts of several
+# workers or replicas merge by adding them. Drift is then scored per feature
+# with the population stability index (PSI) and the Kolmogorov-Smirnov
+# distance between the binned distributions.
+#
+# Usage:
+#     python drift.py profile model_xgb_eta=0.1_score=1.206.model
+#     python drift.py merge http://replica-1:5000 http://replica-2:5000 saved_sketch.json
+import hashlib
+import json
+import multiprocessing
+import threading
+
+import numpy as np
+
+# Quantiles of the training values that bound the numeric bins
+PROFILE_QUANTILES = np.linspace(0, 1, 11)[1:-1]
+# Rows of the training data used for the profile, a sample beyond that
+PROFILE_ROWS = 100000
+# PSI above which a feature counts as drifted, 0.1-0.25 is usually read as
+# a moderate shift and above 0.25 as a significant one
+PSI_THRESHOLD = 0.25
+# Added to empty bins so the PSI stays finite
+PSI_EPSILON = 1e-4
+
+
+def reference_profile(X, feature_names, separator='=', rows=PROFILE_ROWS, seed=1):
+    """Profile of the encoded training rows, stored in the artifact.
+
+    Args:
+        X (numpy.ndarray): Encoded rows, NaN for missing values.
+        feature_names (list): The model's vocabulary, in column order.
+        separator (str, optional): One-hot separator of the vocabulary.
+        rows (int, optional): Rows sampled from X when it has more.
+
+    Returns:
+        dict: `numeric`, the bin edges of each numeric feature, `groups`, the
+            columns of each one-hot group, `counts`, the training rows
+            counted like serving counts them (see DriftSketch), and
+            `source_rows`, the rows the counts were sampled from.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    source_rows = len(X)
+    if len(X) > rows:
+        X = X[np.random.default_rng(seed).choice(len(X), rows, replace=False)]
+
+    numeric, groups = [], []
+    for i, name in enumerate(feature_names):
+        group, sep, _ = name.partition(separator)
+        if not sep:
+            values = X[:, i][~np.isnan(X[:, i])]
+            edges = np.unique(np.quantile(values, PROFILE_QUANTILES)) if len(values) else []
+            numeric.append({'name': name, 'column': i, 'edges': [float(e) for e in edges]})
+        elif groups and groups[-1]['name'] == group:
+            groups[-1]['columns'].append(i)
+        else:
+            groups.append({'name': group, 'columns': [i]})
+
+    profile = {'numeric': numeric, 'groups': groups}
+    sketch = DriftSketch(profile)
+    sketch.update(X)
+    profile['counts'] = sketch.counts.tolist()
+    profile['source_rows'] = source_rows
+    return profile
+
+
+def update_profile(profile, X):
+    """Adds rows appended to the training data to a reference profile.
+
+    Only the new rows are counted, in the bins of the existing profile,
+    and merged into its counts like the sketches of two workers. The bin
+    edges stay those of the original training data, so an update costs
+    the new rows whatever the size of the history. When the profile was
+    counted on a sample, the new rows are weighted by the same rate.
+
+    Args:
+        profile (dict): The profile of the model the rows were added to.
+        X (numpy.ndarray): The new rows, encoded with the same vocabulary.
+
+    Returns:
+        dict: A new profile with the updated counts.
+    """
+    base = DriftSketch(profile)
+    base.counts[:] = profile['counts']
+    new = DriftSketch(profile)
+    new.update(np.asarray(X, dtype=np.float32))
+    source_rows = profile.get('source_rows', base.rows)
+    rate = base.rows / source_rows if source_rows else 1.0
+    new.counts *= rate
+    base.merge(new)
+    return {**profile, 'counts': base.counts.tolist(), 'source_rows': source_rows + len(X)}
+
+
+def profile_fingerprint(profile):
+    """Short hash of a profile's layout and counts."""
+    return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class DriftSketch:
+    """Counts of encoded rows in the bins of a reference profile.
+
+    One flat array: the number of rows first, then per numeric feature one
+    count per bin (below the first edge, between edges, above the last) and
+    one for missing values, then per one-hot group one count per column and
+    one for rows without an active column. Updates are a few array
+    operations for a whole batch of rows, and sketches merge by adding
+    their arrays.
+
+    Args:
+        profile (dict): A reference profile, see reference_profile.
+        counts (array, optional): Buffer holding the counts, e.g. shared
+            memory. A new zeroed array by default.
+    """
+
+    def __init__(self, profile, counts=None):
+        self.profile = profile
+        numeric, groups = profile['numeric'], profile['groups']
+
+        # Bins of every numeric feature: edges padded to the same width with
+        # +inf, so one comparison against a matrix bins all of them at once
+        width = max([len(f['edges']) for f in numeric] or [0])
+        self._numeric_columns = np.array([f['column'] for f in numeric], dtype=np.intp)
+        self._edges = np.full((len(numeric), width), np.inf, dtype=np.float32)
+        self.slices = {}
+        offsets, missing = [], []
+        offset = 1
+        for j, feature in enumerate(numeric):
+            edges = feature['edges']
+            self._edges[j, :len(edges)] = edges
+            offsets.append(offset)
+            missing.append(offset + len(edges) + 1)
+            self.slices[feature['name']] = slice(offset, offset + len(edges) + 2)
+            offset += len(edges) + 2
+        self._offsets = np.array(offsets, dtype=np.intp)
+        # Padding bins are never reached, a missing value jumps to its own bin
+        self._missing_shift = np.array(missing, dtype=np.intp) - self._offsets
+
+        self._onehot = np.array([i for g in groups for i in g['columns']], dtype=np.intp)
+        self._group_starts = np.cumsum([0] + [len(g['columns']) for g in groups[:-1]]) \
+            .astype(np.intp)
+        group_offsets = []
+        for group in groups:
+            group_offsets.append(offset)
+            self.slices[group['name']] = slice(offset, offset + len(group['columns']) + 1)
+            offset += len(group['columns']) + 1
+        self._group_offsets = np.array(group_offsets, dtype=np.intp)
+        self._onehot_offsets = np.concatenate(
+            [np.arange(len(g['columns'])) + o for g, o in zip(groups, group_offsets)]
+        ).astype(np.intp) if groups else np.empty(0, dtype=np.intp)
+        self._group_missing = np.array(
+            [o + len(g['columns']) for g, o in zip(groups, group_offsets)], dtype=np.intp)
+
+        self.size = offset
+        self.counts = np.zeros(offset) if counts is None \
+            else np.frombuffer(counts, dtype=np.float64, count=offset)
+
+    @property
+    def rows(self):
+        return int(self.counts[0])
+
+    def update(self, X):
+        """Adds encoded rows, an array of shape (n, n_features), to the counts."""
+        if not len(X):
+            return
+        self.counts += self.increments(X)
+
+    def increments(self, X):
+        """Counts of a batch of rows, to add to the sketch's counts."""
+        increments = np.zeros(self.size)
+        increments[0] = len(X)
+        if len(self._numeric_columns):
+            values = X[:, self._numeric_columns]
+            bins = (values[:, :, None] >= self._edges).sum(axis=2)
+            bins = np.where(np.isnan(values), self._missing_shift, bins) + self._offsets
+            increments += np.bincount(bins.ravel(), minlength=self.size)
+        if len(self._onehot):
+            active = X[:, self._onehot] == 1
+            increments[self._onehot_offsets] += active.sum(axis=0)
+            none = np.add.reduceat(active, self._group_starts, axis=1) == 0
+            increments[self._group_missing] += none.sum(axis=0)
+        return increments
+
+    def merge(self, other):
+        """Adds the counts of a sketch of the same profile."""
+        if other.size != self.size:
+            raise ValueError("Sketches of different profiles can't be merged")
+        self.counts += other.counts
+
+    def to_dict(self):
+        return {'fingerprint': profile_fingerprint(self.profile), 'counts': self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, profile, data):
+        if data['fingerprint'] != profile_fingerprint(profile):
+            raise ValueError("The sketch was counted with another reference profile")
+        sketch = cls(profile)
+        sketch.counts[:] = data['counts']
+        return sketch
+
+
+def psi(expected, actual):
+    """Population stability index between two histograms of the same bins."""
+    p = expected / max(expected.sum(), 1) + PSI_EPSILON
+    q = actual / max(actual.sum(), 1) + PSI_EPSILON
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks(expected, actual):
+    """Largest difference between the cumulative distributions of two histograms."""
+    p = np.cumsum(expected) / max(expected.sum(), 1)
+    q = np.cumsum(actual) / max(actual.sum(), 1)
+    return float(np.max(np.abs(p - q))) if len(p) else 0.0
+
+
+def drift_scores(profile, sketch, threshold=PSI_THRESHOLD):
+    """Compares served rows with the reference profile, feature by feature.
+
+    Missing values are left out of the distributions and reported as rates.
+
+    Returns:
+        dict: `rows` counted, `features` with the `psi`, `ks` and missing rates
+            of each numeric feature and one-hot group, and `drifted`, the
+            features whose PSI is above `threshold`, most drifted first.
+    """
+    reference = DriftSketch(profile)
+    reference.counts[:] = profile['counts']
+    features = {}
+    for name, bins in sketch.slices.items():
+        expected, actual = reference.counts[bins], sketch.counts[bins]
+        features[name] = {
+            'psi': psi(expected[:-1], actual[:-1]) if sketch.rows else None,
+            'ks': ks(expected[:-1], actual[:-1]) if sketch.rows else None,
+            'missing_rate': float(actual[-1] / sketch.rows) if sketch.rows else None,
+            'reference_missing_rate': float(expected[-1] / max(reference.rows, 1)),
+        }
+    drifted = sorted((name for name, f in features.items()
+                      if f['psi'] is not None and f['psi'] > threshold),
+                     key=lambda name: -features[name]['psi'])
+    return {'rows': sketch.rows, 'reference_rows': reference.rows, 'threshold': threshold,
+            'features': features, 'drifted': drifted}
+
+
+class DriftMonitor:
+    """Counts the rows a server predicts on, for drift_scores.
+
+    Rows are copied into a small per process buffer on the request path
+    and added to the sketch a buffer at a time, so a request only pays for
+    the copy. With `shared`, the counts live in shared memory created before
+    gunicorn forks its workers (like metrics.Metrics), so every worker adds
+    to, and reports, the same sketch. Rows still in another worker's buffer
+    are counted when that worker flushes it.
+
+    Args:
+        profile (dict): Reference profile of the served model.
+        buffer_rows (int, optional): Rows buffered before a flush.
+        shared (bool, optional): Keep the counts in shared memory.
+    """
+
+    def __init__(self, profile, buffer_rows=256, shared=False):
+        self.buffer_rows = buffer_rows
+        self._lock = threading.Lock()
+        self._shared = None
+        self._shared_lock = None
+        if shared:
+            size = DriftSketch(profile).size
+            self._shared = multiprocessing.RawArray('d', size)
+            # Fingerprint of the profile the shared counts belong to, so only
+            # the first worker to see a new model clears them
+            self._shared_profile = multiprocessing.RawValue('d', -1)
+            self._shared_lock = multiprocessing.Lock()
+        self.reset(profile)
+
+    def reset(self, profile):
+        """Starts counting against another profile, e.g. after a model reload."""
+        with self._lock:
+            counts = None
+            if self._shared is not None and len(self._shared) == DriftSketch(profile).size:
+                counts = self._shared
+            self.profile = profile
+            self.sketch = DriftSketch(profile, counts)
+            self._is_shared = counts is not None
+            if self._is_shared:
+                fingerprint = float(int(profile_fingerprint(profile), 16))
+                with self._shared_lock:
+                    if self._shared_profile.value != fingerprint:
+                        self._shared_profile.value = fingerprint
+                        self.sketch.counts[:] = 0
+            self.n_features = len(profile['numeric']) + sum(
+                len(g['columns']) for g in profile['groups'])
+            self._buffer = np.empty((self.buffer_rows, self.n_features), dtype=np.float32)
+            self._filled = 0
+
+    def observe(self, X, profile=None):
+        """Records encoded rows.
+
+        Args:
+            X (numpy.ndarray): Rows of shape (n, n_features).
+            profile (dict, optional): Profile of the model that predicted
+                them, the monitor resets when it changes.
+        """
+        if profile is not None and profile is not self.profile:
+            self.reset(profile)
+        with self._lock:
+            if self._filled + len(X) > self.buffer_rows:
+                self._flush()
+            if len(X) > self.buffer_rows:
+                self._add(X)
+            else:
+                self._buffer[self._filled:self._filled + len(X)] = X
+                self._filled += len(X)
+
+    def _flush(self):
+        if self._filled:
+            self._add(self._buffer[:self._filled])
+            self._filled = 0
+
+    def _add(self, X):
+        if not self._is_shared:
+            self.sketch.update(X)
+            return
+        increments = self.sketch.increments(X)
+        with self._shared_lock:
+            self.sketch.counts += increments
+
+    def report(self, threshold=PSI_THRESHOLD):
+        """Drift scores of the rows seen so far, see drift_scores."""
+        with self._lock:
+            self._flush()
+            return drift_scores(self.profile, self.sketch, threshold)
+
+    def to_dict(self):
+        with self._lock:
+            self._flush()
+            return self.sketch.to_dict()
+
+
+def dataset_profile(data_file, encoder):
+    """Reference profile of a training CSV, encoded with a model's vocabulary.
+
+    The CSV is read through its columnar cache (dataset.py) and sampled
+    down to PROFILE_ROWS rows.
+    """
+    from dataset import cached_dataset
+    from features import TARGET
+
+    df = cached_dataset(data_file)
+    if len(df) > PROFILE_ROWS:
+        df = df.sample(n=PROFILE_ROWS, random_state=1)
+    return reference_profile(encoder.encode_frame(df.drop(columns=TARGET)),
+                             encoder.feature_names, encoder.separator)
+
+
+def profile_artifact(path, data_file=None):
+    """Adds a reference profile to the metadata of an existing artifact.
+
+    Args:
+        path (str): Artifact directory.
+        data_file (str, optional): Training CSV, defaults to the one recorded
+            in the artifact.
+
+    Returns:
+        dict: The profile.
+    """
+    import os
+
+    from artifact import META_FILE, load_artifact
+
+    encoder, _, meta = load_artifact(path)
+    data_file = data_file or meta.get('training_data', {}).get('path')
+    if data_file is None:
+        raise ValueError(f"{path} doesn't record its training data, pass data_file")
+    meta['profile'] = profile = dataset_profile(data_file, encoder)
+
+    meta_file = os.path.join(path, META_FILE)
+    with open(f'{meta_file}.tmp', 'w') as f_out:
+        json.dump(meta, f_out, indent=2, sort_keys=True)
+    os.replace(f'{meta_file}.tmp', meta_file)
+    return profile
+
+
+if __name__ == '__main__':
+    import argparse
+    import urllib.request
+
+    from artifact import read_meta
+
+    parser = argparse.ArgumentParser(description='Reference profiles and drift reports.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    profile_parser = commands.add_parser(
+        'profile', help='add a reference profile to an artifact trained before they existed')
+    profile_parser.add_argument('model')
+    profile_parser.add_argument('--data', help='training CSV, defaults to the recorded one')
+    merge_parser = commands.add_parser(
+        'merge', help='merge the sketches of several replicas and score them together')
+    merge_parser.add_argument('sources', nargs='+',
+                              help='server URLs (their /drift?sketch=1) or saved sketch files')
+    merge_parser.add_argument('--model', default='model_xgb_eta=0.1_score=1.206.model',
+                              help='artifact holding the reference profile')
+    merge_parser.add_argument('--threshold', type=float, default=PSI_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == 'profile':
+        profile = profile_artifact(args.model, args.data)
+        print(f"profile of {len(profile['numeric'])} numeric features and "
+              f"{len(profile['groups'])} one-hot groups from {int(profile['counts'][0])} rows "
+              f"added to {args.model}")
+    else:
+        profile = read_meta(args.model)['profile']
+        merged = DriftSketch(profile)
+        for source in args.sources:
+            if source.startswith(('http://', 'https://')):
+                with urllib.request.urlopen(f"{source.rstrip('/')}/drift?sketch=1") as response:
+                    data = json.load(response)['sketch']
+            else:
+                with open(source) as f_in:
+                    data = json.load(f_in)
+            merged.merge(DriftSketch.from_dict(profile, data))
+        print(json.dumps(drift_scores(profile, merged, args.threshold), indent=2))
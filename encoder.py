@@ -0,0 +1,183 @@
+import math
+
+import numpy as np
+
+MISSING = math.nan
+_NO_CATEGORIES = {}
+
+
+class CompiledEncoder:
+    """Encodes records straight into the model's dense float32 layout.
+
+    Built once from the fitted DictVectorizer vocabulary. It replaces
+    `dv.transform` + `xgb.DMatrix` on the serving path: values are written
+    by precomputed column index, string values are one-hot encoded as
+    `key=value` like DictVectorizer does, and keys outside the vocabulary
+    are ignored.
+
+    Absent features are NaN rather than 0, because XGBoost treats the
+    entries missing from DictVectorizer's sparse output as missing values.
+    That keeps predictions identical to the sparse path.
+    """
+
+    def __init__(self, feature_names, separator='='):
+        self.feature_names = list(feature_names)
+        self.separator = separator
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.n_features = len(self.feature_names)
+        self._empty_row = [MISSING] * self.n_features
+
+        # key -> {value: column} for the one-hot columns, so string values
+        # don't need a `key=value` string built per lookup
+        self.categories = {}
+        for name, i in self.index.items():
+            key, sep, value = name.partition(separator)
+            if sep:
+                self.categories.setdefault(key, {})[value] = i
+
+    @classmethod
+    def from_vectorizer(cls, dv):
+        return cls(dv.feature_names_, separator=dv.separator)
+
+    def _fill(self, human, row):
+        index, categories = self.index, self.categories
+        for key, value in human.items():
+            if isinstance(value, str):
+                i = categories.get(key, _NO_CATEGORIES).get(value)
+                value = 1.0
+            else:
+                i = index.get(key)
+            if i is not None:
+                row[i] = value
+        return row
+
+    def encode(self, human):
+        """Encodes one record.
+
+        Args:
+            human (dict): Feature name to value, as accepted by predict_age.
+
+        Returns:
+            numpy.ndarray: A float32 array of shape (1, n_features).
+        """
+        row = self._fill(human, self._empty_row[:])
+        return np.array([row], dtype=np.float32)
+
+    def encode_many(self, humans):
+        """Encodes a list of records into a float32 array of shape (n, n_features)."""
+        empty = self._empty_row
+        rows = [self._fill(human, empty[:]) for human in humans]
+        if not rows:
+            return np.empty((0, self.n_features), dtype=np.float32)
+        return np.array(rows, dtype=np.float32)
+
+    def encode_frame(self, df):
+        """Encodes a DataFrame column by column, without per row dicts.
+
+        Gives the same result as `encode_many(df.to_dict(orient='records'))`:
+        object columns are one-hot encoded against the vocabulary, numeric
+        columns are copied into their column.
+
+        Args:
+            df (pandas.DataFrame): Records with one column per original feature.
+
+        Returns:
+            numpy.ndarray: A float32 array of shape (len(df), n_features).
+        """
+        X = np.full((len(df), self.n_features), MISSING, dtype=np.float32)
+
+        for column in df.columns:
+            values = df[column]
+            if values.dtype.kind in 'biuf':
+                i = self.index.get(column)
+                if i is not None:
+                    X[:, i] = values.to_numpy(dtype=np.float32)
+            elif column in self.categories:
+                # Map each distinct value to its column once, then scatter
+                # the ones by category code
+                values = values.astype('category')
+                known = self.categories[column]
+                lookup = np.array([known.get(value, -1) for value in values.cat.categories]
+                                  + [-1], dtype=np.intp)
+                columns = lookup[values.cat.codes.to_numpy()]  # code -1 (NaN) -> -1
+                rows = np.flatnonzero(columns >= 0)
+                X[rows, columns[rows]] = 1.0
+
+        return X
+
+    def check_model(self, model):
+        """Raises ValueError if `model` expects a different column order."""
+        feature_names = getattr(model, 'feature_names', None)
+        if feature_names is not None and list(feature_names) != self.feature_names:
+            raise ValueError("Encoder vocabulary doesn't match the model features")
+        # scikit-learn estimators only know how many columns they were fitted on
+        n_features = getattr(model, 'n_features_in_', None)
+        if n_features is not None and n_features != self.n_features:
+            raise ValueError("Encoder vocabulary doesn't match the model features")
+
+
+def check_parity(dv, model, humans, tolerance=0.0):
+    """Compares the compiled path against DictVectorizer + DMatrix.
+
+    Args:
+        dv (DictVectorizer): Fitted vectorizer.
+        model (xgboost.Booster): Trained model.
+        humans (list): Records to score with both paths.
+        tolerance (float): Largest absolute difference accepted.
+
+    Returns:
+        float: The largest absolute difference found.
+    """
+    import xgboost as xgb
+
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    encoder.check_model(model)
+    if not len(humans):
+        # DictVectorizer refuses empty batches
+        return 0.0
+
+    d = xgb.DMatrix(dv.transform(humans), feature_names=list(dv.get_feature_names_out()))
+    expected = model.predict(d)
+    actual = model.inplace_predict(encoder.encode_many(humans))
+
+    diff = float(np.max(np.abs(expected - actual)))
+    if diff > tolerance:
+        raise AssertionError(f"Compiled encoder differs from DictVectorizer by {diff}")
+    return diff
+
+
+if __name__ == '__main__':
+    # Compares the speed of the compiled path with the original one on the
+    # training data. Their parity is checked by tests/test_encoder.py
+    import os
+    import pickle
+    import sys
+    import time
+
+    import pandas as pd
+
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'model_xgb_eta=0.1_score=1.206.bin'
+
+    with open(input_file, 'rb') as f_in:
+        dv, model = pickle.load(f_in)
+
+    df = pd.read_csv(os.path.join('datasets', 'modified_human_age_prediction.csv'))
+    humans = df.drop(columns='age_(years)').to_dict(orient='records')
+
+    print("Max abs difference:", check_parity(dv, model, humans))
+
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    n = 2000
+
+    start = time.perf_counter()
+    for human in humans[:n]:
+        X = dv.transform(human)
+    dv_time = (time.perf_counter() - start) / n
+
+    start = time.perf_counter()
+    for human in humans[:n]:
+        X = encoder.encode(human)
+    encoder_time = (time.perf_counter() - start) / n
+
+    print(f"DictVectorizer.transform: {dv_time * 1e6:.1f} us/row")
+    print(f"CompiledEncoder.encode: {encoder_time * 1e6:.1f} us/row")
@@ -0,0 +1,256 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+
+from cache import row_key
+
+# Boosters copied for explanations, kept for the most recent model versions
+MAX_BOOSTERS = 4
+
+
+class ExplainerBusy(Exception):
+    """Raised when `max_pending` explanations are already queued or running."""
+
+
+class ExplainerTimeout(Exception):
+    """Raised when an explanation takes longer than the caller's timeout."""
+
+
+class FieldGroups:
+    """Maps the encoded columns of a vocabulary back to their source fields.
+
+    `diet=Balanced` and `diet=Vegetarian` both belong to `diet`. Tree SHAP
+    values are additive, so the contribution of a field is the sum of its
+    columns', computed for a whole batch with one matrix product.
+    """
+
+    def __init__(self, encoder):
+        separator = encoder.separator
+        self.fields = []
+        column_fields = []
+        index = {}
+        for name in encoder.feature_names:
+            field = name.partition(separator)[0]
+            if field not in index:
+                index[field] = len(self.fields)
+                self.fields.append(field)
+            column_fields.append(index[field])
+        self.column_fields = np.array(column_fields, dtype=np.intp)
+        # (n_columns, n_fields) 0/1 matrix
+        self.matrix = np.zeros((len(column_fields), len(self.fields)), dtype=np.float32)
+        self.matrix[np.arange(len(column_fields)), self.column_fields] = 1
+        # Category of each one-hot column, None for numeric ones
+        self.categories = [name.partition(separator)[2] if separator in name else None
+                           for name in encoder.feature_names]
+
+    def inputs(self, row):
+        """Value of each field in an encoded row: the number or the active category."""
+        values = [None] * len(self.fields)
+        for i, value in enumerate(row.tolist()):
+            field = self.column_fields[i]
+            category = self.categories[i]
+            if category is None:
+                values[field] = value if value == value else None
+            elif value == 1:
+                values[field] = category
+        return values
+
+
+class Explainer:
+    """Per field tree SHAP contributions, off the request threads.
+
+    Explanations run on their own small thread pool, with XGBoost limited
+    to `threads` threads, on a copy of the Booster, so heavy explanation
+    traffic takes at most `workers * threads` cores from /predict. When
+    `max_pending` explanations are already waiting, new ones are refused
+    with ExplainerBusy instead of queueing. Per row results are kept in
+    their own cache, keyed on the model version like the predictions.
+
+    Args:
+        cache (PredictionCache, optional): LRU cache of the explanations, None
+            disables caching.
+        workers (int): Explanations computed at once.
+        threads (int): XGBoost threads of each explanation.
+        max_pending (int): Explanations queued or running before refusing more.
+    """
+
+    def __init__(self, cache=None, workers=1, threads=1, max_pending=8):
+        self.cache = cache
+        self.workers = workers
+        self.threads = threads
+        self.max_pending = max_pending
+        self.pending = 0
+        self.explained = 0
+        self.refused = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._boosters = OrderedDict()  # (path, version) -> Booster copy
+        self._groups = {}  # encoder -> FieldGroups
+
+    def _booster(self, loaded):
+        """A Booster of the model for explanations, with its own thread count."""
+        key = (loaded.path, loaded.version)
+        with self._lock:
+            booster = self._boosters.get(key)
+            if booster is not None:
+                self._boosters.move_to_end(key)
+                return booster
+
+        if loaded.engine == 'xgboost':
+            booster = loaded.model.copy()
+        elif loaded.engine == 'numpy':
+            # The NumPy trees have no SHAP, read the Booster of the artifact
+            from artifact import load_artifact
+
+            booster = load_artifact(loaded.path)[1]
+        else:
+            raise ValueError(f"Explanations need an XGBoost model, {loaded.path} is "
+                             f"served by the {loaded.engine} engine")
+        booster.set_param({'nthread': self.threads})
+
+        with self._lock:
+            self._boosters[key] = booster
+            while len(self._boosters) > MAX_BOOSTERS:
+                self._boosters.popitem(last=False)
+        return booster
+
+    def groups(self, loaded):
+        groups = self._groups.get(loaded.encoder)
+        if groups is None:
+            groups = self._groups[loaded.encoder] = FieldGroups(loaded.encoder)
+        return groups
+
+    def contributions(self, loaded, X, interactions=False, use_cache=True):
+        """Per field contributions of encoded rows, through the cache.
+
+        Args:
+            loaded (LoadedModel): The model to explain.
+            X (numpy.ndarray): Rows encoded by its encoder.
+            interactions (bool, optional): Also compute the field by field
+                interaction values (`pred_interactions`), much slower.
+            use_cache (bool, optional): False skips the cache for this call.
+
+        Returns:
+            list: Per row, a float32 array with one contribution per field
+                followed by the bias, or with `interactions` a
+                (n_fields + 1, n_fields + 1) matrix whose row sums are
+                those contributions.
+        """
+        import xgboost as xgb
+
+        groups = self.groups(loaded)
+        prefix = b'interactions:' if interactions else b'contributions:'
+        keys = None
+        if self.cache is not None and use_cache:
+            keys = [prefix + row_key(row) for row in X]
+        results = [None] * len(X)
+        missing = list(range(len(X)))
+        if keys is not None:
+            missing = []
+            for i, key in enumerate(keys):
+                results[i] = self.cache.get(loaded.version, key)
+                if results[i] is None:
+                    missing.append(i)
+        if not missing:
+            return results
+
+        booster = self._booster(loaded)
+        matrix = xgb.DMatrix(X[missing], missing=np.nan, feature_names=loaded.encoder.feature_names)
+        # Columns to fields, the bias column stays last
+        G = np.zeros((groups.matrix.shape[0] + 1, groups.matrix.shape[1] + 1), dtype=np.float32)
+        G[:-1, :-1] = groups.matrix
+        G[-1, -1] = 1
+        if interactions:
+            values = booster.predict(matrix, pred_interactions=True)
+            grouped = np.einsum('ij,nik,kl->njl', G, values, G, optimize=True)
+        else:
+            grouped = booster.predict(matrix, pred_contribs=True) @ G
+
+        for i, result in zip(missing, grouped.astype(np.float32)):
+            results[i] = result
+            if keys is not None:
+                self.cache.put(loaded.version, keys[i], result)
+        return results
+
+    def explain(self, loaded, X, top_k=5, interactions=False, use_cache=True, timeout=None):
+        """Explains encoded rows on the pool, see `contributions`.
+
+        Args:
+            top_k (int, optional): Fields listed per row, by absolute
+                contribution. The rest are summed in `other`.
+            timeout (float, optional): Seconds to wait for the result.
+
+        Returns:
+            list: Per row, a dict with the `prediction` (the sum of the
+                contributions), the `base_value`, the `top_k`
+                `contributions` with each field's input value, `other` and,
+                with `interactions`, the `top_k` strongest field pairs.
+
+        Raises:
+            ExplainerBusy: If `max_pending` explanations are pending.
+            ExplainerTimeout: If the result takes longer than `timeout`.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.refused += 1
+                raise ExplainerBusy(f"{self.pending} explanations pending, retry later")
+            self.pending += 1
+            # Created in the serving process, not before gunicorn forks
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='explain')
+        future = self._executor.submit(self.contributions, loaded, X, interactions, use_cache)
+        future.add_done_callback(self._release)
+        try:
+            results = future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ExplainerTimeout(f"Explanation took more than {timeout:g}s") from None
+
+        groups = self.groups(loaded)
+        explanations = [self._summarize(groups, row, result, top_k, interactions)
+                        for row, result in zip(X, results)]
+        with self._lock:
+            self.explained += len(X)
+        return explanations
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+
+    @staticmethod
+    def _summarize(groups, row, result, top_k, interactions):
+        contributions = result.sum(axis=1) if interactions else result
+        fields = contributions[:-1]
+        top = np.argsort(-np.abs(fields), kind='stable')[:top_k]
+        inputs = groups.inputs(row)
+        explanation = {
+            'prediction': float(contributions.sum()),
+            'base_value': float(contributions[-1]),
+            'contributions': [{'feature': groups.fields[j], 'value': inputs[j],
+                               'contribution': float(fields[j])} for j in top],
+            'other': float(fields.sum() - fields[top].sum()),
+        }
+        if interactions:
+            # Both halves of each symmetric pair, without the main effects
+            pairs = result[:-1, :-1] + result[:-1, :-1].T
+            upper = np.triu_indices(len(fields), k=1)
+            values = pairs[upper]
+            strongest = np.argsort(-np.abs(values), kind='stable')[:top_k]
+            explanation['interactions'] = [
+                {'features': [groups.fields[upper[0][p]], groups.fields[upper[1][p]]],
+                 'contribution': float(values[p])} for p in strongest]
+        return explanation
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'threads': self.threads,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'explained': self.explained,
+            'refused': self.refused,
+        }
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+TARGET = 'age_(years)'
+
+# Categorical columns where a missing value means "Unknown"
+UNKNOWN_FILLED = [
+    'alcohol_consumption',
+    'chronic_diseases',
+    'medication_use',
+    'family_history',
+    'education_level',
+]
+
+# Features derived from the target, they can only be computed when the age
+# is known (training) and must otherwise be sent by the client
+AGE_DERIVED = ['bone_density_decline_rate', 'hearing_age_interaction']
+
+
+# Column types of the raw dataset, for reading it without type inference.
+# Categoricals are read as `category` and measurements as float32.
+RAW_DTYPES = {
+    'Gender': 'category',
+    'Height (cm)': 'float32',
+    'Weight (kg)': 'float32',
+    'Blood Pressure (s/d)': 'str',
+    'Cholesterol Level (mg/dL)': 'float32',
+    'BMI': 'float32',
+    'Blood Glucose Level (mg/dL)': 'float32',
+    'Bone Density (g/cm²)': 'float32',
+    'Vision Sharpness': 'float32',
+    'Hearing Ability (dB)': 'float32',
+    'Physical Activity Level': 'category',
+    'Smoking Status': 'category',
+    'Alcohol Consumption': 'category',
+    'Diet': 'category',
+    'Chronic Diseases': 'category',
+    'Medication Use': 'category',
+    'Family History': 'category',
+    'Cognitive Function': 'float32',
+    'Mental Health Status': 'category',
+    'Sleep Patterns': 'category',
+    'Stress Levels': 'float32',
+    'Pollution Exposure': 'float32',
+    'Sun Exposure': 'float32',
+    'Education Level': 'category',
+    'Income Level': 'category',
+    'Age (years)': 'float32',
+}
+
+
+def normalize_columns(df):
+    """Renames columns like the notebook does: `Blood Pressure (s/d)` -> `blood_pressure_(s/d)`."""
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    return df
+
+
+def categorize_bone_density(bone_density):
+    """Vectorized bone density category, > 1.0 is Normal and 0.8-1.0 Osteopenia."""
+    return np.select(
+        [bone_density > 1.0, bone_density >= 0.8],
+        ['Normal', 'Osteopenia'],
+        default='Osteoporosis',
+    )
+
+
+def categorize_hearing(db):
+    """Vectorized hearing loss category from the hearing ability in dB."""
+    return np.select(
+        [db <= 25, db <= 40, db <= 55, db <= 70],
+        ['Normal', 'Mild Loss', 'Moderate Loss', 'Severe Loss'],
+        default='Profound Loss',
+    )
+
+
+def prepare_features(df):
+    """Derives the engineered features from records in the raw dataset schema.
+
+    Replicates the notebook's feature engineering with column operations:
+    fills unknown categoricals, splits the blood pressure into systolic,
+    diastolic and pulse pressure, categorizes bone density and hearing and
+    adds the combined features. The result has the columns of
+    `datasets/modified_human_age_prediction.csv`.
+
+    Args:
+        df (pandas.DataFrame): Records in the `datasets/human_age_prediction.csv`
+            schema. Column names may be raw (`Blood Pressure (s/d)`) or
+            already normalized (`blood_pressure_(s/d)`).
+
+    Returns:
+        pandas.DataFrame: A new frame with the engineered features.
+    """
+    df = normalize_columns(df.copy())
+
+    for column in UNKNOWN_FILLED:
+        if column in df:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype) \
+                    and 'Unknown' not in values.cat.categories:
+                values = values.cat.add_categories('Unknown')
+            df[column] = values.fillna('Unknown')
+
+    if 'blood_pressure_(s/d)' in df:
+        pressure = df['blood_pressure_(s/d)'].astype('str').str.split('/', n=1, expand=True)
+        pressure = pressure.reindex(columns=[0, 1])
+        df['systolic'] = pd.to_numeric(pressure[0], errors='coerce')
+        df['diastolic'] = pd.to_numeric(pressure[1], errors='coerce')
+        df['pulse_pressure'] = df.systolic - df.diastolic
+        df = df.drop('blood_pressure_(s/d)', axis=1)
+
+    bone_density = df['bone_density_(g/cm²)'] if 'bone_density_(g/cm²)' in df else None
+    hearing = df['hearing_ability_(db)'] if 'hearing_ability_(db)' in df else None
+    age = df[TARGET] if TARGET in df else None
+
+    if bone_density is not None:
+        df['bone_density_category'] = categorize_bone_density(bone_density)
+        if age is not None:
+            df['bone_density_decline_rate'] = bone_density / age
+
+    if hearing is not None:
+        df['hearing_category'] = categorize_hearing(hearing)
+
+    if bone_density is not None:
+        if 'vision_sharpness' in df:
+            df['bone_vision_combined'] = bone_density * df['vision_sharpness']
+        if 'cognitive_function' in df:
+            df['bone_cognitive_combined'] = bone_density * df['cognitive_function']
+
+    if hearing is not None and age is not None:
+        df['hearing_age_interaction'] = hearing / age
+
+    return df
+
+
+class MissingFeatures(ValueError):
+    """Records without age derived features the model needs, answered with a 422."""
+
+    def __init__(self, features, rows):
+        self.features = features
+        self.rows = rows
+        super().__init__(
+            f"The model needs {features}, which are computed from the age and can't be "
+            f"derived from the record. Send them with records {rows[:10]}"
+            + (f" and {len(rows) - 10} more" if len(rows) > 10 else ""))
+
+
+def check_age_derived(df, feature_names):
+    """Rejects prepared records missing age derived features the model uses.
+
+    Without them the shipped model's predictions are no better than
+    guessing (test RMSE of 42 years instead of 1.2), so such records
+    are refused rather than scored.
+
+    Args:
+        df (pandas.DataFrame): Records returned by `prepare_features`.
+        feature_names (list): Features of the model.
+
+    Raises:
+        MissingFeatures: If a record lacks one of them, or has it missing.
+    """
+    needed = [name for name in AGE_DERIVED if name in feature_names]
+    if not needed:
+        return
+    missing = np.zeros(len(df), dtype=bool)
+    for name in needed:
+        if name not in df:
+            missing[:] = True
+            break
+        missing |= pd.to_numeric(df[name], errors='coerce').isna().to_numpy()
+    if missing.any():
+        raise MissingFeatures(needed, np.flatnonzero(missing).tolist())
+
+
+def load_dataset(path):
+    """Reads a CSV in the raw dataset schema and prepares its features."""
+    return prepare_features(pd.read_csv(path))
+
+
+def iter_dataset(path, chunksize=100000):
+    """Reads a CSV in the raw dataset schema in chunks with explicit dtypes.
+
+    Yields:
+        pandas.DataFrame: Prepared chunks, with the row numbers of the file
+            as index.
+    """
+    for chunk in pd.read_csv(path, dtype=RAW_DTYPES, chunksize=chunksize):
+        yield prepare_features(chunk)
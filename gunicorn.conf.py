@@ -0,0 +1,44 @@
+# Production server settings, used by the Dockerfile:
+#   gunicorn -c gunicorn.conf.py app:app
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Worker processes, defaults to one per core
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Threads per worker, predictions release the GIL inside XGBoost
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'
+
+# Import app.py (and load the model) once in the master before forking,
+# so every worker shares the model pages copy-on-write
+preload_app = True
+
+# Seconds a worker can spend on a request before it is restarted
+timeout = int(os.environ.get('TIMEOUT', 30))
+# Seconds in-flight requests get to finish after SIGTERM
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth, 0 disables it
+max_requests = int(os.environ.get('MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('ACCESS_LOG', '-')
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    # Move the preloaded objects out of the garbage collector's reach, so
+    # collections in the workers don't write to (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Threads don't survive the fork: each worker watches for replaced model
+    # files and reloads published by /admin/reload in any other worker
+    from app import registry
+
+    registry.start_watching()
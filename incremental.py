@@ -0,0 +1,181 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from artifact import save_artifact, tail_hash
+from features import RAW_DTYPES, TARGET, prepare_features
+from registry import load_model
+from streaming import RunningMetrics, in_test_split
+
+
+def appended_rows(data_file, stamp):
+    """Reads the rows appended to the training CSV since `stamp` was taken.
+
+    Only the new bytes are read. The file counts as appended to when it
+    didn't shrink and the last TAIL_BYTES before the old end are unchanged.
+
+    Args:
+        data_file (str): CSV in the raw dataset schema.
+        stamp (dict): `training_data` of the artifact's metadata.
+
+    Returns:
+        pandas.DataFrame: The new rows, not yet prepared.
+    """
+    size = stamp['size']
+    if os.path.getsize(data_file) < size or tail_hash(data_file, size) != stamp['tail_sha256']:
+        raise ValueError(f"{data_file} was modified, not appended to, since the model was "
+                         "trained. Retrain from scratch")
+
+    with open(data_file, 'rb') as f_in:
+        header = f_in.readline()
+        f_in.seek(max(size - 1, 0))
+        if size and f_in.read(1) != b'\n':
+            raise ValueError(f"{data_file} didn't end with a line break when the model was "
+                             "trained. Retrain from scratch")
+        body = f_in.read()
+    return pd.read_csv(io.BytesIO(header + body), dtype=RAW_DTYPES)
+
+
+def retrain(model_path, data_file=None, new_data=None, strategy='continue', rounds=20,
+            params=None, tolerance=0.0):
+    """Updates a model with new records instead of retraining on all of them.
+
+    The vocabulary of the artifact is reused, so categories it has never
+    seen are ignored like the server does, and new rows are split into a
+    training part and a held-out part by row number (like `train.py --stream`).
+    The held-out rows score both the old and the updated model.
+
+    Args:
+        model_path (str): Artifact to start from.
+        data_file (str, optional): The CSV the artifact was trained on, with
+            rows appended since. Defaults to the path in its metadata.
+        new_data (str, optional): A CSV with only the new rows, for artifacts
+            that don't record their training data.
+        strategy (str, optional): `continue` adds `rounds` boosting rounds
+            fitted on the new rows, `refresh` keeps the trees and recomputes
+            their leaf values from the new rows.
+        rounds (int, optional): Boosting rounds added by `continue`.
+        params (dict, optional): XGBoost parameters, defaults to the ones
+            recorded in the artifact, or train.py's for artifacts without them.
+        tolerance (float, optional): Relative RMSE increase still accepted.
+
+    Returns:
+        dict: `model` (the updated Booster), `metrics` and `base_metrics` on
+            the held-out rows, `accepted`, the `training_data` stamp and
+            `rows` used, and the drift `profile` updated with the new rows
+            (None when the base artifact has none).
+    """
+    base = load_model(model_path)
+    meta = base.meta
+    if not params:
+        from train import xgb_params
+
+        params = meta.get('params') or xgb_params
+    stamp = meta.get('training_data')
+
+    if new_data is not None:
+        df = pd.read_csv(new_data, dtype=RAW_DTYPES)
+        first_row = 0
+        new_stamp = stamp
+    else:
+        if not stamp or 'tail_sha256' not in stamp:
+            raise ValueError(f"{model_path} doesn't record its training data, pass the new "
+                             "rows with new_data")
+        data_file = data_file or stamp['path']
+        df = appended_rows(data_file, stamp)
+        first_row = stamp['rows']
+        size = os.path.getsize(data_file)
+        new_stamp = {
+            'path': data_file,
+            'size': size,
+            'rows': first_row + len(df),
+            'tail_sha256': tail_hash(data_file, size),
+        }
+
+    if not len(df):
+        raise ValueError("No new rows to train on")
+    df = prepare_features(df)
+    df.index = np.arange(first_row, first_row + len(df))
+    test = in_test_split(df.index)
+    if test.all() or not test.any():
+        raise ValueError(f"{len(df)} new rows are too few to hold some out")
+
+    encoder = base.encoder
+    for column in df.columns.drop(TARGET):
+        if column in encoder.categories:
+            unseen = set(df[column].dropna().unique()) - set(encoder.categories[column])
+            if unseen:
+                print(f"ignoring values of {column} unknown to the model: {sorted(unseen)}")
+
+    def matrix(part):
+        return encoder.encode_frame(part.drop(columns=TARGET)), \
+            part[TARGET].to_numpy(dtype=np.float32)
+
+    X_train, y_train = matrix(df[~test])
+    X_test, y_test = matrix(df[test])
+    d_train = xgb.DMatrix(X_train, label=y_train, missing=np.nan,
+                          feature_names=encoder.feature_names)
+
+    base_metrics = RunningMetrics()
+    base_metrics.update(y_test, base.model.inplace_predict(X_test))
+
+    if strategy == 'continue':
+        model = xgb.train(params, d_train, num_boost_round=rounds, xgb_model=base.model)
+    elif strategy == 'refresh':
+        refresh = {**params, 'process_type': 'update', 'updater': 'refresh',
+                   'refresh_leaf': True}
+        model = xgb.train(refresh, d_train, num_boost_round=base.model.num_boosted_rounds(),
+                          xgb_model=base.model)
+    else:
+        raise ValueError(f"Unknown strategy {strategy!r}, expected continue or refresh")
+
+    metrics = RunningMetrics()
+    metrics.update(y_test, model.inplace_predict(X_test))
+    metrics, base_metrics = metrics.results(), base_metrics.results()
+
+    # The drift profile of the base model with the new rows merged in, the
+    # history isn't read again
+    profile = meta.get('profile')
+    if profile:
+        from drift import update_profile
+
+        profile = update_profile(profile, np.concatenate([X_train, X_test]))
+
+    return {
+        'model': model,
+        'metrics': metrics,
+        'base_metrics': base_metrics,
+        'accepted': metrics['rmse'] <= base_metrics['rmse'] * (1 + tolerance),
+        'params': params,
+        'training_data': new_stamp,
+        'rows': {'train': int((~test).sum()), 'test': int(test.sum())},
+        'base': base,
+        'strategy': strategy,
+        'profile': profile,
+    }
+
+
+def publish(result, output=None):
+    """Saves an accepted retrain as a new artifact next to the old one.
+
+    Args:
+        result (dict): Returned by `retrain`.
+        output (str, optional): Artifact directory, named after the eta and
+            the held-out RMSE like train.py by default.
+
+    Returns:
+        str: The path of the saved artifact.
+    """
+    base, params, metrics = result['base'], result['params'], result['metrics']
+    if output is None:
+        output = f"model_xgb_eta={round(params.get('eta', 0.3), 3)}" \
+                 f"_score={round(metrics['rmse'], 3)}.model"
+    return save_artifact(
+        output, base.encoder.feature_names, result['model'], metrics=metrics, params=params,
+        separator=base.encoder.separator, training_data=result['training_data'],
+        parent={'path': base.path, 'version': base.version}, profile=result['profile'],
+        incremental={'strategy': result['strategy'], 'rows': result['rows'],
+                     'base_metrics': result['base_metrics']})
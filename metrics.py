@@ -0,0 +1,177 @@
+import bisect
+import itertools
+import multiprocessing
+
+# Histogram buckets in seconds, for whole requests and for the stages inside
+# the prediction path
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return f'{value:.17g}' if value != float('inf') else '+Inf'
+
+
+class Metrics:
+    """Counters and histograms kept in shared memory, rendered in the
+    Prometheus text format.
+
+    Like the shared rate limiter, the values live in one array created
+    before gunicorn forks its workers (see gunicorn.conf.py), so every
+    worker adds to the same counters and `/metrics` reports the whole
+    server whichever worker answers the scrape. For that, every metric and
+    every label value has to be declared up front.
+
+    Each update takes one uncontended lock, which with the bucket search
+    costs about a microsecond, so hot paths record several values at once
+    with `Histogram.observe_many`.
+    """
+
+    def __init__(self, size=4096):
+        self._array = multiprocessing.RawArray('d', size)
+        # Indexing a memoryview is faster than the ctypes array itself
+        self.values = memoryview(self._array).cast('B').cast('d')
+        self.lock = multiprocessing.Lock()
+        self.size = size
+        self._used = 0
+        self._metrics = []
+
+    def _allocate(self, n):
+        if self._used + n > self.size:
+            raise ValueError(f"Metrics need more than {self.size} values")
+        offset = self._used
+        self._used += n
+        return offset
+
+    def counter(self, name, help, labels=None):
+        """Declares a counter.
+
+        Args:
+            name (str): Metric name, e.g. `http_requests_total`.
+            help (str): Description shown by Prometheus.
+            labels (dict, optional): Label name to every value it can take.
+        """
+        metric = Counter(self, name, help, labels or {})
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets, labels=None):
+        """Declares a histogram with the given bucket upper bounds, see `counter`."""
+        metric = Histogram(self, name, help, buckets, labels or {})
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            values = self.values[:self._used].tolist()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+class _Metric:
+    kind = None
+    width = 1  # Values stored per label combination
+
+    def __init__(self, metrics, name, help, labels):
+        self.metrics = metrics
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.offsets = {
+            combination: metrics._allocate(self.width)
+            for combination in itertools.product(*labels.values())
+        }
+
+    def render(self, values):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for combination, offset in self.offsets.items():
+            lines.extend(self._render_one(combination, values[offset:offset + self.width]))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1.0):
+        """Adds `amount` to the counter of the given label values."""
+        offset = self.offsets[labels]
+        with self.metrics.lock:
+            self.metrics.values[offset] += amount
+
+    def value(self, *labels):
+        return self.metrics.values[self.offsets[labels]]
+
+    def _render_one(self, labels, values):
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(values[0])}']
+
+
+class Histogram(_Metric):
+    """Bucket counts (not cumulative, that's done when rendering) and the sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, metrics, name, help, buckets, labels):
+        self.buckets = tuple(buckets)
+        self.width = len(self.buckets) + 2  # Buckets, +Inf and the sum
+        super().__init__(metrics, name, help, labels)
+
+    def observe(self, value, *labels):
+        """Records one observation for the given label values."""
+        self.observe_many([(labels, value)])
+
+    def observe_many(self, observations):
+        """Records `(labels, value)` pairs taking the lock once."""
+        buckets, values, offsets = self.buckets, self.metrics.values, self.offsets
+        with self.metrics.lock:
+            for labels, value in observations:
+                offset = offsets[labels]
+                values[offset + bisect.bisect_left(buckets, value)] += 1
+                values[offset + len(buckets) + 1] += value
+
+    def snapshot(self, *labels):
+        """Returns the bucket counts (last one is +Inf) and the sum of observations."""
+        offset = self.offsets[labels]
+        with self.metrics.lock:
+            values = self.metrics.values[offset:offset + self.width].tolist()
+        return values[:-1], values[-1]
+
+    def _render_one(self, labels, values):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+            total += count
+            le = _format_labels(self.label_names, labels, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{le} {total:.17g}')
+        names = _format_labels(self.label_names, labels)
+        lines.append(f'{self.name}_sum{names} {_format_value(values[-1])}')
+        lines.append(f'{self.name}_count{names} {total:.17g}')
+        return lines
+
+
+def quantile(buckets, counts, q):
+    """Estimates a quantile from histogram bucket counts like Prometheus'
+    `histogram_quantile`, interpolating linearly inside the bucket."""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen, lower = 0.0, 0.0
+    for bound, count in zip(tuple(buckets) + (float('inf'),), counts):
+        if seen + count >= rank and count:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return lower
@@ -0,0 +1,207 @@
+import hashlib
+import math
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class Decision:
+    """Outcome of taking a token: whether it was allowed and the quota left."""
+
+    __slots__ = ('allowed', 'remaining', 'retry_after', 'limit')
+
+    def __init__(self, allowed, remaining, retry_after, limit):
+        self.allowed = allowed
+        self.remaining = remaining  # Whole tokens left after this request
+        self.retry_after = retry_after  # Seconds until a token is available
+        self.limit = limit
+
+    def headers(self):
+        headers = {
+            'X-RateLimit-Limit': f'{self.limit:g}',
+            'X-RateLimit-Remaining': str(self.remaining),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def _take(tokens, last, now, capacity, refill_rate):
+    # Shared token bucket arithmetic, returns (allowed, tokens, retry_after)
+    tokens = min(capacity, tokens + (now - last) * refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / refill_rate
+
+
+class MemoryBackend:
+    """Per key buckets in this process, for single process servers.
+
+    Buckets live in an LRU ordered dict capped at `max_keys`. Evicting the
+    least recently used bucket only loses state when it was touched less
+    than `capacity / refill_rate` seconds ago, since after that it would be
+    full again anyway.
+    """
+
+    def __init__(self, capacity, refill_rate, max_keys=10000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, last_refill]
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+
+            allowed, bucket[0], retry_after = _take(
+                bucket[0], bucket[1], now, self.capacity, self.refill_rate)
+            bucket[1] = now
+
+        return Decision(allowed, int(bucket[0]), retry_after, self.capacity)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SharedMemoryBackend:
+    """Per key buckets shared by every worker process forked from this one.
+
+    State lives in a fixed size table of `slots` entries in shared memory,
+    created before gunicorn forks its workers (see gunicorn.conf.py), so
+    memory is bounded whatever the number of clients. A key maps to a slot
+    by a stable hash. When two active keys collide they share a bucket,
+    which errs on the side of limiting; an idle slot is simply taken over.
+    """
+
+    def __init__(self, capacity, refill_rate, slots=4096):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.slots = slots
+        # Per slot: key fingerprint, tokens, last refill (wall clock, shared
+        # between processes)
+        self._table = multiprocessing.RawArray('d', slots * 3)
+        self._lock = multiprocessing.Lock()
+        self._full_after = capacity / refill_rate
+
+    def take(self, key):
+        fingerprint = zlib.crc32(key.encode())
+        base = (fingerprint % self.slots) * 3
+        table = self._table
+        now = time.time()
+
+        with self._lock:
+            owner, tokens, last = table[base], table[base + 1], table[base + 2]
+            if owner != fingerprint and now - last >= self._full_after:
+                # Empty or idle slot, it would be full by now anyway
+                owner, tokens, last = fingerprint, self.capacity, now
+
+            allowed, tokens, retry_after = _take(
+                tokens, last, now, self.capacity, self.refill_rate)
+            table[base], table[base + 1], table[base + 2] = owner, tokens, now
+
+        return Decision(allowed, int(tokens), retry_after, self.capacity)
+
+
+# Token bucket as a Redis script so the read-modify-write is atomic across
+# replicas. The key expires once the bucket would be full again, which
+# bounds the memory used by idle clients.
+REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Per key buckets in Redis (or a Redis compatible store), shared by replicas.
+
+    Args:
+        client: A `redis.Redis` like client, only `register_script` is used.
+    """
+
+    def __init__(self, client, capacity, refill_rate, prefix='ratelimit:'):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.prefix = prefix
+        self._script = client.register_script(REDIS_TOKEN_BUCKET)
+
+    def take(self, key):
+        allowed, tokens = self._script(
+            keys=[self.prefix + key],
+            args=[self.capacity, self.refill_rate, time.time()])
+        tokens = float(tokens)
+        retry_after = 0.0 if allowed else (1 - tokens) / self.refill_rate
+        return Decision(bool(allowed), int(tokens), retry_after, self.capacity)
+
+
+def parse_api_keys(value):
+    """API keys from a comma separated setting, empty entries ignored."""
+    return frozenset(key.strip() for key in (value or '').split(',') if key.strip())
+
+
+def client_key(api_key, remote_addr, api_keys):
+    """Bucket key of a request, shared by the Flask and the ASGI server.
+
+    Only keys in `api_keys` get their own bucket, anything else a client
+    sends is ignored and the request is limited by address. Otherwise a
+    client could send a new key with every request to get a full bucket,
+    and push the other clients' buckets out of the bounded table. Known
+    keys are hashed so they aren't stored in the backend in clear.
+
+    Args:
+        api_key (str): The X-API-Key header, None when not sent.
+        remote_addr (str): The client's address.
+        api_keys (frozenset): The configured API keys.
+    """
+    if api_key and api_key in api_keys:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return f'ip:{remote_addr}'
+
+
+def create_backend(name, capacity, refill_rate, max_keys=10000, redis_url=None,
+                   redis_client=None):
+    """Builds the backend selected by name: memory, shared or redis.
+
+    `redis_client` replaces the connection to `redis_url`, e.g. with a
+    `fakeredis.FakeRedis()` stand-in in tests.
+
+    Raises:
+        ImportError: For the redis backend when the redis package (the
+            `redis` extra) isn't installed.
+    """
+    if name == 'memory':
+        return MemoryBackend(capacity, refill_rate, max_keys=max_keys)
+    if name == 'shared':
+        return SharedMemoryBackend(capacity, refill_rate, slots=max_keys)
+    if name == 'redis':
+        if redis_client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("RATE_LIMIT_BACKEND=redis needs the redis package, install "
+                                  "the redis extra: poetry install --extras redis") from None
+            redis_client = redis.Redis.from_url(redis_url)
+        return RedisBackend(redis_client, capacity, refill_rate)
+    raise ValueError(f"Unknown rate limit backend: {name}")
@@ -0,0 +1,478 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from artifact import ENGINES, artifact_version, is_artifact, load_artifact, stamp_path
+from encoder import CompiledEncoder
+from trees import TreeEnsemble
+from validation import RecordValidator
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedModel:
+    """An immutable snapshot of one loaded model and its encoder.
+
+    Requests hold on to the snapshot they started with, so a reload never
+    changes the model underneath an in-flight prediction.
+    """
+
+    def __init__(self, path, encoder, model, version, mtime, load_time, meta=None,
+                 engine='xgboost', validator=None, size_bytes=0):
+        self.path = path
+        self.encoder = encoder
+        # An xgboost.Booster, a TreeEnsemble for the numpy engine or a
+        # scikit-learn regressor for the sklearn engine
+        self.model = model
+        self.engine = engine
+        self.version = version
+        self.mtime = mtime
+        self.load_time = load_time  # Seconds spent reading and deserializing
+        self.meta = meta or {}
+        self.validator = validator or RecordValidator(encoder)
+        # Serialized size of the model, a proxy for the memory it takes
+        self.size_bytes = size_bytes
+        self.loaded_at = time.time()
+        self.warm_up_time = 0.0
+
+    def warm_up(self):
+        """Runs one dummy prediction so the first request doesn't pay for
+        XGBoost's lazy initialization."""
+        start = time.perf_counter()
+        self.predict(np.full((1, self.encoder.n_features), np.nan, dtype=np.float32))
+        self.warm_up_time = time.perf_counter() - start
+
+    def predict(self, X):
+        """Predicts rows encoded by `encoder` with the selected engine."""
+        if self.engine == 'numpy':
+            return self.model.predict(X)
+        if self.engine == 'sklearn':
+            # DictVectorizer leaves absent features at 0, not missing
+            return self.model.predict(np.nan_to_num(X, nan=0.0)).astype(np.float32)
+        return self.model.inplace_predict(X)
+
+    def info(self):
+        return {
+            'path': self.path,
+            'version': self.version,
+            'engine': self.engine,
+            'size_bytes': self.size_bytes,
+            'loaded_at': self.loaded_at,
+            'load_time_ms': round(self.load_time * 1000, 3),
+            'warm_up_time_ms': round(self.warm_up_time * 1000, 3),
+        }
+
+
+def load_model(path, engine='xgboost', encoders=None):
+    """Reads a model artifact from disk.
+
+    Args:
+        path (str): A native artifact directory (see artifact.py) or a
+            pickled `(dv, model)` `.bin` file written by train.py. The model
+            of a `.bin` file can also be a scikit-learn regressor, like the
+            ones compared in the notebook.
+        engine (str, optional): `xgboost` or `numpy`, see trees.py.
+            scikit-learn models always use the `sklearn` engine.
+        encoders (dict, optional): Encoders and validators of the models
+            already loaded, by vocabulary. A model with the same vocabulary
+            reuses them instead of building its own.
+
+    Returns:
+        LoadedModel: The loaded snapshot.
+    """
+    start = time.perf_counter()
+    mtime = os.stat(stamp_path(path)).st_mtime_ns
+
+    if is_artifact(path):
+        encoder, model, meta = load_artifact(path, engine)
+        version = artifact_version(path)
+        size_bytes = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    else:
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown inference engine {engine!r}, expected one of {ENGINES}")
+        with open(path, 'rb') as f_in:
+            data = f_in.read()
+
+        dv, model = pickle.loads(data)
+        encoder = CompiledEncoder.from_vectorizer(dv)
+        encoder.check_model(model)
+        version = hashlib.sha256(data).hexdigest()[:12]
+        size_bytes = len(data)
+        meta = None
+        if not hasattr(model, 'inplace_predict'):
+            engine = 'sklearn'
+        elif engine == 'numpy':
+            model = TreeEnsemble.from_booster(model)
+
+    validator = None
+    if encoders is not None:
+        key = (tuple(encoder.feature_names), encoder.separator)
+        if key not in encoders:
+            encoders.setdefault(key, (encoder, RecordValidator(encoder)))
+        encoder, validator = encoders[key]
+
+    return LoadedModel(path, encoder, model, version, mtime, time.perf_counter() - start,
+                       meta, engine, validator, size_bytes)
+
+
+# Files of a registry state directory, see ModelRegistry
+POINTER_FILE = 'pointer.json'
+WORKERS_DIR = 'workers'
+
+
+def _write_json(path, document):
+    # Written to a temporary file first, readers never see half a document
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f_out:
+        json.dump(document, f_out)
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ModelRegistry:
+    """Keeps the serving model in memory and hot swaps it on change.
+
+    `get()` is the hot path: it returns the current snapshot and, at most
+    once every `check_interval` seconds, stats the file to see whether it
+    was replaced. Reloads build the new snapshot completely before a single
+    reference assignment publishes it, so readers never see a half loaded
+    model and a failed reload keeps the previous one serving.
+
+    Registries of several processes (the gunicorn workers) that share a
+    `state_dir` act as one: `publish` writes the model to serve to a
+    pointer file there, which every registry checks like its model file,
+    and each one records the model it serves in a file of its own, read
+    back by `cluster`. `start_watching` runs the checks in a background
+    thread, so idle workers follow too.
+    """
+
+    def __init__(self, path, check_interval=1.0, prewarm=True, on_load=None, engine='xgboost',
+                 state_dir=None):
+        self.path = path
+        self.check_interval = check_interval  # Seconds, 0 disables watching
+        self.prewarm = prewarm
+        self.engine = engine  # xgboost or numpy, see trees.py
+        self.encoders = {}  # Shared with the models of a ModelPool, see load_model
+        self.on_load = on_load  # Called with 'success' or 'failure' after each load
+        self.state_dir = state_dir  # Shared by the registries of every worker
+        self.generation = 0  # Of the last pointer followed, 0 before any publish
+        self._current = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._pointer_mtime = None
+        self._watcher = None
+        self.loads = 0
+        self.failed_reloads = 0
+
+    def load(self, path=None, generation=None):
+        """Loads `path` (or the configured file) and makes it the serving model.
+
+        Args:
+            path (str, optional): Artifact to switch to. Defaults to the current path.
+            generation (int, optional): Pointer generation the load follows.
+
+        Returns:
+            LoadedModel: The snapshot now serving.
+        """
+        with self._lock:
+            try:
+                loaded = load_model(path or self.path, self.engine, self.encoders)
+                if self.prewarm:
+                    # Before publishing, so no request hits a cold model
+                    loaded.warm_up()
+            except Exception:
+                self._notify('failure')
+                raise
+            self.path = loaded.path
+            self._current = loaded
+            self._last_check = time.monotonic()
+            self.loads += 1
+            if generation is not None:
+                self.generation = generation
+            self._write_state()
+
+        self._notify('success')
+        logger.info('Loaded model %s (version %s) in %.1f ms',
+                    loaded.path, loaded.version, loaded.load_time * 1000)
+        return loaded
+
+    def _notify(self, result):
+        if self.on_load is not None:
+            self.on_load(result)
+
+    def reload(self, path=None, generation=None):
+        """Like `load`, but keeps the old model serving if loading fails."""
+        try:
+            return self.load(path, generation)
+        except Exception:
+            self.failed_reloads += 1
+            logger.exception('Reloading model from %s failed', path or self.path)
+            raise
+
+    def publish(self, path=None):
+        """Reloads here, then points the registries sharing `state_dir` to the model.
+
+        The model is loaded in this process first, so a path that fails to
+        load is never handed to the other workers. They follow on their
+        next check, even when the path didn't change.
+
+        Returns:
+            LoadedModel: The snapshot now serving in this process.
+        """
+        generation = time.time_ns()
+        loaded = self.reload(path, generation)
+        if self.state_dir:
+            _write_json(os.path.join(self.state_dir, POINTER_FILE),
+                        {'path': loaded.path, 'generation': generation})
+        return loaded
+
+    def get(self):
+        """Returns the snapshot to serve the current request with."""
+        current = self._current
+        if current is None:
+            return self.load()
+
+        if self.check_interval and time.monotonic() - self._last_check >= self.check_interval:
+            self._check_for_update(current)
+
+        return self._current
+
+    def _check_for_update(self, current):
+        # Only one thread needs to stat the file, the rest keep serving
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = time.monotonic()
+            pointer = self._read_pointer()
+            mtime = os.stat(stamp_path(self.path)).st_mtime_ns
+        except OSError:
+            # Replaced by a published model, or still being written
+            mtime = current.mtime
+        finally:
+            self._lock.release()
+
+        if pointer is not None:
+            try:
+                self.reload(pointer['path'], pointer['generation'])
+            except Exception:
+                # Read the pointer again on the next check
+                self._pointer_mtime = None
+        elif mtime != current.mtime:
+            try:
+                self.reload()
+            except Exception:
+                # Retry on the next check, the file may still be being written
+                pass
+
+    def _read_pointer(self):
+        # The pointer published by another registry, when it is new to this one
+        if not self.state_dir:
+            return None
+        pointer_file = os.path.join(self.state_dir, POINTER_FILE)
+        try:
+            mtime = os.stat(pointer_file).st_mtime_ns
+            if mtime == self._pointer_mtime:
+                return None
+            with open(pointer_file) as f_in:
+                pointer = json.load(f_in)
+        except (OSError, ValueError):
+            return None
+        self._pointer_mtime = mtime
+        if pointer.get('generation') == self.generation:
+            return None
+        return pointer
+
+    def _write_state(self):
+        # The model this process serves, read by `cluster` in every worker
+        if not self.state_dir:
+            return
+        current = self._current
+        _write_json(os.path.join(self.state_dir, WORKERS_DIR, f'{os.getpid()}.json'), {
+            'pid': os.getpid(),
+            'path': current.path,
+            'version': current.version,
+            'generation': self.generation,
+            'loaded_at': current.loaded_at,
+        })
+
+    def start_watching(self):
+        """Checks for updates in a background thread, in this process.
+
+        Call it in every serving process (gunicorn's post_fork), threads
+        don't survive a fork. Without it a worker only checks when it
+        serves a request.
+        """
+        if not self.check_interval or self._watcher is not None:
+            return
+        self._write_state()
+
+        def watch():
+            while True:
+                time.sleep(self.check_interval)
+                if self._current is not None:
+                    self._check_for_update(self._current)
+
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def cluster(self):
+        """The model every live process sharing `state_dir` serves.
+
+        Returns:
+            dict: `workers`, the path, version and pointer generation of
+                each process, and `consistent`, whether they all serve the
+                same version. Only this process without a `state_dir`.
+        """
+        workers = []
+        workers_dir = os.path.join(self.state_dir, WORKERS_DIR) if self.state_dir else None
+        names = os.listdir(workers_dir) if workers_dir and os.path.isdir(workers_dir) else []
+        for name in sorted(names):
+            pid = int(name.partition('.')[0]) if name.endswith('.json') else None
+            # The gunicorn master loaded the model before forking, it serves nothing
+            if pid is None or pid == os.getppid():
+                continue
+            if not _alive(pid):
+                try:
+                    os.remove(os.path.join(workers_dir, name))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(workers_dir, name)) as f_in:
+                    workers.append(json.load(f_in))
+            except (OSError, ValueError):
+                continue
+        if not workers and self._current is not None:
+            workers = [{'pid': os.getpid(), 'path': self._current.path,
+                        'version': self._current.version, 'generation': self.generation,
+                        'loaded_at': self._current.loaded_at}]
+        return {'workers': workers,
+                'consistent': len({worker['version'] for worker in workers}) <= 1}
+
+    def ready(self):
+        return self._current is not None
+
+    def info(self):
+        current = self._current
+        info = current.info() if current is not None else {'path': self.path}
+        info['loads'] = self.loads
+        info['failed_reloads'] = self.failed_reloads
+        return info
+
+
+class UnknownModel(KeyError):
+    """Raised for a model name that isn't configured."""
+
+
+class ModelPool:
+    """Named models served next to the registry's one, loaded on first use.
+
+    The registry's model is the default and is always loaded. The others
+    are kept in an LRU: when more than `max_loaded` are loaded, or their
+    sizes add up to more than `max_bytes`, the least recently used one is
+    dropped and loaded again the next time it is asked for. Models with
+    the same vocabulary share their encoder and validator.
+
+    Args:
+        registry (ModelRegistry): Serves the default model.
+        paths (dict): Model name to artifact path.
+        max_loaded (int, optional): Named models kept loaded at once.
+        max_bytes (int, optional): Total size of the named models kept
+            loaded, 0 for no limit.
+        engine (str, optional): Inference engine of the named models.
+        prewarm (bool, optional): Warm up models before their first use.
+    """
+
+    def __init__(self, registry, paths, max_loaded=4, max_bytes=0, engine='xgboost',
+                 prewarm=True):
+        self.registry = registry
+        self.paths = dict(paths)
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self.engine = engine
+        self.prewarm = prewarm
+        self.encoders = registry.encoders
+        self._loaded = OrderedDict()  # name -> LoadedModel, least recently used first
+        self._lock = threading.Lock()
+        self.uses = {name: 0 for name in self.paths}
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, name=None):
+        """Returns the snapshot of model `name`, the default one for None.
+
+        Raises:
+            UnknownModel: If `name` isn't configured.
+        """
+        if name is None or name == 'default':
+            return self.registry.get()
+        if name not in self.paths:
+            raise UnknownModel(name)
+
+        with self._lock:
+            self.uses[name] += 1
+            loaded = self._loaded.get(name)
+            if loaded is not None:
+                self._loaded.move_to_end(name)
+                return loaded
+
+            # Loading under the lock, the default model never waits for it
+            loaded = load_model(self.paths[name], self.engine, self.encoders)
+            if self.prewarm:
+                loaded.warm_up()
+            self._loaded[name] = loaded
+            self.loads += 1
+            self._evict()
+
+        logger.info('Loaded model %s from %s (version %s) in %.1f ms',
+                    name, loaded.path, loaded.version, loaded.load_time * 1000)
+        return loaded
+
+    def _evict(self):
+        while len(self._loaded) > 1 and (
+                len(self._loaded) > self.max_loaded
+                or self.max_bytes and self.loaded_bytes() > self.max_bytes):
+            name, _ = self._loaded.popitem(last=False)
+            self.evictions += 1
+            logger.info('Evicted model %s', name)
+
+    def loaded_bytes(self):
+        return sum(loaded.size_bytes for loaded in list(self._loaded.values()))
+
+    def info(self):
+        loaded = dict(self._loaded)
+        return {
+            'default': self.registry.info(),
+            'models': {
+                name: {
+                    'path': path,
+                    'loaded': name in loaded,
+                    'uses': self.uses[name],
+                    **(loaded[name].info() if name in loaded else {}),
+                }
+                for name, path in self.paths.items()
+            },
+            'loaded_bytes': self.loaded_bytes(),
+            'max_loaded': self.max_loaded,
+            'max_bytes': self.max_bytes,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'shared_encoders': len(self.encoders),
+        }
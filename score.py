@@ -0,0 +1,310 @@
+# Bulk scoring of a file with a model artifact.
+#
+# The input is read in chunks by the main process and scored on a pool of
+# worker processes, each with its own copy of the model. Predictions are
+# written in input order and the progress is saved after every chunk, so
+# running the same command again after an interruption resumes where it
+# stopped.
+#
+# Usage:
+#     python score.py datasets/modified_human_age_prediction.csv predictions.csv
+#     python score.py records.parquet predictions.parquet --keep id --workers 8
+import collections
+import io
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from features import check_age_derived, prepare_features
+from registry import load_model
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+PREDICTION = 'prediction'
+
+
+def is_parquet(path):
+    return path.endswith(('.parquet', '.pq'))
+
+
+def csv_chunks(path, block_size, offset=0):
+    """Reads a CSV in blocks of whole lines.
+
+    Parsing happens in the workers, the main process only moves bytes. Rows
+    must not contain line breaks inside quoted values.
+
+    Yields:
+        tuple: The header line, the block and the file offset after it.
+    """
+    with open(path, 'rb') as f_in:
+        header = f_in.readline()
+        offset = max(offset, f_in.tell())
+        f_in.seek(offset)
+        while True:
+            block = f_in.read(block_size)
+            if not block:
+                return
+            if not block.endswith(b'\n'):
+                block += f_in.readline()
+            offset += len(block)
+            yield (header, block), offset
+
+
+def parquet_chunks(path, chunksize, offset=0):
+    """Reads a Parquet file in record batches, skipping the first `offset` rows.
+
+    Yields:
+        tuple: The record batch and the number of rows read after it.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+
+    # Skip whole row groups without reading them
+    first, start = 0, 0
+    while first < parquet_file.num_row_groups:
+        rows = parquet_file.metadata.row_group(first).num_rows
+        if start + rows > offset:
+            break
+        first, start = first + 1, start + rows
+
+    row_groups = range(first, parquet_file.num_row_groups)
+    for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups):
+        if start < offset:
+            skip = min(offset - start, batch.num_rows)
+            batch, start = batch.slice(skip), start + skip
+        if batch.num_rows:
+            start += batch.num_rows
+            yield (batch,), start
+
+
+# Model loaded once per worker process
+_worker = {}
+
+
+def _init_worker(model_file, engine):
+    loaded = load_model(model_file, engine)
+    if engine == 'xgboost':
+        # One thread per worker, the pool provides the parallelism
+        loaded.model.set_param({'nthread': 1})
+    _worker['loaded'] = loaded
+
+
+def score_frame(loaded, df, keep=()):
+    """Predicts a DataFrame of records.
+
+    Args:
+        loaded (LoadedModel): Model and encoder to use.
+        df (pandas.DataFrame): Records in the `modified_human_age_prediction.csv`
+            schema, or raw records in the `human_age_prediction.csv` schema.
+        keep (tuple, optional): Input columns copied to the output.
+
+    Returns:
+        pandas.DataFrame: The `keep` columns and the predictions.
+
+    Raises:
+        MissingFeatures: If raw records lack age derived features of the model.
+    """
+    out = df[list(keep)].reset_index(drop=True)
+    if 'blood_pressure_(s/d)' in df or 'Blood Pressure (s/d)' in df:
+        df = prepare_features(df)
+        check_age_derived(df, loaded.encoder.feature_names)
+    X = loaded.encoder.encode_frame(df)
+    out[PREDICTION] = loaded.predict(X) if len(X) else np.empty(0, np.float32)
+    return out
+
+
+def _score_chunk(data, keep):
+    if isinstance(data[0], bytes):
+        header, block = data
+        df = pd.read_csv(io.BytesIO(header + block))
+    else:
+        df = data[0].to_pandas()
+    return score_frame(_worker['loaded'], df, keep)
+
+
+class CsvOutput:
+    """Appends chunks to a CSV, truncated back to the last saved chunk on resume."""
+
+    def __init__(self, path, resume_at=None):
+        self.path = path
+        if resume_at is None:
+            self.f_out = open(path, 'wb')
+        else:
+            self.f_out = open(path, 'r+b')
+            self.f_out.truncate(resume_at)
+            self.f_out.seek(resume_at)
+
+    def write(self, df, chunk):
+        df.to_csv(self.f_out, header=self.f_out.tell() == 0, index=False)
+        self.f_out.flush()
+        os.fsync(self.f_out.fileno())
+        return self.f_out.tell()
+
+    def close(self):
+        self.f_out.close()
+
+
+class ParquetOutput:
+    """Writes one Parquet file per chunk into the output directory.
+
+    A Parquet file can't be appended to after a crash, so every chunk is a
+    separate part and resuming drops the parts after the last saved one.
+    """
+
+    def __init__(self, path, resume_at=None):
+        self.path = path
+        if resume_at is None:
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if resume_at is not None and name.startswith('part-') \
+                    and int(name[5:11]) >= resume_at:
+                os.remove(os.path.join(path, name))
+
+    def write(self, df, chunk):
+        part = os.path.join(self.path, f'part-{chunk:06d}.parquet')
+        df.to_parquet(f'{part}.tmp', index=False)
+        os.replace(f'{part}.tmp', part)
+        return chunk + 1
+
+    def close(self):
+        pass
+
+
+def _job(input_file, model_version, keep):
+    """Identifies the scoring job, the saved progress only applies to the same one."""
+    stat = os.stat(input_file)
+    return {
+        'input': os.path.abspath(input_file),
+        'input_size': stat.st_size,
+        'input_mtime_ns': stat.st_mtime_ns,
+        'model_version': model_version,
+        'keep': list(keep),
+    }
+
+
+def _save_progress(path, progress):
+    with open(f'{path}.tmp', 'w') as f_out:
+        json.dump(progress, f_out)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def score_file(input_file, output_file, model_file=MODEL_FILE, workers=None,
+               chunksize=100000, block_size=16 << 20, keep=(), restart=False,
+               report_every=5.0, engine='xgboost'):
+    """Scores every record of a CSV or Parquet file.
+
+    Memory is bounded by the chunks in flight, two per worker, not by the
+    size of the file.
+
+    Args:
+        input_file (str): CSV or Parquet (`.parquet`) file with the records.
+        output_file (str): CSV file, or directory of Parquet parts if the
+            name ends in `.parquet`.
+        model_file (str, optional): Native artifact or pickled `.bin` file.
+        workers (int, optional): Scoring processes, defaults to one per core.
+        chunksize (int, optional): Rows per chunk of a Parquet input.
+        block_size (int, optional): Bytes per chunk of a CSV input.
+        keep (tuple, optional): Input columns copied to the output, e.g. an id.
+        restart (bool, optional): Ignore the saved progress and start over.
+        report_every (float, optional): Seconds between progress lines.
+        engine (str, optional): `xgboost` or `numpy`, see trees.py.
+
+    Returns:
+        dict: The final progress: rows and chunks written, elapsed seconds.
+    """
+    workers = workers or os.cpu_count()
+    progress_file = f'{output_file}.progress'
+    job = _job(input_file, load_model(model_file).version, keep)
+
+    progress = None
+    if not restart and os.path.exists(progress_file) and os.path.exists(output_file):
+        with open(progress_file) as f_in:
+            progress = json.load(f_in)
+        if progress['job'] != job:
+            raise ValueError(f"{progress_file} belongs to a different input or model, "
+                             "use --restart to start over")
+        print(f"resuming after {progress['rows']:,} rows")
+    if progress is None:
+        progress = {'job': job, 'chunks': 0, 'rows': 0, 'position': 0, 'output': None,
+                    'seconds': 0.0}
+
+    if is_parquet(input_file):
+        chunks = parquet_chunks(input_file, chunksize, progress['position'])
+    else:
+        chunks = csv_chunks(input_file, block_size, progress['position'])
+    output_type = ParquetOutput if is_parquet(output_file) else CsvOutput
+    output = output_type(output_file, progress['output'])
+
+    start = time.perf_counter() - progress['seconds']
+    rows_before, seconds_before = progress['rows'], progress['seconds']
+    last_report = time.perf_counter()
+
+    def write(future, position):
+        nonlocal last_report
+        df = future.result()
+        progress['output'] = output.write(df, progress['chunks'])
+        progress['chunks'] += 1
+        progress['rows'] += len(df)
+        progress['position'] = position
+        progress['seconds'] = time.perf_counter() - start
+        _save_progress(progress_file, progress)
+
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            last_report = now
+            rate = (progress['rows'] - rows_before) / (progress['seconds'] - seconds_before)
+            print(f"{progress['rows']:,} rows, {rate:,.0f} rows/s")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_file, engine)) as pool:
+            in_flight = collections.deque()
+            for data, position in chunks:
+                in_flight.append((pool.submit(_score_chunk, data, tuple(keep)), position))
+                if len(in_flight) >= 2 * workers:
+                    write(*in_flight.popleft())
+            while in_flight:
+                write(*in_flight.popleft())
+    finally:
+        output.close()
+
+    elapsed = progress['seconds'] - seconds_before
+    rate = (progress['rows'] - rows_before) / elapsed if elapsed else 0.0
+    print(f"scored {progress['rows']:,} rows in {progress['chunks']} chunks, "
+          f"{rate:,.0f} rows/s")
+    return progress
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score a CSV or Parquet file in bulk.')
+    parser.add_argument('input', help='CSV or .parquet file with the records')
+    parser.add_argument('output', help='CSV file, or directory of parts for .parquet')
+    parser.add_argument('--model', default=MODEL_FILE,
+                        help='native artifact directory or pickled .bin file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='scoring processes, defaults to one per core')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='rows per chunk of a Parquet input')
+    parser.add_argument('--block-mb', type=float, default=16,
+                        help='megabytes per chunk of a CSV input')
+    parser.add_argument('--keep', nargs='*', default=[],
+                        help='input columns copied to the output, e.g. an id')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the saved progress and start over')
+    parser.add_argument('--engine', choices=['xgboost', 'numpy'], default='xgboost',
+                        help='evaluate the trees with XGBoost or NumPy')
+    args = parser.parse_args()
+
+    score_file(args.input, args.output, model_file=args.model, workers=args.workers,
+               chunksize=args.chunksize, block_size=int(args.block_mb * (1 << 20)),
+               keep=args.keep, restart=args.restart, engine=args.engine)
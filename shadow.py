@@ -0,0 +1,150 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Predictions of each model written per comparison in the log
+LOGGED_ROWS = 100
+
+
+class ShadowScorer:
+    """Scores a candidate model on the default model's traffic, off the request path.
+
+    After a request was answered by the default model, its encoded rows and
+    predictions are handed to a background thread that runs the candidate
+    on the same rows and logs both predictions and latencies as a JSON
+    line on the `shadow` logger. Clients never wait for the candidate and
+    never see its predictions. When `max_pending` comparisons are already
+    waiting, new ones are dropped rather than queued.
+    """
+
+    def __init__(self, pool, name, sample_rate=1.0, max_pending=64, on_result=None):
+        """
+        Args:
+            pool (ModelPool): Where the candidate model is loaded from.
+            name (str): Name of the candidate in the pool.
+            sample_rate (float): Fraction of the requests compared.
+            max_pending (int): Comparisons waiting at once before dropping.
+            on_result (callable, optional): Called with `scored`, `dropped`
+                or `failed`, plus the comparison dict when scored.
+        """
+        self.pool = pool
+        self.name = name
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.on_result = on_result
+        self._executor = None
+        self._lock = threading.Lock()
+        self._columns = {}  # (primary version, shadow version) -> column mapping
+        self.pending = 0
+
+        self.scored = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rows = 0
+        self.sum_abs_diff = 0.0
+        self.max_abs_diff = 0.0
+
+    def submit(self, primary, X, predictions, seconds):
+        """Queues a comparison, returns False if it was sampled out or dropped.
+
+        Args:
+            primary (LoadedModel): The model that answered the request.
+            X (numpy.ndarray): Rows it predicted, encoded by its encoder.
+            predictions (numpy.ndarray): Its predictions.
+            seconds (float): Time its prediction took.
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                dropped = True
+            else:
+                self.pending += 1
+                dropped = False
+            # Created in the serving process, not before gunicorn forks
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        if dropped:
+            self._notify('dropped')
+            return False
+
+        self._executor.submit(self._score, primary, X, predictions, seconds)
+        return True
+
+    def _align(self, primary, shadow, X):
+        """Rows of X in the shadow model's column order."""
+        if shadow.encoder is primary.encoder:
+            return X
+        key = (primary.version, shadow.version)
+        columns = self._columns.get(key)
+        if columns is None:
+            index = shadow.encoder.index
+            pairs = [(i, index[name]) for i, name in enumerate(primary.encoder.feature_names)
+                     if name in index]
+            columns = self._columns[key] = tuple(np.array(c, dtype=np.intp) for c in zip(*pairs))
+        aligned = np.full((len(X), shadow.encoder.n_features), np.nan, dtype=np.float32)
+        if columns:
+            aligned[:, columns[1]] = X[:, columns[0]]
+        return aligned
+
+    def _score(self, primary, X, predictions, seconds):
+        try:
+            shadow = self.pool.get(self.name)
+            start = time.perf_counter()
+            shadow_predictions = shadow.predict(self._align(primary, shadow, X))
+            shadow_seconds = time.perf_counter() - start
+        except Exception:
+            logger.exception('Shadow scoring with model %s failed', self.name)
+            with self._lock:
+                self.pending -= 1
+                self.failed += 1
+            self._notify('failed')
+            return
+
+        differences = np.abs(np.asarray(shadow_predictions, dtype=np.float64)
+                             - np.asarray(predictions, dtype=np.float64))
+        comparison = {
+            'primary': primary.version,
+            'shadow': shadow.version,
+            'shadow_name': self.name,
+            'rows': len(X),
+            'primary_ms': seconds * 1000,
+            'shadow_ms': shadow_seconds * 1000,
+            'mean_abs_diff': float(differences.mean()) if len(X) else 0.0,
+            'max_abs_diff': float(differences.max()) if len(X) else 0.0,
+            'primary_predictions': [float(y) for y in predictions[:LOGGED_ROWS]],
+            'shadow_predictions': [float(y) for y in shadow_predictions[:LOGGED_ROWS]],
+        }
+        with self._lock:
+            self.pending -= 1
+            self.scored += 1
+            self.rows += len(X)
+            self.sum_abs_diff += float(differences.sum())
+            self.max_abs_diff = max(self.max_abs_diff, comparison['max_abs_diff'])
+        logger.info(json.dumps(comparison))
+        self._notify('scored', comparison)
+
+    def _notify(self, result, comparison=None):
+        if self.on_result is not None:
+            self.on_result(result, comparison)
+
+    def stats(self):
+        return {
+            'model': self.name,
+            'sample_rate': self.sample_rate,
+            'pending': self.pending,
+            'scored': self.scored,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'rows': self.rows,
+            'mean_abs_diff': self.sum_abs_diff / self.rows if self.rows else 0.0,
+            'max_abs_diff': self.max_abs_diff,
+        }
@@ -0,0 +1,173 @@
+import math
+
+import numpy as np
+import xgboost as xgb
+from sklearn.feature_extraction import DictVectorizer
+
+from encoder import CompiledEncoder
+from features import TARGET, iter_dataset
+
+
+def in_test_split(index, test_size=0.2, seed=1):
+    """Deterministic train/test assignment by row number.
+
+    Every pass over the file must put a row on the same side of the split,
+    without keeping a list of test rows around, so the side is a hash of the
+    row number instead of a shuffle.
+    """
+    h = (np.asarray(index, dtype=np.uint64) + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+    return (h >> np.uint64(40)).astype(np.float64) / float(1 << 24) < test_size
+
+
+def fit_vectorizer(frames):
+    """Builds the DictVectorizer fitting on the per row dicts of `frames` would give.
+
+    The vocabulary is collected column by column, numeric columns by name
+    and categorical ones as `column=value` for the values present, without
+    building a dict per record, so the saved artifact stays compatible with
+    the server and predict.py.
+
+    Args:
+        frames (iterable): Prepared DataFrames, e.g. the chunks of a file.
+            The target column is ignored.
+
+    Returns:
+        DictVectorizer: A vectorizer with the fitted vocabulary.
+    """
+    names = set()
+    for frame in frames:
+        for column in frame.columns.drop(TARGET, errors='ignore'):
+            values = frame[column]
+            if values.dtype.kind in 'biuf':
+                names.add(column)
+            else:
+                for value in values.dropna().unique():
+                    names.add(f'{column}={value}')
+
+    dv = DictVectorizer(sparse=True)
+    dv.feature_names_ = sorted(names)
+    dv.vocabulary_ = {name: i for i, name in enumerate(dv.feature_names_)}
+    return dv
+
+
+def dataset_chunks(path, chunksize, use_cache=True):
+    """Returns a function iterating over the prepared chunks of a CSV.
+
+    With `use_cache` the chunks are slices of the memory mapped columnar
+    cache (dataset.py), built first if needed, otherwise the CSV is parsed
+    on every pass. Chunks are indexed by row number either way.
+    """
+    if use_cache:
+        from dataset import cached_dataset
+
+        def chunks():
+            df = cached_dataset(path, chunksize=chunksize)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+    else:
+        def chunks():
+            return iter_dataset(path, chunksize)
+    return chunks
+
+
+class ChunkIterator(xgb.DataIter):
+    """Feeds one side of the split to XGBoost chunk by chunk.
+
+    Used with `cache_prefix` set, XGBoost pages the encoded data to disk
+    (external memory), so memory stays bounded by the chunk size instead
+    of the dataset size.
+    """
+
+    def __init__(self, chunks, encoder, test, cache_prefix=None):
+        self.chunks = chunks  # Function iterating over the prepared chunks
+        self.encoder = encoder
+        self.test = test  # Which side of the split to yield
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._chunks = None
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = self.chunks()
+
+        for chunk in self._chunks:
+            chunk = chunk[in_test_split(chunk.index) == self.test]
+            if len(chunk):
+                input_data(data=self.encoder.encode_frame(chunk.drop(columns=TARGET)),
+                           label=chunk[TARGET].to_numpy(dtype=np.float32),
+                           feature_names=self.encoder.feature_names)
+                return True
+        return False
+
+
+class RunningMetrics:
+    """RMSE, MAE, MSE and R² accumulated chunk by chunk."""
+
+    def __init__(self):
+        self.n = 0
+        self.sum_error = 0.0
+        self.sum_abs_error = 0.0
+        self.sum_squared_error = 0.0
+        self.sum_y = 0.0
+        self.sum_y_squared = 0.0
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.float64)
+        error = y_true - y_pred
+        self.n += len(y_true)
+        self.sum_abs_error += float(np.abs(error).sum())
+        self.sum_squared_error += float((error ** 2).sum())
+        self.sum_y += float(y_true.sum())
+        self.sum_y_squared += float((y_true ** 2).sum())
+
+    def results(self):
+        mse = self.sum_squared_error / self.n
+        total = self.sum_y_squared - self.sum_y ** 2 / self.n
+        return {
+            'rmse': math.sqrt(mse),
+            'mae': self.sum_abs_error / self.n,
+            'mse': mse,
+            'r2': 1 - self.sum_squared_error / total,
+        }
+
+
+def evaluate_streaming(model, chunks, encoder):
+    """Scores the test side of the split chunk by chunk."""
+    metrics = RunningMetrics()
+    for chunk in chunks():
+        chunk = chunk[in_test_split(chunk.index)]
+        if len(chunk):
+            X = encoder.encode_frame(chunk.drop(columns=TARGET))
+            metrics.update(chunk[TARGET], model.inplace_predict(X))
+    return metrics.results()
+
+
+def train_streaming(path, params, num_boost_round, chunksize, cache_dir, use_cache=True):
+    """Trains on a CSV of any size with bounded memory.
+
+    Args:
+        path (str): CSV in the raw dataset schema.
+        params (dict): XGBoost parameters.
+        num_boost_round (int): Boosting rounds.
+        chunksize (int): Rows read, encoded and handed to XGBoost at a time.
+        cache_dir (str): Directory for XGBoost's external memory pages.
+        use_cache (bool, optional): Read the chunks from the prepared dataset
+            cache (dataset.py) instead of parsing the CSV on every pass.
+
+    Returns:
+        tuple: The fitted DictVectorizer, the Booster and the test metrics.
+    """
+    chunks = dataset_chunks(path, chunksize, use_cache)
+    dv = fit_vectorizer(chunks())
+    encoder = CompiledEncoder.from_vectorizer(dv)
+
+    it = ChunkIterator(chunks, encoder, test=False, cache_prefix=f'{cache_dir}/train')
+    d_train = xgb.DMatrix(it, missing=np.nan)
+
+    # External memory needs the hist tree method
+    params = {**params, 'tree_method': 'hist'}
+    model = xgb.train(params, d_train, num_boost_round=num_boost_round)
+
+    return dv, model, evaluate_streaming(model, chunks, encoder)
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Keep the app's startup light in tests
+os.environ.setdefault('SWAGGER', '0')
+os.environ.setdefault('MODEL_CHECK_INTERVAL', '0')
+# Tests that check the rate limiter install their own
+os.environ.setdefault('RATE_LIMIT_CAPACITY', '1000000')
@@ -0,0 +1,59 @@
+import os
+import shutil
+
+import pytest
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+
+
+@pytest.fixture()
+def app_module(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secret')
+    return app
+
+
+def reload(app_module, path=None, token='secret'):
+    headers = {'X-Admin-Token': token} if token is not None else {}
+    body = {'path': path} if path is not None else {}
+    return app_module.app.test_client().post('/admin/reload', json=body, headers=headers)
+
+
+def test_reload_is_refused_without_a_configured_token(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', None)
+    assert reload(app_module, token=None).status_code == 403
+    assert reload(app_module, token='').status_code == 403
+
+
+def test_reload_needs_the_right_token(app_module):
+    assert reload(app_module, token=None).status_code == 403
+    assert reload(app_module, token='wrong').status_code == 403
+    response = reload(app_module)
+    assert response.status_code == 200
+    assert response.get_json()['path'] == MODEL_FILE
+
+
+def test_reload_never_unpickles_a_client_path(app_module, monkeypatch):
+    import registry
+
+    def fail(_data):
+        raise AssertionError('unpickled a client supplied path')
+
+    monkeypatch.setattr(registry.pickle, 'loads', fail)
+    response = reload(app_module, 'model_xgb_eta=0.1_score=1.206.bin')
+    assert response.status_code == 400
+    assert 'native model artifact' in response.get_json()['detail']
+
+
+def test_reload_only_loads_artifacts_from_the_model_dir(app_module, tmp_path):
+    outside = tmp_path / 'copy.model'
+    shutil.copytree(MODEL_FILE, outside)
+    response = reload(app_module, str(outside))
+    assert response.status_code == 400
+    assert 'Only artifacts in' in response.get_json()['detail']
+
+    # Relative paths can't climb out of it either
+    escaping = os.path.relpath(outside, app_module.MODEL_DIR)
+    assert reload(app_module, escaping).status_code == 400
+    assert app_module.registry.get().path == MODEL_FILE
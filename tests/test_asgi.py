@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi():
+    import asgi
+
+    return asgi
+
+
+@pytest.fixture(scope='module')
+def query():
+    import app
+
+    return app.predict_age.__defaults__[0]
+
+
+def server(asgi, **kwargs):
+    return asgi.AsyncPredictServer(asgi.flask_app.app, threads=2, **kwargs)
+
+
+async def request(app, path='/predict', body=None, headers=None, method='POST',
+                  disconnect=False):
+    """Sends one http request through the ASGI app, returns the status, headers and JSON."""
+    body = json.dumps(body).encode() if not isinstance(body, bytes) and body is not None \
+        else body or b''
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'client': ('127.0.0.1', 1234), 'server': ('localhost', 5000),
+             'headers': [(b'content-type', b'application/json')]
+                        + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+    messages = [{'type': 'http.disconnect'}] if disconnect else \
+        [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+    done = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        if message['type'] == 'http.response.body':
+            done.set()
+
+    await app(scope, receive, send)
+    if not sent:
+        return None, {}, None
+    headers = {k.decode(): v.decode() for k, v in sent[0]['headers']}
+    return sent[0]['status'], headers, json.loads(sent[1]['body'])
+
+
+def call(app, **kwargs):
+    return asyncio.run(request(app, **kwargs))
+
+
+def test_predictions_match_the_flask_app(asgi, query):
+    status, _, body = call(server(asgi), body={'query': query})
+    assert status == 200
+    expected = asgi.flask_app.app.test_client().post('/predict', json={'query': query})
+    assert body == expected.get_json()
+
+
+def test_bad_requests(asgi, query):
+    app = server(asgi)
+    assert call(app, body=b'{')[0] == 400
+    assert call(app, body={'nope': 1})[0] == 400
+    status, _, body = call(app, body={'query': {**query, 'bmi': 500.0}})
+    assert status == 400
+    assert [e['field'] for e in body['errors']] == ['bmi']
+    assert call(app, body={'query': query, 'model': 'missing'})[0] == 404
+    assert call(server(asgi, max_body_bytes=10), body={'query': query})[0] == 413
+
+
+def test_requests_beyond_max_in_flight_are_refused(asgi, query):
+    status, headers, body = call(server(asgi, max_in_flight=0), body={'query': query})
+    assert status == 503
+    assert headers['retry-after'] == '1'
+    assert 'Server busy' in body['detail']
+
+
+def test_slow_predictions_miss_their_deadline(asgi, monkeypatch, query):
+    release = threading.Event()
+    predict_age = asgi.flask_app.predict_age
+
+    def slow(*args, **kwargs):
+        release.wait(5)
+        return predict_age(*args, **kwargs)
+
+    monkeypatch.setattr(asgi.flask_app, 'predict_age', slow)
+    app = server(asgi, timeout=5)
+
+    async def scenario():
+        try:
+            answer = await request(app, body={'query': query},
+                                   headers={'X-Request-Timeout-Ms': '50'})
+        finally:
+            release.set()
+        # The slot is freed once the thread is done, not when the 504 is sent
+        for _ in range(500):
+            if not app.in_flight:
+                break
+            await asyncio.sleep(0.01)
+        return answer
+
+    status, _, body = asyncio.run(scenario())
+    assert status == 504
+    assert body == {'detail': 'Deadline exceeded'}
+    assert app.in_flight == 0
+
+
+def test_work_past_its_deadline_is_dropped_without_running(asgi, monkeypatch, query):
+    monkeypatch.setattr(asgi.flask_app, 'predict_age', pytest.fail)
+    with pytest.raises(asgi.DeadlineExceeded):
+        asgi.run_prediction(query, True, deadline=0)
+
+
+def test_clients_that_left_get_no_answer(asgi, query):
+    app = server(asgi)
+    assert call(app, body={'query': query}, disconnect=True) == (None, {}, None)
+    assert app.in_flight == 0
+
+
+def test_other_routes_are_served_by_flask(asgi):
+    status, _, body = call(server(asgi), path='/health', method='GET')
+    assert (status, body) == (200, {'status': 'ok'})
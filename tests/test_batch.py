@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    import app
+
+    return app
+
+
+@pytest.fixture(scope='module')
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture(scope='module')
+def query(app_module):
+    return app_module.predict_age.__defaults__[0]
+
+
+def predict(client, query):
+    return client.post('/predict', json={'query': query}).get_json()['result']
+
+
+def test_rows_are_answered_in_order_with_their_errors(client, query):
+    other = {**query, 'bmi': 22.0}
+    response = client.post('/predict/batch', json={'queries': [
+        query, {**query, 'bmi': 500.0}, 'not a record', other, {**query, 'diet': 'Carnivore'}]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['errors'] == 3
+    results = body['results']
+    assert results[0] == {'result': predict(client, query)}
+    assert results[3] == {'result': predict(client, other)}
+    assert [e['field'] for e in results[1]['errors']] == ['bmi']
+    assert 'must be an object' in results[2]['detail']
+    assert [e['field'] for e in results[4]['errors']] == ['diet']
+
+
+def test_a_bare_list_of_records(client, query):
+    body = client.post('/predict/batch', json=[query, query]).get_json()
+    assert body['errors'] == 0
+    assert body['results'][0] == body['results'][1] == {'result': predict(client, query)}
+
+
+def test_json_lines_report_unparsable_lines(client, query):
+    lines = '\n'.join([json.dumps(query), '{not json', '', json.dumps(query)])
+    response = client.post('/predict/batch', data=lines, content_type='application/x-ndjson')
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['errors'] == 1
+    assert body['results'][0] == body['results'][2] == {'result': predict(client, query)}
+    assert body['results'][1]['detail'].startswith('Invalid JSON')
+
+
+def test_positional_rows(app_module, client, query):
+    features = client.get('/model/features').get_json()['features']
+    row = [query[name] for name in features]
+    out_of_range = list(row)
+    out_of_range[features.index('bmi')] = 500.0
+    body = client.post('/predict/batch', json={'queries': [row, out_of_range]}).get_json()
+    assert body['errors'] == 1
+    assert float(body['results'][0]['result']) == pytest.approx(float(predict(client, query)))
+    assert [e['field'] for e in body['results'][1]['errors']] == ['bmi']
+
+    response = client.post('/predict/batch', json={'queries': [row[:-1]]})
+    assert response.status_code == 400
+
+
+def test_rejected_batches(app_module, client, monkeypatch, query):
+    assert client.post('/predict/batch', json={'queries': []}).status_code == 400
+    assert client.post('/predict/batch', json={'nope': 1}).status_code == 400
+    assert client.post('/predict/batch', data=b'{', content_type='application/json') \
+        .status_code == 400
+    response = client.post('/predict/batch', json={'queries': [query], 'model': 'missing'})
+    assert response.status_code == 404
+
+    monkeypatch.setattr(app_module, 'MAX_BATCH_SIZE', 2)
+    response = client.post('/predict/batch', json={'queries': [query] * 3})
+    assert response.status_code == 413
@@ -0,0 +1,42 @@
+import numpy as np
+
+from cache import PredictionCache, row_key
+
+
+def test_models_share_the_cache_without_evicting_each_other():
+    cache = PredictionCache(max_size=10, ttl=0)
+    key = row_key(np.array([1.0, np.nan], dtype=np.float32))
+    cache.put('v1', key, 1.0)
+    cache.put('v2', key, 2.0)
+    # Alternating between models keeps hitting
+    for _ in range(3):
+        assert cache.get('v1', key) == 1.0
+        assert cache.get('v2', key) == 2.0
+    assert cache.stats()['hit_rate'] == 1.0
+    assert cache.stats()['versions'] == {'v1': 1, 'v2': 1}
+
+
+def test_other_versions_never_see_an_entry():
+    cache = PredictionCache(max_size=10, ttl=0)
+    cache.put('v1', b'k', 1.0)
+    assert cache.get('v2', b'k') is None
+
+
+def test_entries_of_replaced_versions_age_out():
+    cache = PredictionCache(max_size=3, ttl=0)
+    for i in range(3):
+        cache.put('old', bytes([i]), float(i))
+    for i in range(3):
+        cache.put('new', bytes([i]), float(i))
+    assert cache.stats()['versions'] == {'new': 3}
+
+
+def test_expired_entries_are_misses():
+    cache = PredictionCache(max_size=3, ttl=1e-9)
+    cache.put('v1', b'k', 1.0)
+    assert cache.get('v1', b'k') is None
+
+
+def test_equivalent_rows_share_a_key():
+    assert row_key(np.array([-0.0, 1], dtype=np.float32)) == \
+        row_key(np.array([0.0, 1.0], dtype=np.float64))
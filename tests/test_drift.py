@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import drift
+from drift import DriftSketch, drift_scores, reference_profile, update_profile
+from features import TARGET, prepare_features
+from registry import load_model
+
+DATA_FILE = 'datasets/human_age_prediction.csv'
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+
+
+@pytest.fixture(scope='module')
+def encoded():
+    loaded = load_model(MODEL_FILE)
+    df = prepare_features(pd.read_csv(DATA_FILE))
+    return loaded.encoder, loaded.encoder.encode_frame(df.drop(columns=TARGET))
+
+
+def test_update_counts_the_new_rows_in_the_base_bins(encoded):
+    encoder, X = encoded
+    base = reference_profile(X[:2000], encoder.feature_names, encoder.separator)
+    updated = update_profile(base, X[2000:])
+
+    whole = DriftSketch(base)
+    whole.update(X)
+    np.testing.assert_array_equal(updated['counts'], whole.counts)
+    assert updated['numeric'] == base['numeric']
+    assert updated['source_rows'] == len(X)
+
+
+def test_update_weights_new_rows_like_a_sampled_profile(encoded):
+    encoder, X = encoded
+    base = reference_profile(X[:2000], encoder.feature_names, encoder.separator, rows=500)
+    updated = update_profile(base, X[2000:])
+    # 500 of 2000 rows counted, the 1000 new ones count for 250
+    assert updated['counts'][0] == pytest.approx(750)
+    assert updated['source_rows'] == 3000
+
+
+def test_serving_the_training_distribution_doesnt_drift(encoded):
+    encoder, X = encoded
+    profile = reference_profile(X[:1500], encoder.feature_names, encoder.separator)
+    sketch = DriftSketch(profile)
+    sketch.update(X[1500:])
+    assert drift_scores(profile, sketch)['drifted'] == []
+
+
+def test_incremental_publish_doesnt_reread_the_history(tmp_path, monkeypatch, encoded):
+    import incremental
+
+    encoder, X = encoded
+
+    def fail(*args, **kwargs):
+        raise AssertionError('read the whole training data')
+
+    monkeypatch.setattr(drift, 'dataset_profile', fail)
+    base = load_model(MODEL_FILE)
+    new_rows = tmp_path / 'new.csv'
+    pd.read_csv(DATA_FILE).tail(600).to_csv(new_rows, index=False)
+
+    result = incremental.retrain(MODEL_FILE, new_data=str(new_rows), rounds=2)
+    path = incremental.publish(result, str(tmp_path / 'updated.model'))
+    profile = load_model(path).meta['profile']
+    assert profile['counts'][0] == base.meta['profile']['counts'][0] + 600
+    assert profile['numeric'] == base.meta['profile']['numeric']
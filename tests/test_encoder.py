@@ -0,0 +1,90 @@
+import math
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from encoder import CompiledEncoder, check_parity
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.bin'
+
+# The pickle was written by older scikit-learn and XGBoost versions
+pytestmark = pytest.mark.filterwarnings('ignore')
+
+
+@pytest.fixture(scope='module')
+def model():
+    with open(MODEL_FILE, 'rb') as f_in:
+        dv, booster = pickle.load(f_in)
+    df = pd.read_csv(os.path.join('datasets', 'modified_human_age_prediction.csv'))
+    humans = df.drop(columns='age_(years)').to_dict(orient='records')
+    return dv, booster, humans
+
+
+def test_parity_on_the_dataset(model):
+    dv, booster, humans = model
+    assert check_parity(dv, booster, humans) <= 1e-6
+
+
+def test_unknown_categories_and_keys_are_ignored(model):
+    dv, booster, humans = model
+    humans = [{**human} for human in humans[:200]]
+    for i, human in enumerate(humans):
+        if i % 2:
+            human['diet'] = 'Carnivore'
+            human['gender'] = 'Other'
+        if i % 3:
+            human['favourite_colour'] = 'Blue'
+            human['shoe_size'] = 42.0
+    check_parity(dv, booster, humans, tolerance=1e-6)
+
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    X = encoder.encode(humans[1])
+    diet = [encoder.index[name] for name in encoder.feature_names if name.startswith('diet=')]
+    assert np.isnan(X[0, diet]).all()
+
+
+def test_missing_fields(model):
+    dv, booster, humans = model
+    fields = list(humans[0])
+    humans = [{key: value for j, (key, value) in enumerate(human.items()) if (i + j) % 4}
+              for i, human in enumerate(humans[:200])]
+    humans += [{}, {fields[0]: humans[0].get(fields[0], 1.0)}]
+    check_parity(dv, booster, humans, tolerance=1e-6)
+
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    assert np.isnan(encoder.encode({})).all()
+
+
+def test_nan_inputs(model):
+    dv, booster, humans = model
+    humans = [{key: math.nan if isinstance(value, float) and (i + j) % 5 == 0 else value
+               for j, (key, value) in enumerate(human.items())}
+              for i, human in enumerate(humans[:200])]
+    check_parity(dv, booster, humans, tolerance=1e-6)
+
+
+def test_frames_encode_like_records(model):
+    dv, _, humans = model
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    df = pd.DataFrame(humans[:500])
+    df.loc[::7, 'diet'] = 'Carnivore'
+    df.loc[::5, 'bmi'] = np.nan
+    df.loc[::3, 'gender'] = np.nan
+    expected = encoder.encode_many(df.to_dict(orient='records'))
+    np.testing.assert_array_equal(encoder.encode_frame(df), expected)
+
+
+def test_empty_batches(model):
+    dv, booster, _ = model
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    assert encoder.encode_many([]).shape == (0, encoder.n_features)
+    assert check_parity(dv, booster, []) == 0.0
+
+
+def test_a_different_vocabulary_is_rejected(model):
+    dv, booster, _ = model
+    with pytest.raises(ValueError):
+        CompiledEncoder(dv.feature_names_[:-1]).check_model(booster)
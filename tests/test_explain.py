@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from cache import PredictionCache
+from explain import Explainer
+
+
+@pytest.fixture()
+def app_module(monkeypatch):
+    import app
+
+    explainer = Explainer(None, max_pending=2)
+    monkeypatch.setattr(app, 'explainer', explainer)
+    return app
+
+
+@pytest.fixture(scope='module')
+def query():
+    import app
+
+    return app.predict_age.__defaults__[0]
+
+
+def explain(app_module, body):
+    return app_module.app.test_client().post('/explain', json=body)
+
+
+def test_contributions_add_up_to_the_prediction(app_module, query):
+    response = explain(app_module, {'query': query, 'top_k': 3})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert len(result['contributions']) == 3
+    total = result['base_value'] + result['other'] + sum(
+        c['contribution'] for c in result['contributions'])
+    assert total == pytest.approx(result['prediction'], abs=1e-3)
+
+    prediction = app_module.app.test_client().post('/predict', json={'query': query})
+    assert result['prediction'] == pytest.approx(float(prediction.get_json()['result']), abs=1e-2)
+
+
+def test_batches_report_invalid_rows(app_module, query):
+    response = explain(app_module, {'queries': [query, 'nope', {**query, 'bmi': 'high'}]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['errors'] == 2
+    assert 'prediction' in body['results'][0]
+    assert body['results'][1]['errors'] and body['results'][2]['errors']
+
+
+def test_explanations_never_hold_every_request_thread(app_module):
+    assert app_module.EXPLAIN_MAX_PENDING < app_module.THREADS
+
+
+def test_a_full_pool_is_answered_with_503_at_once(app_module, query):
+    app_module.explainer.pending = app_module.explainer.max_pending
+    response = explain(app_module, {'query': query})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert app_module.explainer.stats()['refused'] == 1
+
+
+def test_slow_explanations_are_answered_with_504(app_module, monkeypatch, query):
+    release = threading.Event()
+    contributions = app_module.explainer.contributions
+
+    def slow(*args):
+        release.wait(5)
+        return contributions(*args)
+
+    monkeypatch.setattr(app_module.explainer, 'contributions', slow)
+    monkeypatch.setattr(app_module, 'EXPLAIN_TIMEOUT_MS', 50)
+    try:
+        response = explain(app_module, {'query': query})
+        assert response.status_code == 504
+    finally:
+        release.set()
+
+
+def test_explanations_have_their_own_cache(app_module, monkeypatch, query):
+    cache, explain_cache = PredictionCache(), PredictionCache()
+    monkeypatch.setattr(app_module, 'cache', cache)
+    monkeypatch.setattr(app_module, 'explain_cache', explain_cache)
+    monkeypatch.setattr(app_module, 'explainer', Explainer(explain_cache))
+
+    first = explain(app_module, {'query': query}).get_json()
+    second = explain(app_module, {'query': query}).get_json()
+    assert first == second
+    assert explain_cache.stats()['hits'] == 1
+    assert cache.stats()['hits'] == cache.stats()['misses'] == 0
+
+    stats = app_module.app.test_client().get('/cache').get_json()
+    assert stats['explanations']['hits'] == 1
+    assert stats['misses'] == 0
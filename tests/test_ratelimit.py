@@ -0,0 +1,108 @@
+import sys
+import time
+
+import pytest
+
+from ratelimit import MemoryBackend, SharedMemoryBackend, client_key, create_backend
+
+API_KEYS = frozenset({'team-a', 'team-b'})
+
+
+def test_only_configured_api_keys_get_their_own_bucket():
+    assert client_key('team-a', '10.0.0.1', API_KEYS).startswith('key:')
+    assert client_key('team-a', '10.0.0.1', API_KEYS) == client_key('team-a', '10.0.0.2',
+                                                                    API_KEYS)
+    assert client_key('made-up', '10.0.0.1', API_KEYS) == 'ip:10.0.0.1'
+    assert client_key(None, '10.0.0.1', API_KEYS) == 'ip:10.0.0.1'
+    # Keys aren't stored in clear
+    assert 'team-a' not in client_key('team-a', '10.0.0.1', API_KEYS)
+
+
+def test_rotating_unknown_keys_doesnt_refill_the_bucket():
+    limiter = MemoryBackend(capacity=3, refill_rate=0.001, max_keys=2)
+    allowed = [limiter.take(client_key(f'key-{i}', '10.0.0.1', API_KEYS)).allowed
+               for i in range(5)]
+    assert allowed == [True, True, True, False, False]
+    assert len(limiter) == 1
+
+
+@pytest.fixture(params=['memory', 'shared', 'redis'])
+def backend(request):
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        return create_backend('redis', capacity=3, refill_rate=10,
+                              redis_client=fakeredis.FakeRedis())
+    return create_backend(request.param, capacity=3, refill_rate=10, max_keys=64)
+
+
+def test_backends_limit_each_client_to_its_capacity(backend):
+    decisions = [backend.take('ip:a') for _ in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert [d.remaining for d in decisions] == [2, 1, 0, 0]
+    assert decisions[-1].headers()['Retry-After'] == '1'
+    # Other clients have their own bucket
+    assert backend.take('ip:b').allowed
+
+
+def test_backends_refill_over_time(backend):
+    for _ in range(3):
+        backend.take('ip:a')
+    assert not backend.take('ip:a').allowed
+    time.sleep(0.15)
+    assert backend.take('ip:a').allowed
+
+
+def test_redis_backend_without_the_package_names_the_extra(monkeypatch):
+    # An import of a None entry raises ImportError, like a missing package
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    with pytest.raises(ImportError, match='redis extra'):
+        create_backend('redis', capacity=3, refill_rate=10, redis_url='redis://localhost')
+
+
+def test_redis_buckets_expire_once_full_again():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    backend = create_backend('redis', capacity=3, refill_rate=10, redis_client=client)
+    backend.take('ip:a')
+    assert 0 < client.pttl('ratelimit:ip:a') <= 300
+
+
+def test_shared_memory_table_is_bounded():
+    limiter = SharedMemoryBackend(capacity=1, refill_rate=0.001, slots=8)
+    for i in range(100):
+        limiter.take(f'ip:{i}')
+    assert len(limiter._table) == 8 * 3
+
+
+def test_the_app_ignores_unknown_api_keys(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'API_KEYS', API_KEYS)
+    monkeypatch.setattr(app, 'limiter', MemoryBackend(capacity=2, refill_rate=0.001))
+    client = app.app.test_client()
+    statuses = [client.get('/model', headers={'X-API-Key': f'key-{i}'}).status_code
+                for i in range(3)]
+    assert statuses == [200, 200, 429]
+    # A configured key has its own bucket
+    assert client.get('/model', headers={'X-API-Key': 'team-a'}).status_code == 200
+
+
+def test_the_async_server_uses_the_same_keys(monkeypatch):
+    httpx = pytest.importorskip('httpx')
+    import asyncio
+
+    import app
+    import asgi
+
+    monkeypatch.setattr(app, 'API_KEYS', API_KEYS)
+    monkeypatch.setattr(app, 'limiter', MemoryBackend(capacity=2, refill_rate=0.001))
+    query = app.predict_age.__defaults__[0]
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return [(await client.post('/predict', json={'query': query},
+                                       headers={'X-API-Key': f'key-{i}'})).status_code
+                    for i in range(3)]
+
+    assert asyncio.run(run()) == [200, 200, 429]
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import train_test_split
+
+from features import AGE_DERIVED, TARGET, MissingFeatures, prepare_features
+from registry import load_model
+from score import score_frame
+
+DATA_FILE = 'datasets/human_age_prediction.csv'
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+# Test RMSE of the model in its file name
+MODEL_RMSE = 1.206
+
+
+@pytest.fixture(scope='module')
+def test_split():
+    # The test split of train.py, in the raw schema
+    df = pd.read_csv(DATA_FILE)
+    _, df_test = train_test_split(df, test_size=0.2, random_state=1)
+    return df_test.reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    import app
+
+    return app
+
+
+def raw_records(df, with_age_derived):
+    """Raw records without the age, optionally with the age derived features."""
+    records = df.drop(columns='Age (years)')
+    if with_age_derived:
+        prepared = prepare_features(df)
+        for name in AGE_DERIVED:
+            records[name] = prepared[name]
+    return records.replace({np.nan: None}).to_dict(orient='records')
+
+
+def rmse(y, predictions):
+    return float(np.sqrt(np.mean((np.asarray(predictions, dtype=float) - y) ** 2)))
+
+
+def test_raw_records_match_the_training_accuracy(app_module, test_split):
+    predictions = app_module.predict_age_raw(raw_records(test_split, True), use_cache=False)
+    assert rmse(test_split['Age (years)'].to_numpy(), predictions) < MODEL_RMSE + 0.01
+
+
+def test_raw_records_match_the_prepared_path(app_module, test_split):
+    loaded = load_model(MODEL_FILE)
+    prepared = prepare_features(test_split).drop(columns=TARGET)
+    expected = loaded.predict(loaded.encoder.encode_frame(prepared))
+    predictions = app_module.predict_age_raw(raw_records(test_split, True), use_cache=False)
+    np.testing.assert_allclose(predictions, expected, rtol=1e-6)
+
+
+def test_raw_records_without_age_derived_features_are_rejected(app_module, test_split):
+    records = raw_records(test_split.head(5), True)
+    del records[3]['hearing_age_interaction']
+    records[4]['bone_density_decline_rate'] = None
+    with pytest.raises(MissingFeatures) as error:
+        app_module.predict_age_raw(records, use_cache=False)
+    assert error.value.rows == [3, 4]
+
+    response = app_module.app.test_client().post(
+        '/predict/raw', json={'queries': raw_records(test_split.head(2), False)})
+    assert response.status_code == 422
+    assert response.get_json()['features'] == AGE_DERIVED
+
+
+def test_score_frame_rejects_raw_files_without_age_derived_features(test_split):
+    loaded = load_model(MODEL_FILE)
+    with pytest.raises(MissingFeatures):
+        score_frame(loaded, test_split.drop(columns='Age (years)'))
+    scored = score_frame(loaded, test_split)
+    assert rmse(test_split['Age (years)'].to_numpy(), scored['prediction']) < MODEL_RMSE + 0.01
@@ -0,0 +1,102 @@
+import json
+import multiprocessing
+import shutil
+import time
+
+import pytest
+
+from registry import ModelRegistry
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+
+
+@pytest.fixture()
+def artifacts(tmp_path):
+    # Two copies of the artifact with different versions
+    paths = []
+    for name in ('a', 'b'):
+        path = tmp_path / f'{name}.model'
+        shutil.copytree(MODEL_FILE, path)
+        meta = json.loads((path / 'meta.json').read_text())
+        meta['copy'] = name
+        (path / 'meta.json').write_text(json.dumps(meta))
+        paths.append(str(path))
+    return paths
+
+
+def worker(path, state_dir, ready, done):
+    # Another serving process, it only watches and never gets a request
+    registry = ModelRegistry(path, check_interval=0.05, prewarm=False, state_dir=state_dir)
+    registry.load()
+    registry.start_watching()
+    ready.set()
+    done.wait(60)
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+def test_publish_reaches_every_process(artifacts, tmp_path):
+    a, b = artifacts
+    state_dir = str(tmp_path / 'state')
+    context = multiprocessing.get_context('spawn')
+    ready, done = context.Event(), context.Event()
+    process = context.Process(target=worker, args=(a, state_dir, ready, done))
+    process.start()
+    try:
+        assert ready.wait(60)
+        registry = ModelRegistry(a, check_interval=0, prewarm=False, state_dir=state_dir)
+        registry.load()
+
+        def versions():
+            return {w['pid']: w['version'] for w in registry.cluster()['workers']}
+
+        wait_for(lambda: process.pid in versions())
+        assert registry.cluster()['consistent']
+
+        new = registry.publish(b)
+        wait_for(lambda: versions().get(process.pid) == new.version)
+        cluster = registry.cluster()
+        assert cluster['consistent']
+        assert {w['generation'] for w in cluster['workers']} == {registry.generation}
+
+        # Publishing the same path again is followed too
+        registry.publish(b)
+        wait_for(lambda: all(w['generation'] == registry.generation
+                             for w in registry.cluster()['workers']))
+    finally:
+        done.set()
+        process.join(30)
+
+    # Workers that exited aren't reported
+    assert process.pid not in versions()
+
+
+def test_a_failing_publish_is_never_propagated(artifacts, tmp_path):
+    a, _ = artifacts
+    state_dir = tmp_path / 'state'
+    registry = ModelRegistry(a, check_interval=0, prewarm=False, state_dir=str(state_dir))
+    registry.load()
+    with pytest.raises(Exception):
+        registry.publish(str(tmp_path / 'missing.model'))
+    assert not (state_dir / 'pointer.json').exists()
+    assert registry.get().path == a
+
+
+def test_a_new_process_follows_the_published_model(artifacts, tmp_path):
+    # Like a worker recycled by gunicorn, started with the configured model
+    a, b = artifacts
+    state_dir = str(tmp_path / 'state')
+    first = ModelRegistry(a, check_interval=0, prewarm=False, state_dir=state_dir)
+    first.load()
+    first.publish(b)
+
+    second = ModelRegistry(a, check_interval=0.01, prewarm=False, state_dir=state_dir)
+    second.load()
+    time.sleep(0.02)
+    assert second.get().path == b
+    assert second.generation == first.generation
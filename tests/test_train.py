@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.model_selection import train_test_split
+
+import train
+from dataset import cached_dataset
+from encoder import CompiledEncoder
+from streaming import dataset_chunks, fit_vectorizer
+
+TARGET = 'age_(years)'
+
+
+def dense(X):
+    """A sparse DictVectorizer matrix with its absent entries as NaN, like XGBoost reads it."""
+    X = X.tocoo()
+    result = np.full(X.shape, np.nan, dtype=np.float32)
+    result[X.row, X.col] = X.data
+    return result
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    return cached_dataset(train.DATA_FILE, cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+def test_the_vocabulary_matches_dict_vectorizer(dataset):
+    df = dataset.drop(columns=TARGET)
+    dv = DictVectorizer().fit(df.to_dict(orient='records'))
+    assert fit_vectorizer([df]).feature_names_ == dv.feature_names_
+    # Fitted on chunks, the vocabulary is the one of the whole frame
+    chunks = [df.iloc[start:start + 700] for start in range(0, len(df), 700)]
+    assert fit_vectorizer(chunks).feature_names_ == dv.feature_names_
+
+
+def test_prepared_matrices_match_dict_vectorizer(monkeypatch, dataset):
+    monkeypatch.setattr(train, 'cached_dataset', lambda data_file: dataset)
+    dv, X_full_train, y_full_train, X_test, y_test = train.prepare_data(train.DATA_FILE)
+
+    # The split and the per record encoding train.py used before
+    df_train, df_test = train_test_split(dataset, test_size=0.2, random_state=1)
+    expected_dv = DictVectorizer(sparse=True)
+    expected_train = expected_dv.fit_transform(
+        df_train.drop(columns=TARGET).to_dict(orient='records'))
+    expected_test = expected_dv.transform(df_test.drop(columns=TARGET).to_dict(orient='records'))
+
+    assert dv.feature_names_ == expected_dv.feature_names_
+    assert X_full_train.dtype == np.float32
+    np.testing.assert_array_equal(X_full_train, dense(expected_train))
+    np.testing.assert_array_equal(X_test, dense(expected_test))
+    np.testing.assert_array_equal(y_full_train, df_train[TARGET])
+
+
+def test_cached_chunks_match_the_parsed_ones():
+    parsed = list(dataset_chunks(train.DATA_FILE, 1000, use_cache=False)())
+    cached = list(dataset_chunks(train.DATA_FILE, 1000)())
+    assert [chunk.index[0] for chunk in cached] == [chunk.index[0] for chunk in parsed]
+    dv = fit_vectorizer(parsed)
+    assert fit_vectorizer(cached).feature_names_ == dv.feature_names_
+
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    for a, b in zip(parsed, cached):
+        np.testing.assert_allclose(encoder.encode_frame(b.drop(columns=TARGET)),
+                                   encoder.encode_frame(a.drop(columns=TARGET)), rtol=1e-6)
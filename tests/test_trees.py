@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact import TREES_FILE, load_artifact
+from trees import TreeEnsemble, check_parity
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+
+
+@pytest.fixture(scope='module')
+def model():
+    encoder, booster, _ = load_artifact(MODEL_FILE)
+    df = pd.read_csv(os.path.join('datasets', 'modified_human_age_prediction.csv'))
+    X = encoder.encode_frame(df.drop(columns='age_(years)'))
+    return booster, TreeEnsemble.from_booster(booster), X
+
+
+def test_parity_with_xgboost_on_the_dataset(model):
+    booster, ensemble, X = model
+    assert check_parity(booster, ensemble, X) <= 1e-5
+
+
+def test_parity_with_missing_values(model):
+    booster, ensemble, X = model
+    rng = np.random.default_rng(1)
+    X = X[:500].copy()
+    X[rng.random(X.shape) < 0.3] = np.nan
+    X[0] = np.nan
+    check_parity(booster, ensemble, X)
+
+
+def test_single_rows_and_block_boundaries(model):
+    booster, ensemble, X = model
+    expected = booster.inplace_predict(X[:300])
+    np.testing.assert_allclose(ensemble.predict(X[:1]), expected[:1], atol=1e-5)
+    np.testing.assert_allclose(ensemble.predict(X[:300], block_size=7), expected, atol=1e-5)
+    assert len(ensemble.predict(X[:0])) == 0
+
+
+def test_saved_trees_round_trip(model, tmp_path):
+    booster, ensemble, X = model
+    path = tmp_path / TREES_FILE
+    ensemble.save(path)
+    check_parity(booster, TreeEnsemble.load(path), X)
+
+
+def test_the_shipped_export_matches_the_booster(model):
+    booster, _, X = model
+    check_parity(booster, TreeEnsemble.load(os.path.join(MODEL_FILE, TREES_FILE)), X)
+
+
+def test_wrong_widths_are_rejected(model):
+    _, ensemble, X = model
+    with pytest.raises(ValueError):
+        ensemble.predict(X[:, :-1])
+
+
+def test_the_script_doesnt_modify_the_artifact(tmp_path):
+    before = {name: os.stat(os.path.join(MODEL_FILE, name)).st_mtime_ns
+              for name in os.listdir(MODEL_FILE)}
+    output = tmp_path / 'trees.npz'
+    subprocess.run([sys.executable, 'trees.py', MODEL_FILE, '--output', str(output)],
+                   check=True, capture_output=True)
+    after = {name: os.stat(os.path.join(MODEL_FILE, name)).st_mtime_ns
+             for name in os.listdir(MODEL_FILE)}
+    assert after == before
+    assert output.exists()
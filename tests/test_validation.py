@@ -0,0 +1,152 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from artifact import load_artifact
+from validation import NUMERIC_RANGES, RecordValidator, ValidationError
+
+MODEL_FILE = 'model_xgb_eta=0.1_score=1.206.model'
+
+
+@pytest.fixture(scope='module')
+def validator():
+    encoder, _, _ = load_artifact(MODEL_FILE)
+    return RecordValidator(encoder)
+
+
+@pytest.fixture(scope='module')
+def humans():
+    df = pd.read_csv(os.path.join('datasets', 'modified_human_age_prediction.csv'), nrows=50)
+    return df.drop(columns='age_(years)').to_dict(orient='records')
+
+
+def one_hot(validator, human):
+    """The record with its categorical fields sent as 0/1 columns, like the API example."""
+    row = validator.encoder.encode(human)[0]
+    return {name: 0 if value != value else float(value)
+            for name, value in zip(validator.feature_names, row)
+            if value == value or validator.encoder.separator in name}
+
+
+def fields(error):
+    return [e['field'] for e in error.errors]
+
+
+def test_valid_records_encode_like_the_encoder(validator, humans):
+    for human in humans[:10]:
+        np.testing.assert_array_equal(validator.encode(human), validator.encoder.encode(human))
+    X, valid, errors = validator.encode_many(humans)
+    assert valid == list(range(len(humans))) and errors == {}
+    np.testing.assert_array_equal(X, validator.encoder.encode_many(humans))
+
+
+@pytest.mark.parametrize('field', sorted(NUMERIC_RANGES))
+def test_values_outside_the_numeric_ranges_are_refused(validator, humans, field):
+    low, high = NUMERIC_RANGES[field]
+    if field not in validator.encoder.index:
+        pytest.skip(f'{field} is not a feature of the model')
+    for value in (low, high):
+        validator.encode({**humans[0], field: value})
+    for value in (low - 1, high + 1):
+        with pytest.raises(ValidationError) as e:
+            validator.encode({**humans[0], field: value})
+        assert fields(e.value) == [field]
+        assert 'must be between' in str(e.value)
+
+
+def test_missing_values_are_accepted(validator, humans):
+    X = validator.encode({**humans[0], 'bmi': math.nan})
+    assert np.isnan(X[0, validator.encoder.index['bmi']])
+    partial = {'bmi': 25.0, 'diet': 'Balanced'}
+    np.testing.assert_array_equal(validator.encode(partial), validator.encoder.encode(partial))
+
+
+@pytest.mark.parametrize('changes, field, message', [
+    ({'bmi': 'high'}, 'bmi', 'must be a number'),
+    ({'bmi': None}, 'bmi', 'must be a number'),
+    ({'bmi': [25]}, 'bmi', 'must be a number'),
+    ({'diet=Balanced': 'yes'}, 'diet=Balanced', 'must be 0 or 1'),
+    ({'diet=Balanced': 2}, 'diet=Balanced', 'must be 0 or 1'),
+    ({'diet=Balanced': 1}, 'diet', 'exactly one active value, got 2'),
+    ({'diet=Low-carb': 0}, 'diet', 'exactly one active value, got 0'),
+    ({'favourite_colour': 'blue'}, 'favourite_colour', 'is not a feature'),
+])
+def test_wrong_types_and_one_hot_groups_are_refused(validator, humans, changes, field, message):
+    human = one_hot(validator, humans[0])
+    assert human['diet=Low-carb'] == 1
+    validator.encode(human)
+    with pytest.raises(ValidationError) as e:
+        validator.encode({**human, **changes})
+    assert field in fields(e.value)
+    assert message in str(e.value)
+
+
+def test_categorical_fields(validator):
+    validator.encode({'diet': 'Balanced'})
+    for value in ('Carnivore', 1):
+        with pytest.raises(ValidationError, match='has unknown value'):
+            validator.encode({'diet': value})
+    with pytest.raises(ValidationError, match='exactly one active value, got 2'):
+        validator.encode({'diet': 'Balanced', 'diet=Vegetarian': 1})
+
+
+def test_records_must_be_non_empty_objects(validator):
+    for human, message in (([1, 2], 'must be an object'), ({}, 'is empty')):
+        with pytest.raises(ValidationError, match=message):
+            validator.encode(human)
+
+
+def test_batches_report_errors_per_row(validator, humans):
+    batch = [
+        humans[0],
+        {**humans[1], 'bmi': 500.0},           # Encoded, then caught by the array check
+        {**humans[2], 'diet': 'Carnivore'},   # Caught while filling the row
+        'not a record',
+        {**humans[3], 'height_(cm)': -1, 'unknown': 1},
+        humans[4],
+    ]
+    X, valid, errors = validator.encode_many(batch)
+    assert valid == [0, 5]
+    np.testing.assert_array_equal(X, validator.encoder.encode_many([humans[0], humans[4]]))
+    assert sorted(errors) == [1, 2, 3, 4]
+    assert fields(errors[1]) == ['bmi']
+    assert fields(errors[2]) == ['diet']
+    assert fields(errors[3]) == [None]
+    assert sorted(fields(errors[4])) == ['height_(cm)', 'unknown']
+
+    assert validator.encode_many(['nope'])[0].shape == (0, validator.n_features)
+
+
+def test_bad_rows_of_an_encoded_batch(validator, humans):
+    X = validator.encoder.encode_many(humans[:4])
+    index = validator.encoder.index
+    X[1, index['bmi']] = 500
+    X[2, [index['diet=Balanced'], index['diet=Vegetarian']]] = 1  # Two active diets
+    X[3, index['diet=Balanced']] = 0.5
+    assert validator._bad_rows(X).tolist() == [False, True, True, True]
+    # Groups left out entirely are missing, not invalid
+    X[0, [index[name] for name in index if name.startswith('diet=')]] = np.nan
+    assert not validator._bad_rows(X[:1]).any()
+
+
+def test_check_matrix(validator, humans):
+    index = validator.encoder.index
+    X = validator.encoder.encode_many(humans[:5])
+    X[0, index['bmi']] = np.nan  # Missing, still valid
+    X[1, index['systolic']] = 1000
+    X[2, index['bone_density_decline_rate']] = np.inf
+    X[3, index['gender=Male']] = 0.5
+
+    kept, valid, errors = validator.check_matrix(X)
+    assert list(valid) == [0, 4]
+    np.testing.assert_array_equal(kept, X[[0, 4]])
+    assert fields(errors[1]) == ['systolic']
+    assert fields(errors[2]) == ['bone_density_decline_rate']
+    assert 'gender=Male' in fields(errors[3])
+
+    X = validator.encoder.encode_many(humans[:3])
+    kept, valid, errors = validator.check_matrix(X)
+    assert kept is X and list(valid) == [0, 1, 2] and errors == {}
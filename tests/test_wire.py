@@ -0,0 +1,114 @@
+import gzip
+import sys
+
+import numpy as np
+import pytest
+
+import wire
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    import app
+
+    return app
+
+
+@pytest.fixture(scope='module')
+def query(app_module):
+    return app_module.predict_age.__defaults__[0]
+
+
+def without(monkeypatch, *packages):
+    # An import of a None entry raises ImportError, like a missing package
+    for name in packages:
+        monkeypatch.setitem(sys.modules, name, None)
+
+
+def test_missing_packages_are_answered_with_415(app_module, monkeypatch):
+    without(monkeypatch, 'msgpack', 'pyarrow', 'zstandard')
+    client = app_module.app.test_client()
+    for path in ('/predict', '/predict/batch', '/explain'):
+        response = client.post(path, data=b'\x80', content_type=wire.MSGPACK)
+        assert response.status_code == 415, path
+        assert 'msgpack package' in response.get_json()['detail']
+    response = client.post('/predict/batch', data=b'', content_type=wire.ARROW)
+    assert response.status_code == 415
+    response = client.post('/predict', data=gzip.compress(b'{}'),
+                           content_type='application/json',
+                           headers={'Content-Encoding': 'zstd'})
+    assert response.status_code == 415
+
+
+def test_package_errors_are_unsupported_formats(monkeypatch):
+    without(monkeypatch, 'msgpack')
+    with pytest.raises(wire.UnsupportedFormat):
+        wire.media_type('application/x-msgpack')
+    with pytest.raises(wire.UnsupportedFormat):
+        wire.dump({}, wire.MSGPACK)
+    assert wire.media_type(None) == wire.JSON
+    assert wire.media_type(wire.FLOAT32) == wire.FLOAT32
+
+
+def test_msgpack_round_trip(app_module, query):
+    msgpack = pytest.importorskip('msgpack')
+    response = app_module.app.test_client().post(
+        '/predict', data=msgpack.packb({'query': query}), content_type=wire.MSGPACK)
+    assert response.status_code == 200
+    assert response.mimetype == wire.MSGPACK
+    assert 'result' in msgpack.unpackb(response.data)
+
+
+def test_arrow_and_float32_batches(app_module, query):
+    pa = pytest.importorskip('pyarrow')
+    loaded = app_module.models.get(None)
+    X = np.repeat(loaded.validator.encode(query), 3, axis=0)
+    expected = loaded.predict(X)
+    client = app_module.app.test_client()
+
+    response = client.post('/predict/batch', data=X.astype('<f4').tobytes(),
+                           content_type=wire.FLOAT32)
+    np.testing.assert_allclose(np.frombuffer(response.data, '<f4'), expected, rtol=1e-6)
+
+    table = pa.table({name: X[:, i] for i, name in enumerate(loaded.encoder.feature_names)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    response = client.post('/predict/batch', data=sink.getvalue().to_pybytes(),
+                           content_type=wire.ARROW)
+    result = pa.ipc.open_stream(response.data).read_all()
+    np.testing.assert_allclose(result['prediction'].to_numpy(), expected, rtol=1e-6)
+
+
+def test_gzip_bodies_and_the_decompression_limit():
+    body = gzip.compress(b'x' * 1000)
+    assert wire.decompress(body, 'gzip', 1000) == b'x' * 1000
+    with pytest.raises(ValueError):
+        wire.decompress(body, 'gzip', 999)
+
+
+def test_corrupt_bodies_are_answered_with_400(app_module):
+    good = gzip.compress(b'{}')
+    for body in (b'notgzip', good[:-4], good[:10] + b'\x00' * 8):
+        with pytest.raises(ValueError, match='Invalid gzip body'):
+            wire.decompress(body, 'gzip', 1000)
+
+    client = app_module.app.test_client()
+    for path in ('/predict', '/predict/batch', '/explain'):
+        response = client.post(path, data=b'notgzip', content_type='application/json',
+                               headers={'Content-Encoding': 'gzip'})
+        assert response.status_code == 400, path
+        assert 'Invalid gzip body' in response.get_json()['detail']
+
+
+def test_corrupt_zstd_bodies_are_answered_with_400(app_module):
+    pytest.importorskip('zstandard')
+    with pytest.raises(ValueError, match='Invalid zstd body'):
+        wire.decompress(b'notzstd', 'zstd', 1000)
+
+    client = app_module.app.test_client()
+    for path in ('/predict', '/predict/batch', '/explain'):
+        response = client.post(path, data=b'notzstd', content_type='application/json',
+                               headers={'Content-Encoding': 'zstd'})
+        assert response.status_code == 400, path
+        assert 'Invalid zstd body' in response.get_json()['detail']
@@ -1,38 +1,24 @@
+import numpy as np
 import pandas as pd
 from sklearn.metrics import root_mean_squared_error, mean_absolute_error, mean_squared_error, r2_score
 from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction import DictVectorizer
 import xgboost as xgb
+import argparse
 import pickle
+import os
+import tempfile
+from artifact import save_artifact
+from dataset import cached_dataset
+from encoder import CompiledEncoder
+from features import load_dataset
+from streaming import fit_vectorizer
 
-df = df = pd.read_csv('datasets\modified_human_age_prediction.csv')
-
-df_full_train, df_test = train_test_split(
-    df, test_size=0.2, random_state=1)
-
-df_full_train = df_full_train.reset_index(drop=True)
-y_full_train = df_full_train['age_(years)']
-y_test = df_test['age_(years)']
-del df_full_train['age_(years)']
-
-dicts_full_train = df_full_train.to_dict(orient='records')
-
-dv = DictVectorizer(sparse=True)
-X_full_train = dv.fit_transform(dicts_full_train)
-
-dicts_test = df_test.to_dict(orient='records')
-X_test = dv.transform(dicts_test)
-
-d_full_train = xgb.DMatrix(
-    X_full_train, label=y_full_train, feature_names=list(dv.get_feature_names_out()))
-
-d_test = xgb.DMatrix(X_test, feature_names=list(dv.get_feature_names_out()))
+DATA_FILE = os.path.join('datasets', 'human_age_prediction.csv')
 
 xgb_params = {
     'eta': 0.1,
     'max_depth': 7,
     'min_child_weight': 10,
-    'early_stopping_round': 50,
     'gamma': 0.1,
     'lambda': 1,
     'alpha': 0,
@@ -44,23 +30,191 @@ xgb_params = {
     'verbosity': 1,
 }
 
-model = xgb.train(xgb_params, d_full_train, num_boost_round=200)
+num_boost_round = 200
+
+
+def prepare_data(data_file, use_cache=True):
+    """Loads the dataset, splits off the test set and encodes both parts.
+
+    The prepared dataset comes from its columnar cache (dataset.py), built
+    first if the CSV or the feature engineering changed, unless `use_cache`
+    is False. The vocabulary is fitted on the columns of the training part
+    and both parts are encoded column by column into dense float32
+    matrices (missing values are NaN), without a dict per record.
+    """
+    # Same feature engineering the API applies to raw records
+    df = cached_dataset(data_file) if use_cache else load_dataset(data_file)
+
+    df_full_train, df_test = train_test_split(
+        df, test_size=0.2, random_state=1)
+
+    df_full_train = df_full_train.reset_index(drop=True)
+    y_full_train = df_full_train['age_(years)']
+    y_test = df_test['age_(years)']
+    del df_full_train['age_(years)']
+    df_test = df_test.drop(columns='age_(years)')
 
-y_pred = model.predict(d_test)
+    dv = fit_vectorizer([df_full_train])
+    encoder = CompiledEncoder.from_vectorizer(dv)
+    X_full_train = encoder.encode_frame(df_full_train)
+    X_test = encoder.encode_frame(df_test)
 
-rms = root_mean_squared_error(y_test, y_pred)
-mae = mean_absolute_error(y_test, y_pred)
-mse = mean_squared_error(y_test, y_pred)
-r2 = r2_score(y_test, y_pred)
+    return dv, X_full_train, y_full_train, X_test, y_test
 
-print("Root Mean Squared Error (RMSE):", rms)
-print("Mean Absolute Error (MAE):", mae)
-print("Mean Squared Error (MSE):", mse)
-print("R-squared (R²):", r2)
 
-output_file = f"model_xgb_eta={xgb_params['eta']}_score={rms.round(3)}.bin"
+def evaluate(model, dv, X_test, y_test):
+    d_test = xgb.DMatrix(X_test, missing=np.nan, feature_names=list(dv.get_feature_names_out()))
 
-with open(output_file, "wb") as f_out:
-    pickle.dump((dv, model), f_out)
+    y_pred = model.predict(d_test)
 
-print(f"the model is saved to {output_file}")
+    return {
+        'rmse': root_mean_squared_error(y_test, y_pred),
+        'mae': mean_absolute_error(y_test, y_pred),
+        'mse': mean_squared_error(y_test, y_pred),
+        'r2': r2_score(y_test, y_pred),
+    }
+
+
+def train(data_file, use_cache=True):
+    """Trains in memory, the whole dataset is loaded at once."""
+    dv, X_full_train, y_full_train, X_test, y_test = prepare_data(data_file, use_cache)
+
+    d_full_train = xgb.DMatrix(
+        X_full_train, label=y_full_train, missing=np.nan,
+        feature_names=list(dv.get_feature_names_out()))
+
+    model = xgb.train(xgb_params, d_full_train, num_boost_round=num_boost_round)
+
+    return dv, model, evaluate(model, dv, X_test, y_test)
+
+
+def train_stream(data_file, chunksize, use_cache=True):
+    """Trains reading the dataset in chunks, memory doesn't grow with the dataset."""
+    from streaming import train_streaming
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        return train_streaming(data_file, xgb_params, num_boost_round,
+                               chunksize=chunksize, cache_dir=cache_dir, use_cache=use_cache)
+
+
+def tune(data_file, use_cache=True, **search_args):
+    """Cross-validated hyperparameter search, then trains the best candidate."""
+    from tuning import Search
+
+    dv, X_full_train, y_full_train, X_test, y_test = prepare_data(data_file, use_cache)
+    feature_names = list(dv.get_feature_names_out())
+
+    search = Search(xgb_params, **search_args)
+    best = search.run(X_full_train, y_full_train, feature_names)
+    print(f"best cv rmse {best['rmse']:.4f} with {best['best_iteration']} rounds:", best['params'])
+
+    d_full_train = xgb.DMatrix(X_full_train, label=y_full_train, missing=np.nan,
+                               feature_names=feature_names)
+    model = xgb.train(best['params'], d_full_train, num_boost_round=best['best_iteration'])
+
+    return dv, model, evaluate(model, dv, X_test, y_test), best['params']
+
+
+def save_model(dv, model, metrics, params=xgb_params, data_file=DATA_FILE, output_format='native'):
+    """Prints the metrics and saves the model.
+
+    The native format is the artifact directory described in artifact.py,
+    with the reference profile of the training data for drift monitoring
+    (drift.py). pickle writes the `(dv, model)` tuple used by older versions.
+    """
+    print("Root Mean Squared Error (RMSE):", metrics['rmse'])
+    print("Mean Absolute Error (MAE):", metrics['mae'])
+    print("Mean Squared Error (MSE):", metrics['mse'])
+    print("R-squared (R²):", metrics['r2'])
+
+    name = f"model_xgb_eta={round(params['eta'], 3)}_score={round(metrics['rmse'], 3)}"
+
+    if output_format == 'native':
+        from drift import dataset_profile
+        from encoder import CompiledEncoder
+
+        # Training distribution the server compares its inputs with
+        profile = dataset_profile(data_file, CompiledEncoder(dv.feature_names_, dv.separator))
+        output_file = save_artifact(f"{name}.model", dv.feature_names_, model,
+                                    metrics=metrics, params=params, data_file=data_file,
+                                    separator=dv.separator, profile=profile)
+    else:
+        output_file = f"{name}.bin"
+        with open(output_file, "wb") as f_out:
+            pickle.dump((dv, model), f_out)
+
+    print(f"the model is saved to {output_file}")
+    return output_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the age prediction model.')
+    parser.add_argument('--data', default=DATA_FILE,
+                        help='CSV in the datasets/human_age_prediction.csv schema')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse the CSV instead of loading the prepared dataset cache')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the CSV in chunks and train with external memory')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='rows per chunk in --stream mode')
+    parser.add_argument('--tune', action='store_true',
+                        help='cross-validated hyperparameter search before training')
+    parser.add_argument('--strategy', choices=['halving', 'random'], default='halving',
+                        help='search strategy in --tune mode')
+    parser.add_argument('--trials', type=int, default=32,
+                        help='candidates sampled in --tune mode')
+    parser.add_argument('--folds', type=int, default=5,
+                        help='cross-validation folds in --tune mode')
+    parser.add_argument('--max-rounds', type=int, default=1000,
+                        help='largest boosting rounds budget in --tune mode')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes in --tune mode, defaults to one per core')
+    parser.add_argument('--results', default='tuning_results.jsonl',
+                        help='file --tune appends results to and resumes from')
+    parser.add_argument('--format', choices=['native', 'pickle'], default='native',
+                        help='native artifact directory or pickled (dv, model) .bin file')
+    parser.add_argument('--incremental', metavar='MODEL',
+                        help='update this artifact with the rows appended to --data since '
+                             'it was trained, instead of training from scratch')
+    parser.add_argument('--new-data',
+                        help='CSV with only the new rows in --incremental mode, for '
+                             'artifacts that don\'t record their training data')
+    parser.add_argument('--refresh', action='store_true',
+                        help='recompute the leaf values in --incremental mode instead of '
+                             'adding boosting rounds')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='boosting rounds added in --incremental mode')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='relative held-out RMSE increase still published in '
+                             '--incremental mode')
+    parser.add_argument('--output', help='artifact directory written in --incremental mode')
+    args = parser.parse_args()
+
+    if args.incremental:
+        from incremental import publish, retrain
+
+        result = retrain(args.incremental,
+                         data_file=args.data if args.data != DATA_FILE else None,
+                         new_data=args.new_data, rounds=args.rounds, tolerance=args.tolerance,
+                         strategy='refresh' if args.refresh else 'continue')
+        print(f"trained on {result['rows']['train']} new rows, "
+              f"held out {result['rows']['test']}")
+        print(f"held-out RMSE: {result['base_metrics']['rmse']:.4f} before, "
+              f"{result['metrics']['rmse']:.4f} after")
+        if not result['accepted']:
+            print("RMSE regressed, the model is not published")
+            raise SystemExit(1)
+        print(f"the model is saved to {publish(result, args.output)}")
+        raise SystemExit(0)
+
+    params = xgb_params
+    if args.tune:
+        dv, model, metrics, params = tune(
+            args.data, use_cache=not args.no_cache, strategy=args.strategy, n_trials=args.trials, n_folds=args.folds,
+            max_rounds=args.max_rounds, workers=args.workers, results_file=args.results)
+    elif args.stream:
+        dv, model, metrics = train_stream(args.data, args.chunksize, use_cache=not args.no_cache)
+    else:
+        dv, model, metrics = train(args.data, use_cache=not args.no_cache)
+
+    save_model(dv, model, metrics, params, data_file=args.data, output_format=args.format)
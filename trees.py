@@ -0,0 +1,259 @@
+# Pure NumPy evaluator of the XGBoost tree ensemble.
+#
+# The trees are exported once from the booster's JSON model into flat arrays
+# (feature, threshold, children, missing value direction, leaf value) and
+# walked one level at a time for every row and tree at once. For a single
+# record this skips XGBoost's per call overhead, and serving from a
+# `trees.npz` export doesn't need the xgboost package at all.
+#
+# Usage:
+#     python trees.py model_xgb_eta=0.1_score=1.206.model
+#     python trees.py old.model --output old.model/trees.npz
+import json
+
+import numpy as np
+
+# Objectives whose prediction is the raw margin
+IDENTITY_OBJECTIVES = ('reg:squarederror', 'reg:squaredlogerror', 'reg:pseudohubererror',
+                       'reg:absoluteerror', 'reg:quantileerror')
+
+
+def _parse_float(value):
+    # base_score is '5.3E1' in older models and '[5.3E1]' since XGBoost 3
+    return float(str(value).strip('[]'))
+
+
+class TreeEnsemble:
+    """A regression tree ensemble in flat arrays.
+
+    Nodes of all trees are numbered globally and laid out so that one
+    comparison per level picks the child: a node sends a row to
+    `children[node] + (X2[row, feature[node]] >= threshold[node])`, where X2
+    is the rows followed by their negation. Nodes whose missing values go
+    right compare the negated value against the negated largest float32
+    below the threshold, which is the same split with NaN falling on the
+    other side, and their children are stored right first. Leaves have a
+    NaN threshold and point to themselves, so every row takes `max_depth`
+    steps without checking where it is.
+
+    Args:
+        feature (numpy.ndarray): Column of X2 compared at each node.
+        threshold (numpy.ndarray): Value compared at each node.
+        children (numpy.ndarray): Child taken when the comparison is False,
+            the other one follows it.
+        value (numpy.ndarray): Leaf value per node, 0 for split nodes.
+        roots (numpy.ndarray): Root node of each tree, in boosting order.
+        max_depth (int): Levels of the deepest tree.
+        base_score (float): Margin before the first tree.
+        n_features (int): Columns of the rows to predict.
+        feature_names (list, optional): Column names the trees expect.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, base_score,
+                 n_features, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.base_score = np.float32(base_score)
+        self.n_features = int(n_features)
+        self.feature_names = feature_names
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Exports the trees of an xgboost.Booster."""
+        return cls.from_json(booster.save_raw('json'))
+
+    @classmethod
+    def from_json(cls, raw):
+        """Builds the arrays from XGBoost's JSON model format.
+
+        Raises:
+            ValueError: For models this evaluator can't reproduce: other
+                boosters or objectives, categorical splits, several targets.
+        """
+        learner = json.loads(raw)['learner']
+        objective = learner['objective']['name']
+        booster = learner['gradient_booster']
+        params = learner['learner_model_param']
+        if booster['name'] != 'gbtree':
+            raise ValueError(f"Only gbtree models are supported, not {booster['name']}")
+        if objective not in IDENTITY_OBJECTIVES:
+            raise ValueError(f"Objective {objective} is not supported")
+        if int(params.get('num_target', 1)) > 1 or int(params.get('num_class', 0)) > 1:
+            raise ValueError("Models with several outputs are not supported")
+        n_features = int(params['num_feature'])
+
+        feature, threshold, children, value, roots = [], [], [], [], []
+        max_depth = 0
+        for tree in booster['model']['trees']:
+            if tree['categories_nodes']:
+                raise ValueError("Categorical splits are not supported")
+            left, right = tree['left_children'], tree['right_children']
+            conditions = tree['split_conditions']
+
+            # Renumber breadth first, giving the two children of a node
+            # consecutive numbers in the order the comparison picks them
+            root = len(value)
+            roots.append(root)
+            queue = [(0, root, 0)]  # XGBoost node, global node, depth
+            for i, node, depth in queue:
+                feature.append(0)
+                threshold.append(np.nan)
+                children.append(node)
+                value.append(0.0)
+                if left[i] == -1:
+                    value[node] = conditions[i]  # The leaf value
+                    max_depth = max(max_depth, depth)
+                    continue
+                first = root + len(queue)  # The next two numbers
+                children[node] = first
+                split = np.float32(conditions[i])
+                if tree['default_left'][i]:
+                    # x >= split goes right, NaN compares False and goes left
+                    feature[node] = tree['split_indices'][i]
+                    threshold[node] = split
+                    queue += [(left[i], first, depth + 1), (right[i], first + 1, depth + 1)]
+                else:
+                    # -x >= -(float below split) is x < split and goes left,
+                    # NaN compares False and goes right
+                    feature[node] = n_features + tree['split_indices'][i]
+                    threshold[node] = -np.nextafter(split, np.float32(-np.inf))
+                    queue += [(right[i], first, depth + 1), (left[i], first + 1, depth + 1)]
+
+        return cls(
+            feature=np.array(feature, dtype=np.intp),
+            threshold=np.array(threshold, dtype=np.float32),
+            children=np.array(children, dtype=np.intp),
+            value=np.array(value, dtype=np.float32),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth,
+            base_score=_parse_float(params['base_score']),
+            n_features=n_features,
+            feature_names=learner.get('feature_names') or None,
+        )
+
+    def save(self, path):
+        """Writes the arrays to an `.npz` file."""
+        np.savez(path, feature=self.feature, threshold=self.threshold, children=self.children,
+                 value=self.value, roots=self.roots, max_depth=self.max_depth,
+                 base_score=self.base_score, n_features=self.n_features,
+                 feature_names=np.array(self.feature_names or [], dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(
+                feature=arrays['feature'].astype(np.intp),
+                threshold=arrays['threshold'],
+                children=arrays['children'].astype(np.intp),
+                value=arrays['value'],
+                roots=arrays['roots'].astype(np.intp),
+                max_depth=int(arrays['max_depth']),
+                base_score=float(arrays['base_score']),
+                n_features=int(arrays['n_features']),
+                feature_names=arrays['feature_names'].tolist() or None,
+            )
+
+    def _leaves(self, X):
+        """Leaf reached in every tree by every row, shape (len(X), n_trees)."""
+        flat = np.concatenate([X, -X], axis=1).ravel()
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        if len(X) == 1:
+            for _ in range(self.max_depth):
+                node = self.children[node] + (flat[self.feature[node]] >= self.threshold[node])
+        else:
+            row_offsets = (np.arange(len(X)) * (2 * self.n_features))[:, None]
+            for _ in range(self.max_depth):
+                node = self.children[node] + (flat[row_offsets + self.feature[node]]
+                                              >= self.threshold[node])
+        return node
+
+    def predict(self, X, block_size=128):
+        """Predicts encoded rows, like `Booster.inplace_predict`.
+
+        Leaf values are added tree by tree in float32, in the same order as
+        XGBoost, so the results agree with it to float32 rounding.
+
+        Args:
+            X (numpy.ndarray): Rows of shape (n, n_features), NaN for missing values.
+            block_size (int, optional): Rows walked at once. Small blocks keep
+                the per level arrays in the CPU cache.
+
+        Returns:
+            numpy.ndarray: One float32 prediction per row.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected rows of {self.n_features} features, got shape {X.shape}")
+
+        predictions = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), block_size):
+            block = X[start:start + block_size]
+            # Base score, then one column per tree, summed left to right
+            margins = np.empty((len(block), len(self.roots) + 1), dtype=np.float32)
+            margins[:, 0] = self.base_score
+            np.take(self.value, self._leaves(block), out=margins[:, 1:])
+            predictions[start:start + block_size] = np.cumsum(margins, axis=1, out=margins)[:, -1]
+        return predictions
+
+
+def check_parity(booster, ensemble, X, tolerance=1e-5):
+    """Compares the NumPy evaluator with XGBoost on the rows of X.
+
+    Returns:
+        float: The largest absolute difference found.
+
+    Raises:
+        AssertionError: If it is larger than `tolerance`.
+    """
+    expected = booster.inplace_predict(X)
+    actual = ensemble.predict(X)
+    diff = float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+    if diff > tolerance:
+        raise AssertionError(f"NumPy trees differ from XGBoost by {diff}")
+    return diff
+
+
+if __name__ == '__main__':
+    # Checks the trees of an artifact against XGBoost and compares their speed
+    import argparse
+    import os
+    import time
+
+    import pandas as pd
+
+    from artifact import TREES_FILE, load_artifact
+
+    parser = argparse.ArgumentParser(description='Check the NumPy trees against XGBoost.')
+    parser.add_argument('model', nargs='?', default='model_xgb_eta=0.1_score=1.206.model')
+    parser.add_argument('--output', help=f'also save the exported trees to this file, e.g. '
+                                         f'MODEL/{TREES_FILE} for an artifact without one')
+    args = parser.parse_args()
+
+    encoder, booster, _ = load_artifact(args.model)
+    ensemble = TreeEnsemble.from_booster(booster)
+    print(f"{len(ensemble.roots)} trees, {len(ensemble.value)} nodes, "
+          f"depth {ensemble.max_depth}")
+    if args.output:
+        ensemble.save(args.output)
+        print(f"saved to {args.output}")
+
+    df = pd.read_csv(os.path.join('datasets', 'modified_human_age_prediction.csv'))
+    X = encoder.encode_frame(df.drop(columns='age_(years)'))
+    print("Max abs difference:", check_parity(booster, ensemble, X))
+
+    n = 500
+    for name, predict in [('XGBoost inplace_predict', booster.inplace_predict),
+                          ('TreeEnsemble.predict', ensemble.predict)]:
+        start = time.perf_counter()
+        for i in range(n):
+            predict(X[i:i + 1])
+        single = (time.perf_counter() - start) / n
+        start = time.perf_counter()
+        predict(X)
+        batch = (time.perf_counter() - start) / len(X)
+        print(f"{name}: {single * 1e6:.1f} us for one row, {batch * 1e6:.2f} us/row "
+              f"for {len(X)} rows")
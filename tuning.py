@@ -0,0 +1,186 @@
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import KFold
+
+# Parameters searched and how to sample them: ('log', low, high) samples
+# log-uniformly, ('uniform', low, high) uniformly and ('int', low, high)
+# integers in [low, high]
+SEARCH_SPACE = {
+    'eta': ('log', 0.01, 0.3),
+    'max_depth': ('int', 3, 10),
+    'min_child_weight': ('log', 1, 50),
+    'gamma': ('uniform', 0.0, 1.0),
+    'lambda': ('log', 0.1, 10),
+    'alpha': ('log', 0.001, 1),
+    'subsample': ('uniform', 0.6, 1.0),
+    'colsample_bytree': ('uniform', 0.5, 1.0),
+}
+
+
+def sample_candidates(space, n, seed):
+    """Draws `n` parameter sets, always the same ones for the same seed."""
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(n):
+        params = {}
+        for name, (kind, low, high) in space.items():
+            if kind == 'log':
+                params[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+            elif kind == 'int':
+                params[name] = int(rng.integers(low, high + 1))
+            else:
+                params[name] = float(rng.uniform(low, high))
+        candidates.append(params)
+    return candidates
+
+
+# Data shared by the trials of each worker process, built once per worker
+_worker = {}
+
+
+def _init_worker(X, y, feature_names, folds):
+    d_full = xgb.DMatrix(X, label=y, feature_names=feature_names)
+    _worker['folds'] = [(d_full.slice(train_idx), d_full.slice(val_idx))
+                        for train_idx, val_idx in folds]
+
+
+def _run_trial(trial, rung, params, num_boost_round, early_stopping_rounds):
+    """k-fold CV of one candidate with early stopping on each validation fold."""
+    scores, iterations = [], []
+    for d_train, d_val in _worker['folds']:
+        model = xgb.train(params, d_train, num_boost_round=num_boost_round,
+                          evals=[(d_val, 'val')],
+                          early_stopping_rounds=early_stopping_rounds,
+                          verbose_eval=False)
+        scores.append(model.best_score)
+        iterations.append(model.best_iteration + 1)
+
+    return {
+        'trial': trial,
+        'rung': rung,
+        'rounds': num_boost_round,
+        'rmse': float(np.mean(scores)),
+        'rmse_std': float(np.std(scores)),
+        'best_iteration': int(np.mean(iterations)),
+        'params': params,
+    }
+
+
+class Search:
+    """Cross-validated search over SEARCH_SPACE run on a process pool.
+
+    Results are appended to `results_file` as JSON lines as soon as each
+    trial finishes. Running the same search again skips the trials already
+    in the file, so an interrupted search resumes where it stopped.
+
+    With strategy 'halving', every candidate starts with `min_rounds`
+    boosting rounds and only the best 1/`factor` of each rung continue with
+    `factor` times more rounds, up to `max_rounds`. With 'random', every
+    candidate gets `max_rounds` directly.
+    """
+
+    def __init__(self, base_params, n_trials=32, strategy='halving', n_folds=5,
+                 max_rounds=1000, min_rounds=50, factor=3, early_stopping_rounds=50,
+                 seed=1, workers=None, results_file='tuning_results.jsonl',
+                 space=SEARCH_SPACE):
+        self.base_params = base_params
+        self.n_trials = n_trials
+        self.strategy = strategy
+        self.n_folds = n_folds
+        self.max_rounds = max_rounds
+        self.min_rounds = min_rounds if strategy == 'halving' else max_rounds
+        self.factor = factor
+        self.early_stopping_rounds = early_stopping_rounds
+        self.seed = seed
+        self.workers = workers or os.cpu_count()
+        self.results_file = results_file
+        self.space = space
+        self.candidates = sample_candidates(space, n_trials, seed)
+
+        # Identifies the search, results of a different one are not reused
+        config = [space, n_trials, strategy, n_folds, self.min_rounds, max_rounds,
+                  factor, early_stopping_rounds, seed, base_params]
+        self.key = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+    def _load_results(self):
+        done = {}
+        if os.path.exists(self.results_file):
+            with open(self.results_file) as f_in:
+                for line in f_in:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line
+                    if result.get('search') == self.key:
+                        done[(result['trial'], result['rung'])] = result
+        return done
+
+    def _save_result(self, result):
+        with open(self.results_file, 'a') as f_out:
+            f_out.write(json.dumps({'search': self.key, **result}) + '\n')
+            f_out.flush()
+            os.fsync(f_out.fileno())
+
+    def _rungs(self):
+        rounds, rung = self.min_rounds, 0
+        while True:
+            yield rung, min(rounds, self.max_rounds)
+            if rounds >= self.max_rounds:
+                return
+            rounds *= self.factor
+            rung += 1
+
+    def run(self, X, y, feature_names):
+        """Runs (or resumes) the search.
+
+        Args:
+            X: Training features, e.g. encoded by train.prepare_data.
+            y: Training labels.
+            feature_names (list): Column names of X.
+
+        Returns:
+            dict: The best result, with its parameters and the mean number of
+                boosting rounds early stopping picked.
+        """
+        done = self._load_results()
+        folds = list(KFold(n_splits=self.n_folds, shuffle=True, random_state=self.seed).split(X))
+
+        trials = list(range(self.n_trials))
+        results = []
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(X, np.asarray(y), feature_names, folds)) as pool:
+            for rung, rounds in self._rungs():
+                results = [done[(t, rung)] for t in trials if (t, rung) in done]
+                pending = [t for t in trials if (t, rung) not in done]
+
+                futures = []
+                for t in pending:
+                    # One thread per trial, the pool provides the parallelism
+                    params = {**self.base_params, **self.candidates[t], 'nthread': 1}
+                    futures.append(pool.submit(_run_trial, t, rung, params, rounds,
+                                               self.early_stopping_rounds))
+
+                for future in as_completed(futures):
+                    result = future.result()
+                    result['params'] = self.candidates[result['trial']]
+                    self._save_result(result)
+                    results.append(result)
+                    print(f"rung {rung} trial {result['trial']}: "
+                          f"rmse {result['rmse']:.4f} ({result['best_iteration']} rounds)")
+
+                results.sort(key=lambda r: r['rmse'])
+                if rounds >= self.max_rounds:
+                    break
+                keep = max(1, len(results) // self.factor)
+                trials = [r['trial'] for r in results[:keep]]
+
+        best = results[0]
+        best['params'] = {**self.base_params, **best['params']}
+        return best
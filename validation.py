@@ -0,0 +1,266 @@
+import numpy as np
+
+from encoder import MISSING
+
+# Plausible values of the numeric features. They are wide enough for every
+# record in the dataset and the examples; a value outside its range is a
+# client error, not a record to score. Features not listed only need to be
+# finite numbers.
+NUMERIC_RANGES = {
+    'height_(cm)': (30, 300),
+    'weight_(kg)': (1, 700),
+    'bmi': (1, 200),
+    'cholesterol_level_(mg/dl)': (0, 1000),
+    'blood_glucose_level_(mg/dl)': (0, 2000),
+    'bone_density_(g/cm²)': (-5, 20),
+    'vision_sharpness': (0, 10),
+    'hearing_ability_(db)': (-20, 200),
+    'cognitive_function': (0, 200),
+    'stress_levels': (0, 10),
+    'pollution_exposure': (0, 100),
+    'sun_exposure': (0, 24),
+    'systolic': (0, 400),
+    'diastolic': (0, 300),
+    'pulse_pressure': (-300, 400),
+}
+
+_FINITE = (float(-np.finfo(np.float32).max), float(np.finfo(np.float32).max))
+_NUMBER_TYPES = frozenset((float, int, bool))
+
+
+class ValidationError(ValueError):
+    """A record that doesn't match the model's schema.
+
+    Attributes:
+        errors (list): `{'field': ..., 'error': ...}` for every problem found.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(
+            f"'{e['field']}' {e['error']}" if e['field'] else e['error'] for e in errors))
+
+
+class RecordValidator:
+    """Checks records against the model vocabulary while encoding them.
+
+    Built once per model from its CompiledEncoder. Every key must be either
+    a numeric feature, a one-hot column (`diet=Balanced`, 0 or 1) or a
+    categorical field with a known value (`diet: 'Balanced'`). Numbers must
+    be within NUMERIC_RANGES, and a one-hot group that is sent must have
+    exactly one active column. Features and groups left out, or sent as
+    NaN, are missing values like before.
+
+    The row is filled by looking up every feature name in the record (no
+    per key Python branching), then checked as a whole: with list counts
+    per one-hot group for a single record and with array operations for a
+    batch. Only records failing the check go through the slow per key pass
+    that explains what is wrong.
+    """
+
+    def __init__(self, encoder, ranges=NUMERIC_RANGES):
+        self.encoder = encoder
+        self.feature_names = encoder.feature_names
+        self.index = encoder.index
+        self.categories = encoder.categories
+        self.n_features = encoder.n_features
+        self._missing = [MISSING] * self.n_features
+
+        # Per numeric column: (column, low, high)
+        self.ranges = []
+        # Per one-hot group: (name, first column, last column + 1). The
+        # vocabulary is sorted, so the columns of a group are contiguous
+        self.groups = []
+        for name, i in self.index.items():
+            key, sep, _ = name.partition(encoder.separator)
+            if not sep:
+                low, high = ranges.get(name, _FINITE)
+                self.ranges.append((i, low, high))
+            elif self.groups and self.groups[-1][0] == key and self.groups[-1][2] == i:
+                self.groups[-1] = (key, self.groups[-1][1], i + 1)
+            else:
+                self.groups.append((key, i, i + 1))
+
+        self._low = np.full(self.n_features, 0, dtype=np.float32)
+        self._high = np.full(self.n_features, 1, dtype=np.float32)
+        for i, low, high in self.ranges:
+            self._low[i], self._high[i] = low, high
+        self._onehot = np.concatenate(
+            [np.arange(start, stop) for _, start, stop in self.groups]).astype(np.intp) \
+            if self.groups else np.empty(0, dtype=np.intp)
+        sizes = [stop - start for _, start, stop in self.groups]
+        self._group_starts = np.cumsum([0] + sizes[:-1]).astype(np.intp)
+
+    def _fill(self, human):
+        """Row of `human` in vocabulary order, or None if it needs the slow pass."""
+        if type(human) is not dict or not human:
+            return None
+        row = list(map(human.get, self.feature_names, self._missing))
+        if not _NUMBER_TYPES.issuperset(map(type, row)):
+            return None
+        if not human.keys() <= self.index.keys():
+            # Categorical fields sent as `diet: 'Balanced'`
+            for key in human.keys() - self.index.keys():
+                columns = self.categories.get(key)
+                value = human[key]
+                i = columns.get(value) if columns is not None and type(value) is str else None
+                if i is None or row[i] is not MISSING:
+                    return None
+                row[i] = 1
+        return row
+
+    def _row_ok(self, row):
+        for i, low, high in self.ranges:
+            value = row[i]
+            if value < low or value > high:  # False for NaN, a missing value
+                return False
+        for _, start, stop in self.groups:
+            values = row[start:stop]
+            missing = values.count(MISSING)
+            if missing == stop - start:
+                continue
+            ones = values.count(1)
+            if ones != 1 or ones + values.count(0) + missing != stop - start:
+                return False
+        return True
+
+    def errors(self, human):
+        """Every problem of a record, one key at a time.
+
+        Returns:
+            list: `{'field': ..., 'error': ...}` dicts, empty if the record is valid.
+        """
+        if not isinstance(human, dict):
+            return [{'field': None, 'error': 'Record must be an object'}]
+        if not human:
+            return [{'field': None, 'error': 'Record is empty'}]
+
+        ranges = {self.feature_names[i]: (low, high) for i, low, high in self.ranges}
+        errors = []
+        active = {}  # One-hot group -> active columns, for the groups sent
+
+        for key, value in human.items():
+            group, sep, _ = key.partition(self.encoder.separator)
+            is_number = type(value) in _NUMBER_TYPES
+            if key in ranges:
+                low, high = ranges[key]
+                if not is_number:
+                    errors.append({'field': key, 'error': f'must be a number, got {value!r}'})
+                elif value < low or value > high:
+                    errors.append({'field': key,
+                                   'error': f'must be between {low:g} and {high:g}, got {value!r}'})
+            elif key in self.index and sep:
+                if is_number and value != value:
+                    continue  # NaN, missing
+                if not is_number or value not in (0, 1):
+                    errors.append({'field': key, 'error': f'must be 0 or 1, got {value!r}'})
+                    continue
+                active[group] = active.get(group, 0) + (value == 1)
+            elif key in self.categories:
+                if type(value) is not str or value not in self.categories[key]:
+                    errors.append({'field': key, 'error': f'has unknown value {value!r}, '
+                                   f'expected one of {sorted(self.categories[key])}'})
+                    continue
+                active[key] = active.get(key, 0) + 1
+            else:
+                errors.append({'field': key, 'error': 'is not a feature of the model'})
+
+        for group, count in active.items():
+            if count != 1:
+                errors.append({'field': group,
+                               'error': f'needs exactly one active value, got {count}'})
+        return errors
+
+    def encode(self, human):
+        """Validates and encodes one record.
+
+        Args:
+            human (dict): Feature name to value, as accepted by predict_age.
+
+        Returns:
+            numpy.ndarray: A float32 array of shape (1, n_features).
+
+        Raises:
+            ValidationError: If the record doesn't match the schema.
+        """
+        row = self._fill(human)
+        if row is None or not self._row_ok(row):
+            errors = self.errors(human)
+            if errors:
+                raise ValidationError(errors)
+            return self.encoder.encode(human)
+        return np.array([row], dtype=np.float32)
+
+    def _bad_rows(self, X):
+        """Rows of an encoded batch breaking a range or a one-hot group."""
+        bad = (X < self._low).any(axis=1) | (X > self._high).any(axis=1)
+        if len(self._onehot):
+            H = X[:, self._onehot]
+            sent = ~np.isnan(H)
+            ones = np.add.reduceat(H == 1, self._group_starts, axis=1, dtype=np.intp)
+            sent_groups = np.add.reduceat(sent, self._group_starts, axis=1, dtype=np.intp)
+            bad |= ((sent_groups > 0) & (ones != 1)).any(axis=1)
+            bad |= (sent & (H != 0) & (H != 1)).any(axis=1)
+        return bad
+
+    def encode_many(self, humans):
+        """Validates and encodes many records, skipping the invalid ones.
+
+        Returns:
+            tuple: A float32 array with the valid records, the indices of the
+                valid records and a dict mapping the index of each invalid
+                record to its ValidationError.
+        """
+        rows, valid, errors = [], [], {}
+        for i, human in enumerate(humans):
+            row = self._fill(human)
+            if row is None:
+                record_errors = self.errors(human)
+                if record_errors:
+                    errors[i] = ValidationError(record_errors)
+                    continue
+                row = self.encoder.encode(human)[0].tolist()
+            rows.append(row)
+            valid.append(i)
+
+        if not rows:
+            return np.empty((0, self.n_features), dtype=np.float32), valid, errors
+
+        X = np.array(rows, dtype=np.float32)
+        bad = np.flatnonzero(self._bad_rows(X))
+        if len(bad):
+            keep = np.ones(len(X), dtype=bool)
+            for j in bad:
+                record_errors = self.errors(humans[valid[j]])
+                if record_errors:
+                    errors[valid[j]] = ValidationError(record_errors)
+                    keep[j] = False
+            X = X[keep]
+            valid = [i for i, k in zip(valid, keep) if k]
+        return X, valid, errors
+
+    def check_matrix(self, X):
+        """Validates rows that are already encoded, e.g. sent as float32 arrays.
+
+        Rows failing the array checks are explained by the per key pass on
+        their non missing values.
+
+        Args:
+            X (numpy.ndarray): Float32 rows of shape (n, n_features).
+
+        Returns:
+            tuple: Like encode_many, the valid rows, their indices and the
+                ValidationError of each invalid row by index.
+        """
+        bad = np.flatnonzero(self._bad_rows(X) | np.isinf(X).any(axis=1))
+        if not len(bad):
+            return X, range(len(X)), {}
+        errors = {}
+        for i in bad:
+            human = {name: float(value) for name, value in zip(self.feature_names, X[i])
+                     if value == value}
+            errors[int(i)] = ValidationError(self.errors(human) or [
+                {'field': None, 'error': 'Record must be finite numbers'}])
+        keep = np.ones(len(X), dtype=bool)
+        keep[bad] = False
+        return X[keep], np.flatnonzero(keep).tolist(), errors
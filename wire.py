@@ -0,0 +1,224 @@
+# Request and response formats of the prediction endpoints besides JSON.
+#
+#     application/json                        {"query": {...}} or positional rows,
+#                                             {"query": [...]} / {"queries": [[...], ...]}
+#     application/msgpack                     The same documents in MessagePack
+#     application/vnd.apache.arrow.stream     Arrow IPC stream, one column per feature
+#     application/octet-stream                Little-endian float32 rows, n_features each
+#
+# Positional rows, Arrow columns and float32 buffers go straight into the
+# prediction matrix, without building a dict per record. Bodies can be sent
+# with `Content-Encoding: gzip` or `zstd`, and responses use the format of
+# the request. msgpack, pyarrow and zstandard (the `formats` extra) are
+# imported only when a request needs them, without them the format is
+# answered with a 415.
+import gzip
+import importlib
+import io
+import json
+import zlib
+
+import numpy as np
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+FLOAT32 = 'application/octet-stream'
+
+# Other names clients send for the same formats
+ALIASES = {
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+    'application/vnd.apache.arrow.file': ARROW,
+}
+
+# Package each format needs, in the `formats` extra of pyproject.toml
+PACKAGES = {MSGPACK: 'msgpack', ARROW: 'pyarrow'}
+
+# Formats carrying a matrix rather than documents
+MATRIX_FORMATS = (ARROW, FLOAT32)
+FORMATS = (JSON, MSGPACK) + MATRIX_FORMATS
+
+
+class UnsupportedFormat(ValueError):
+    """A content type or encoding the server doesn't read, answered with a 415."""
+
+
+def package(name, purpose):
+    """Imports an optional package, UnsupportedFormat when it isn't installed."""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise UnsupportedFormat(f"{purpose} need the {name} package, which isn't installed "
+                                "on this server (the formats extra)") from None
+
+
+def media_type(mimetype):
+    """Canonical format of a request's mimetype, JSON when none is given.
+
+    Raises:
+        UnsupportedFormat: For unknown formats, and formats whose package
+            isn't installed.
+    """
+    mimetype = ALIASES.get(mimetype, mimetype or JSON)
+    if mimetype not in FORMATS:
+        raise UnsupportedFormat(f"Unsupported content type {mimetype}, expected one of "
+                                f"{list(FORMATS)}")
+    if mimetype in PACKAGES:
+        package(PACKAGES[mimetype], f"{mimetype} bodies")
+    return mimetype
+
+
+def decompress(body, encoding, limit):
+    """Decodes a `Content-Encoding: gzip` or `zstd` body.
+
+    Args:
+        body (bytes): The body as received.
+        encoding (str): The Content-Encoding header, None or `identity` for none.
+        limit (int): Largest decompressed size, guards against compression bombs.
+
+    Raises:
+        ValueError: For corrupt bodies and bodies larger than `limit`.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return body
+    if encoding in ('gzip', 'x-gzip'):
+        try:
+            with gzip.GzipFile(fileobj=io.BytesIO(body)) as f_in:
+                data = f_in.read(limit + 1)
+        except (OSError, EOFError, zlib.error):
+            raise ValueError("Invalid gzip body") from None
+    elif encoding == 'zstd':
+        zstandard = package('zstandard', 'zstd bodies')
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(body) as f_in:
+                data = f_in.read(limit + 1)
+        except zstandard.ZstdError:
+            raise ValueError("Invalid zstd body") from None
+    else:
+        raise UnsupportedFormat(f"Unsupported content encoding {encoding}, expected gzip "
+                                "or zstd")
+    if len(data) > limit:
+        raise ValueError(f"Decompressed body is larger than {limit} bytes")
+    return data
+
+
+def load_document(body, mimetype):
+    """Parses a JSON or MessagePack body."""
+    if mimetype == MSGPACK:
+        msgpack = package('msgpack', f"{MSGPACK} bodies")
+        try:
+            return msgpack.unpackb(body)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack body: {e}") from None
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON body: {e}") from None
+
+
+def rows_matrix(rows, n_features):
+    """Positional rows in the model's feature order as a float32 matrix.
+
+    None (null) is a missing value.
+    """
+    try:
+        X = np.array(rows, dtype=np.float32)
+    except (TypeError, ValueError):
+        raise ValueError("Positional rows must be lists of numbers or null, "
+                         f"{n_features} per row") from None
+    if X.ndim == 1:
+        X = X[None, :]
+    if X.ndim != 2 or X.shape[1] != n_features:
+        raise ValueError(f"Positional rows must have {n_features} values each, in the order "
+                         "of /model/features")
+    return X
+
+
+def load_matrix(body, mimetype, feature_names):
+    """Reads an Arrow IPC stream or a float32 buffer into the prediction matrix.
+
+    Arrow columns are matched by name, features without a column are
+    missing values. float32 buffers hold whole rows in feature order.
+
+    Returns:
+        numpy.ndarray: Float32 rows of shape (n, len(feature_names)).
+    """
+    n_features = len(feature_names)
+    if mimetype == FLOAT32:
+        if len(body) % (4 * n_features):
+            raise ValueError(f"float32 bodies must hold whole rows of {n_features} values "
+                             f"({4 * n_features} bytes), got {len(body)} bytes")
+        return np.frombuffer(body, dtype='<f4').reshape(-1, n_features)
+
+    pa = package('pyarrow', f"{ARROW} bodies")
+
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid:
+        try:
+            table = pa.ipc.open_file(pa.py_buffer(body)).read_all()
+        except pa.ArrowInvalid as e:
+            raise ValueError(f"Invalid Arrow IPC body: {e}") from None
+
+    index = {name: i for i, name in enumerate(feature_names)}
+    unknown = [name for name in table.column_names if name not in index]
+    if unknown:
+        raise ValueError(f"Columns that aren't features of the model: {unknown}")
+    X = np.full((table.num_rows, n_features), np.nan, dtype=np.float32)
+    for name, column in zip(table.column_names, table.columns):
+        try:
+            X[:, index[name]] = column.to_numpy(zero_copy_only=False)
+        except (TypeError, ValueError, pa.ArrowInvalid):
+            raise ValueError(f"Column {name!r} must be numeric") from None
+    return X
+
+
+def dump(payload, mimetype):
+    """Serializes a JSON style response document as JSON or MessagePack.
+
+    Returns:
+        tuple: The body and its content type.
+    """
+    if mimetype == MSGPACK:
+        msgpack = package('msgpack', f"{MSGPACK} responses")
+        return msgpack.packb(payload, default=_plain), MSGPACK
+    return json.dumps(payload, default=_plain), JSON
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't serialize {type(value).__name__}")
+
+
+def dump_predictions(predictions, errors, mimetype):
+    """Serializes the predictions of a matrix request in its own format.
+
+    Args:
+        predictions (numpy.ndarray): One float32 per row, NaN for invalid rows.
+        errors (dict): Index of each invalid row to its error message.
+        mimetype (str): ARROW or FLOAT32.
+
+    Returns:
+        tuple: The body and its content type. float32 responses are the
+            predictions as a little-endian buffer, Arrow responses have a
+            `prediction` column and an `error` column.
+    """
+    predictions = np.asarray(predictions, dtype='<f4')
+    if mimetype == FLOAT32:
+        return predictions.tobytes(), FLOAT32
+
+    pa = package('pyarrow', f"{ARROW} responses")
+
+    messages = [None] * len(predictions)
+    for i, message in errors.items():
+        messages[i] = message
+    batch = pa.record_batch([pa.array(predictions, mask=np.isnan(predictions)),
+                             pa.array(messages, type=pa.string())],
+                            names=['prediction', 'error'])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes(), ARROW